@@ -1,7 +1,14 @@
-from .calculate_results import calculate_results
+from .calculate_results import calculate_results, calculate_results_for_multiple_seeds, iter_results
 from .config import ChantStatsConfig
 from .dendrogram import calculate_dendrogram
 from .export_results import export_results
 from .load_pieces import load_pieces
 from .logging import logger
+from .metadata_index import MetadataIndex
 from .modal_category import GroupingByModalCategory
+from .similarity_search import SimilarityIndex
+from .pattern_search import MelodicPatternIndex
+from .run_plan import RunPlan
+from .parameter_sweep import sweep_parameters
+from .instrumentation import instrumentation
+from .profiling import profiler
@@ -1,3 +1,5 @@
+import functools
+from collections import Counter
 from .analysis_type import AnalysisType
 from .freqs import (
     PCFreqs,
@@ -6,12 +8,31 @@ from .freqs import (
     L5M5inMDFreqs,
     L4M4Freqs,
     L4M4inMDFreqs,
+    PhraseEnding2Freqs,
+    PhraseEnding2inMDFreqs,
+    PhraseEnding3Freqs,
+    PhraseEnding3inMDFreqs,
+    VerticalIntervalFreqs,
+    SimpleVerticalIntervalFreqs,
     convert_pc_based_freqs_to_mode_degree_based_freqs,
 )
 from .leaps_and_melodic_outlines import L5M5, L5M5inMD, L4M4, L4M4inMD
-from .tendency import PCTendency, ModeDegreeTendency
-
-__all__ = ["get_analysis_function"]
+from .mode_degree import mode_degrees_from_note_pairs, mode_degrees_from_pc_pairs
+from .phrase_endings import PhraseEndingInMD, calculate_phrase_ending_counts, get_phrase_endings_in_mode_degrees
+from .pitch_class import PC
+from .repertoire_and_genre import RepertoireAndGenreType
+from .tendency import PCTendency, ModeDegreeTendency, PCApproaches, ModeDegreeApproaches, calculate_approach_counts
+from .unit import UnitType
+from .vertical_intervals import calculate_vertical_interval_counts
+
+__all__ = [
+    "get_analysis_function",
+    "calculate_counts_for_units",
+    "calculate_counts_for_analyses_counted_together",
+    "calculate_result_from_counts",
+    "check_analysis_for_repertoire",
+    "get_units_for_analysis",
+]
 
 
 def calculate_relative_pc_freqs(item, unit):
@@ -36,36 +57,32 @@ def calculate_tendency(item, unit, *, using="condprobs_v1"):
     return tendency.as_series(using=using)
 
 
-class ModalCategoryAsTendencyAnalysisInput:
-    def __init__(self, modal_category):
-        self.modal_category = modal_category
+def calculate_tendency_for_modal_category(modal_category, unit):
+    counts_per_item = [
+        calculate_counts_for_units(item, analysis="tendency", units=[unit]) for item in modal_category.items
+    ]
+    return calculate_tendency_for_modal_category_from_counts(counts_per_item, unit=unit)
 
-    @property
-    def pc_pairs(self):
-        for item in self.modal_category.items:
-            yield from item.pc_pairs
 
-    @property
-    def mode_degree_pairs(self):
-        for item in self.modal_category.items:
-            yield from item.mode_degree_pairs
+def calculate_tendency_for_modal_category_from_counts(counts_per_item, *, unit, analysis="tendency"):
+    """
+    Same as `calculate_tendency_for_modal_category()`, but using the pair counts of the
+    individual items (as returned by `calculate_counts_for_units()`) as input. This also
+    works for the approaches analysis, whose results are based on pair counts, too.
+    """
+    pair_counts = sum((counts[unit] for counts in counts_per_item), Counter())
+    return calculate_result_from_counts(pair_counts, analysis=analysis, unit=unit)
 
 
-def calculate_tendency_for_modal_category(modal_category, unit):
-    mc = ModalCategoryAsTendencyAnalysisInput(modal_category)
-    return calculate_tendency(mc, unit=unit)
-
-
-# def calculate_approaches(item, unit, *, using="condprobs_v1"):
-#     if unit == "pcs":
-#         tendency = PCApproaches(item)
-#     elif unit == "mode_degrees":
-#         # tendency = ModeDegreeApproaches(item)
-#         raise NotImplementedError()
-#     else:
-#         raise NotImplementedError()
-#
-#     return tendency.as_series(using=using)
+def calculate_approaches(item, unit, *, using="condprobs_v1", version="v1"):
+    if unit == "pcs":
+        approaches = PCApproaches(item, version=version)
+    elif unit == "mode_degrees":
+        approaches = ModeDegreeApproaches(item, version=version)
+    else:
+        raise NotImplementedError()
+
+    return approaches.as_series(using=using)
 
 
 def calculate_leap_occurrences(item, *, unit, interval_name, cls_pcs, cls_mds):
@@ -136,6 +153,262 @@ def calculate_relative_L5M5_freqs(item, *, unit):
     return freqs.rel_freqs
 
 
+def calculate_relative_phrase_ending_freqs(item, *, unit, length):
+    if unit == "pcs":
+        freqs = COUNTED_CLASSES[PHRASE_ENDING_ANALYSES[length]][unit].from_counts(
+            calculate_phrase_ending_counts(item, lengths=[length])[length]
+        )
+    elif unit == "mode_degrees":
+        freqs = COUNTED_CLASSES[PHRASE_ENDING_ANALYSES[length]][unit](
+            get_phrase_endings_in_mode_degrees(item, length=length)
+        )
+    else:
+        raise NotImplementedError()
+
+    return freqs.rel_freqs
+
+
+def calculate_relative_vertical_interval_freqs(item, *, unit, simple=False):
+    # Vertical intervals don't depend on the final, so the results are the same for both units.
+    if unit not in ["pcs", "mode_degrees"]:
+        raise NotImplementedError()
+    cls = SimpleVerticalIntervalFreqs if simple else VerticalIntervalFreqs
+    freqs = cls.from_counts(calculate_vertical_interval_counts(item, simple=simple))
+
+    return freqs.rel_freqs
+
+
+#
+# The functions below split each analysis into two steps: counting the occurrences of
+# the relevant entities (pitch classes, pairs of pitch classes, leaps and melodic outlines,
+# phrase endings, vertical intervals) in each item, and calculating the final result from these counts. For
+# unit="mode_degrees" the counts are derived from the PC-based counts by relabelling them
+# using the final of the item, which avoids walking through all the notes a second time
+# when results for both units are needed.
+#
+
+COUNTED_CLASSES = {
+    AnalysisType.PC_FREQS: {UnitType.PCS: PCFreqs, UnitType.MODE_DEGREES: ModeDegreeFreqs},
+    AnalysisType.TENDENCY: {UnitType.PCS: PCTendency, UnitType.MODE_DEGREES: ModeDegreeTendency},
+    AnalysisType.LEAPS_AND_MELODIC_OUTLINES_L5M5: {UnitType.PCS: L5M5Freqs, UnitType.MODE_DEGREES: L5M5inMDFreqs},
+    AnalysisType.LEAPS_AND_MELODIC_OUTLINES_L4M4: {UnitType.PCS: L4M4Freqs, UnitType.MODE_DEGREES: L4M4inMDFreqs},
+    AnalysisType.PHRASE_ENDINGS_2: {UnitType.PCS: PhraseEnding2Freqs, UnitType.MODE_DEGREES: PhraseEnding2inMDFreqs},
+    AnalysisType.PHRASE_ENDINGS_3: {UnitType.PCS: PhraseEnding3Freqs, UnitType.MODE_DEGREES: PhraseEnding3inMDFreqs},
+    AnalysisType.APPROACHES: {UnitType.PCS: PCApproaches, UnitType.MODE_DEGREES: ModeDegreeApproaches},
+    AnalysisType.APPROACHES_V2: {UnitType.PCS: PCApproaches, UnitType.MODE_DEGREES: ModeDegreeApproaches},
+    AnalysisType.VERTICAL_INTERVALS: {
+        UnitType.PCS: VerticalIntervalFreqs,
+        UnitType.MODE_DEGREES: VerticalIntervalFreqs,
+    },
+    AnalysisType.VERTICAL_SIMPLE_INTERVALS: {
+        UnitType.PCS: SimpleVerticalIntervalFreqs,
+        UnitType.MODE_DEGREES: SimpleVerticalIntervalFreqs,
+    },
+}
+
+# Analyses whose results are conditional probabilities calculated from pair counts (rather than
+# frequency distributions), and which are therefore not clustered but combined per modal category.
+PAIR_COUNT_ANALYSES = [AnalysisType.TENDENCY, AnalysisType.APPROACHES, AnalysisType.APPROACHES_V2]
+
+# Approaches analyses, mapped to the version of the thresholds used to classify the intervals
+# as common tones, steps or leaps (see `classify_intervals()`).
+APPROACH_ANALYSES = {AnalysisType.APPROACHES: "v1", AnalysisType.APPROACHES_V2: "v2"}
+
+PHRASE_ENDING_ANALYSES = {
+    analysis.phrase_ending_length: analysis for analysis in AnalysisType if analysis.phrase_ending_length is not None
+}
+
+# Analyses of the vertical intervals between duplum and tenor (only defined for organum), mapped to
+# whether they count octave-reduced simple intervals rather than intervals in semitones.
+VERTICAL_INTERVAL_ANALYSES = {AnalysisType.VERTICAL_INTERVALS: False, AnalysisType.VERTICAL_SIMPLE_INTERVALS: True}
+
+
+def check_analysis_for_repertoire(analysis, repertoire_and_genre):
+    """
+    Raise a ValueError if the given analysis is not defined for the given repertoire
+    (so that this is detected before loading any pieces or extracting any inputs).
+    """
+    analysis = AnalysisType(analysis)
+    repertoire_and_genre = RepertoireAndGenreType(repertoire_and_genre)
+    if analysis in VERTICAL_INTERVAL_ANALYSES and repertoire_and_genre not in [
+        RepertoireAndGenreType.ORGANUM_PIECES,
+        RepertoireAndGenreType.ORGANUM_PHRASES,
+    ]:
+        raise ValueError(
+            f"Analysis '{analysis.value}' is only defined for organum, not for {repertoire_and_genre.value}."
+        )
+
+
+def get_units_for_analysis(analysis, units):
+    """
+    Return those of the given units for which results are calculated for the given analysis.
+
+    The vertical intervals don't depend on the final, so their results would be the same for
+    both units. They are therefore only calculated for unit="pcs" (and a ValueError is raised
+    if this isn't among the given units).
+    """
+    analysis = AnalysisType(analysis)
+    units = [UnitType(unit) for unit in units]
+    if analysis in VERTICAL_INTERVAL_ANALYSES:
+        if UnitType.PCS not in units:
+            raise ValueError(f"Results for analysis '{analysis.value}' are only calculated for unit='pcs'.")
+        return [UnitType.PCS]
+    return units
+
+
+def calculate_pc_based_counts(item, *, analysis):
+    """
+    Return a Counter containing the number of occurrences of each PC-based
+    entity which is relevant for the given analysis.
+    """
+    analysis = AnalysisType(analysis)
+
+    if analysis == "pc_freqs":
+        return Counter(item.pitch_classes)
+    elif analysis == "tendency":
+        return Counter(item.pc_pairs)
+    elif analysis in APPROACH_ANALYSES:
+        return calculate_approach_counts(item, version=APPROACH_ANALYSES[analysis])
+    elif analysis == "L_and_M__L5_u_M5":
+        return Counter(calculate_L5_occurrences(item, unit="pcs") + calculate_M5_occurrences(item, unit="pcs"))
+    elif analysis == "L_and_M__L4_u_M4":
+        return Counter(calculate_L4_occurrences(item, unit="pcs") + calculate_M4_occurrences(item, unit="pcs"))
+    elif analysis.phrase_ending_length is not None:
+        length = analysis.phrase_ending_length
+        return calculate_phrase_ending_counts(item, lengths=[length])[length]
+    elif analysis in VERTICAL_INTERVAL_ANALYSES:
+        return calculate_vertical_interval_counts(item, simple=VERTICAL_INTERVAL_ANALYSES[analysis])
+    else:
+        raise NotImplementedError()
+
+
+def convert_pc_based_counts_to_mode_degree_based_counts(pc_based_counts, *, analysis, item):
+    """
+    Convert the output of `calculate_pc_based_counts()` into the counts which are obtained
+    for unit="mode_degrees" (relative to the final of the given item).
+
+    This uses exactly the same conversion from pitch classes to mode degrees as the
+    mode degrees calculated for each item: `ModeDegree.from_note_pair()` for the
+    pitch class frequencies and tendency, and `ModeDegree.from_pc_pair()` for
+    leaps and melodic outlines.
+    """
+    analysis = AnalysisType(analysis)
+    md_based_counts = Counter()
+
+    if analysis == "pc_freqs":
+        base_pc = PC.from_note(item.note_of_final)
+        for pc, count in pc_based_counts.items():
+            md_based_counts[mode_degrees_from_note_pairs[pc, base_pc]] += count
+    elif analysis == "tendency":
+        base_pc = PC.from_note(item.note_of_final)
+        for (pc1, pc2), count in pc_based_counts.items():
+            md1 = mode_degrees_from_note_pairs[pc1, base_pc]
+            md2 = mode_degrees_from_note_pairs[pc2, base_pc]
+            md_based_counts[md1, md2] += count
+    elif analysis in APPROACH_ANALYSES:
+        base_pc = PC.from_note(item.note_of_final)
+        for (pc2, interval_type), count in pc_based_counts.items():
+            md_based_counts[mode_degrees_from_note_pairs[pc2, base_pc], interval_type] += count
+    elif analysis in ["L_and_M__L5_u_M5", "L_and_M__L4_u_M4"]:
+        base_pc = PC(item.final)
+        cls_mds = L5M5inMD if analysis == "L_and_M__L5_u_M5" else L4M4inMD
+        for occurrence, count in pc_based_counts.items():
+            bottom_md = mode_degrees_from_pc_pairs[occurrence.bottom_pc, base_pc]
+            top_md = mode_degrees_from_pc_pairs[occurrence.top_pc, base_pc]
+            md_based_counts[cls_mds(bottom_md=bottom_md, top_md=top_md, base_pc=item.final)] += count
+    elif analysis.phrase_ending_length is not None:
+        base_pc = PC.from_note(item.note_of_final)
+        for phrase_ending, count in pc_based_counts.items():
+            mds = [mode_degrees_from_note_pairs[pc, base_pc] for pc in phrase_ending.pcs]
+            md_based_counts[PhraseEndingInMD(mds)] += count
+    elif analysis in VERTICAL_INTERVAL_ANALYSES:
+        md_based_counts.update(pc_based_counts)  # vertical intervals don't depend on the final
+    else:
+        raise NotImplementedError()
+
+    return md_based_counts
+
+
+def calculate_counts_for_units(item, *, analysis, units):
+    """
+    Calculate the counts needed for the given analysis for each of the given units.
+    The PC-based counts are only calculated once; the mode-degree-based counts are
+    derived from them.
+
+    Returns
+    -------
+    dict
+        Dictionary of the form {unit: Counter}.
+    """
+    pc_based_counts = calculate_pc_based_counts(item, analysis=analysis)
+    return _convert_pc_based_counts_to_units(pc_based_counts, analysis=analysis, units=units, item=item)
+
+
+def _convert_pc_based_counts_to_units(pc_based_counts, *, analysis, units, item):
+    counts = {}
+    for unit in [UnitType(unit) for unit in units]:
+        if unit == "pcs":
+            counts[unit] = pc_based_counts
+        elif unit == "mode_degrees":
+            counts[unit] = convert_pc_based_counts_to_mode_degree_based_counts(
+                pc_based_counts, analysis=analysis, item=item
+            )
+        else:
+            raise NotImplementedError()
+    return counts
+
+
+def get_analyses_counted_together(analysis):
+    """
+    Return the analyses whose counts are calculated in a single pass over an item together
+    with those of the given analysis (this is the case for the phrase endings of all lengths,
+    which are read off the same suffix table). The given analysis is always included.
+    """
+    analysis = AnalysisType(analysis)
+    if analysis.phrase_ending_length is not None:
+        return list(PHRASE_ENDING_ANALYSES.values())
+    return [analysis]
+
+
+def calculate_counts_for_analyses_counted_together(item, *, analysis, units):
+    """
+    Same as `calculate_counts_for_units()`, but returns the counts for all analyses
+    returned by `get_analyses_counted_together()` at once (at no extra cost compared to
+    counting only those for the given analysis).
+
+    Returns
+    -------
+    dict
+        Dictionary of the form {analysis: {unit: Counter}}.
+    """
+    analysis = AnalysisType(analysis)
+    if analysis.phrase_ending_length is None:
+        return {analysis: calculate_counts_for_units(item, analysis=analysis, units=units)}
+
+    pc_based_counts_by_length = calculate_phrase_ending_counts(item, lengths=PHRASE_ENDING_ANALYSES)
+    return {
+        other_analysis: _convert_pc_based_counts_to_units(
+            pc_based_counts_by_length[length], analysis=other_analysis, units=units, item=item
+        )
+        for length, other_analysis in PHRASE_ENDING_ANALYSES.items()
+    }
+
+
+def calculate_result_from_counts(counts, *, analysis, unit):
+    """
+    Calculate the result of the given analysis from the counts returned
+    by `calculate_counts_for_units()`. This returns the same result as the
+    corresponding analysis function (see `get_analysis_function()`).
+    """
+    analysis = AnalysisType(analysis)
+    cls = COUNTED_CLASSES[analysis][UnitType(unit)]
+
+    if analysis in PAIR_COUNT_ANALYSES:
+        return cls.from_pair_counts(counts).as_series(using="condprobs_v1")
+    else:
+        return cls.from_counts(counts).rel_freqs
+
+
 def get_analysis_function(analysis):
     analysis = AnalysisType(analysis)
 
@@ -143,11 +416,17 @@ def get_analysis_function(analysis):
         return calculate_relative_pc_freqs
     elif analysis == "tendency":
         return calculate_tendency
-    # elif analysis == "approaches":
-    #     return calculate_approaches
+    elif analysis in APPROACH_ANALYSES:
+        return functools.partial(calculate_approaches, version=APPROACH_ANALYSES[analysis])
     elif analysis == "L_and_M__L5_u_M5":
         return calculate_relative_L5M5_freqs
     elif analysis == "L_and_M__L4_u_M4":
         return calculate_relative_L4M4_freqs
+    elif analysis.phrase_ending_length is not None:
+        return functools.partial(calculate_relative_phrase_ending_freqs, length=analysis.phrase_ending_length)
+    elif analysis in VERTICAL_INTERVAL_ANALYSES:
+        return functools.partial(
+            calculate_relative_vertical_interval_freqs, simple=VERTICAL_INTERVAL_ANALYSES[analysis]
+        )
     else:
         raise NotImplementedError()
@@ -6,7 +6,6 @@ __all__ = ["AnalysisType"]
 class AnalysisType(str, Enum):
     PC_FREQS = ("pc_freqs", "Mode profiles", "MP", "Analysis 1 Mode Profiles: ", ("1_mode_profiles", ""))
     TENDENCY = ("tendency", "Tendency", "T", "Analysis 2 Tendency: ", ("2_tendency", ""))
-    # APPROACHES = ("approaches", "Leaps and Melodic Outlines", "L+M", "Analysis 3 L&M: ")
     LEAPS_AND_MELODIC_OUTLINES_L5M5 = (
         "L_and_M__L5_u_M5",
         "Leaps and Melodic Outlines (L5 & M5)",
@@ -21,6 +20,42 @@ class AnalysisType(str, Enum):
         "Analysis 3 L&M: L4 ∪ M4: ",
         ("3_L_and_M", "L4_u_M4"),
     )
+    PHRASE_ENDINGS_2 = (
+        "phrase_endings__last_2_notes",
+        "Phrase endings (last 2 notes)",
+        "PE",
+        "Analysis 4 Phrase endings: last 2 notes: ",
+        ("4_phrase_endings", "last_2_notes"),
+    )
+    PHRASE_ENDINGS_3 = (
+        "phrase_endings__last_3_notes",
+        "Phrase endings (last 3 notes)",
+        "PE",
+        "Analysis 4 Phrase endings: last 3 notes: ",
+        ("4_phrase_endings", "last_3_notes"),
+    )
+    APPROACHES = ("approaches", "Approaches", "A", "Analysis 5 Approaches: ", ("5_approaches", ""))
+    APPROACHES_V2 = (
+        "approaches__interval_types_v2",
+        "Approaches (interval types v2)",
+        "A",
+        "Analysis 5 Approaches: interval types v2: ",
+        ("5_approaches", "interval_types_v2"),
+    )
+    VERTICAL_INTERVALS = (
+        "vertical_intervals__semitones",
+        "Vertical intervals (semitones)",
+        "VI",
+        "Analysis 6 Vertical intervals: semitones: ",
+        ("6_vertical_intervals", "semitones"),
+    )
+    VERTICAL_SIMPLE_INTERVALS = (
+        "vertical_intervals__simple_intervals",
+        "Vertical intervals (simple intervals)",
+        "VI",
+        "Analysis 6 Vertical intervals: simple intervals: ",
+        ("6_vertical_intervals", "simple_intervals"),
+    )
 
     def __new__(cls, value, desc, desc_short, plot_title_descr, output_path_stubs, **kwargs):
         obj = str.__new__(cls, value)
@@ -51,3 +86,16 @@ class AnalysisType(str, Enum):
     @property
     def output_path_stub_2(self):
         return self._output_path_stub_2
+
+    @property
+    def phrase_ending_length(self):
+        """
+        Number of notes in the phrase endings counted by this analysis (or None if
+        this is not a phrase ending analysis).
+        """
+        if self == "phrase_endings__last_2_notes":
+            return 2
+        elif self == "phrase_endings__last_3_notes":
+            return 3
+        else:
+            return None
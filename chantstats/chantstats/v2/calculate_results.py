@@ -1,17 +1,39 @@
+import contextlib
+import functools
+import itertools
+import os
 from .analysis_type import AnalysisType
-from .analysis_functions import calculate_tendency_for_modal_category
-from .dendrogram import calculate_dendrogram
+from .analysis_functions import (
+    PAIR_COUNT_ANALYSES,
+    calculate_counts_for_analyses_counted_together,
+    calculate_tendency_for_modal_category_from_counts,
+    check_analysis_for_repertoire,
+    get_units_for_analysis,
+)
+from .dendrogram import calculate_dendrogram_from_dataframe
+from .dendrogram.distance_metrics import DEFAULT_METRIC, DEFAULT_LINKAGE_METHOD, check_metric_and_method
+from .instrumentation import increment, tagged, timed
+from .item_cache import ItemCache, default_item_cache, lookup_counts, put_counts
 from .logging import logger
 from .modal_category import ModalCategoryType, GroupingByModalCategory
 from .old_code.organum_piece import OrganumPieces, OrganumPhrases
+from .parallel import SharedInputsPool, submit_and_yield_in_order
+from .profiling import is_profiling_requested_by_env, profiled, profiler
 from .plainchant_sequence_piece import PlainchantSequencePieces
 from .responsorial_chants import ResponsorialChantPieces
 from .repertoire_and_genre import RepertoireAndGenreType
 from .result_descriptor import ResultDescriptor
 from .unit import UnitType
-from .utils import get_subsample
+from .subsampling import Subsampler
 
-__all__ = ["calculate_results"]
+__all__ = [
+    "calculate_results",
+    "iter_results",
+    "calculate_results_for_multiple_seeds",
+    "calculate_results_for_modal_category",
+    "iter_results_for_modal_categories",
+    "get_modal_categories",
+]
 
 
 class PathStubs(tuple):
@@ -41,24 +63,131 @@ class PathStubs(tuple):
         return obj
 
 
-def calculate_results(
+def calculate_results_for_modal_category(
+    modal_category,
     *,
-    pieces,
     analysis,
-    sampling_fraction,
-    sampling_seed,
-    min_num_phrases_per_monomodal_section=3,
-    min_num_notes_per_monomodal_section=80,
-    min_num_notes_per_organum_phrase=12,
-    modes=None,
-    units=None,
-    modal_category_keys=None,
+    units,
+    counts_per_item=None,
+    metric=DEFAULT_METRIC,
+    method=DEFAULT_LINKAGE_METHOD,
+    leaf_ordering="auto",
+    num_bootstrap_replicates=0,
+    bootstrap_scales=(1.0,),
+    bootstrap_seed=None,
+    bootstrap_workers=None,
 ):
-    assert isinstance(pieces, (PlainchantSequencePieces, ResponsorialChantPieces, OrganumPieces, OrganumPhrases))
-    modes = modes or list(ModalCategoryType)
-    units = units or list(UnitType)
+    """
+    Calculate the results for a single modal category and all given units.
+    The dendrograms are calculated using the given distance metric, linkage
+    method and leaf ordering, and the bootstrap support of their clusters is
+    calculated if `num_bootstrap_replicates` is greater than zero (using
+    `bootstrap_workers` worker processes; see `calculate_dendrogram()`).
+
+    The features of each item (e.g. its pitch class counts) are only extracted
+    once; the mode-degree-based features are derived from the PC-based ones.
+    If `counts_per_item` is given (as returned by `ModalCategory.calculate_counts_for_units()`)
+    then these counts are used instead.
+
+    Returns
+    -------
+    dict
+        Dictionary of the form {unit: result}, where each result is a dictionary of
+        the form {'dendrogram': <dendrogram>} or {'tendency_distribution': <distribution>}.
+    """
+    units = [UnitType(unit) for unit in units]
+    if counts_per_item is None:
+        counts_per_item = modal_category.calculate_counts_for_units(analysis=analysis, units=units)
+
+    if analysis in PAIR_COUNT_ANALYSES:
+        return {
+            unit: {
+                "tendency_distribution": calculate_tendency_for_modal_category_from_counts(
+                    counts_per_item, unit=unit, analysis=analysis
+                )
+            }
+            for unit in units
+        }
+    else:
+        dfs = modal_category.make_results_dataframes(analysis=analysis, units=units, counts_per_item=counts_per_item)
+        results = {}
+        for unit in units:
+            dendrogram = calculate_dendrogram_from_dataframe(
+                dfs[unit], analysis=analysis, metric=metric, method=method, leaf_ordering=leaf_ordering
+            )
+            if num_bootstrap_replicates > 0:
+                df_counts = modal_category.make_counts_dataframe(
+                    analysis=analysis, unit=unit, counts_per_item=counts_per_item
+                )
+                dendrogram.calculate_bootstrap_support(
+                    df_counts,
+                    num_replicates=num_bootstrap_replicates,
+                    scales=bootstrap_scales,
+                    seed=bootstrap_seed,
+                    workers=bootstrap_workers,
+                )
+            results[unit] = {"dendrogram": dendrogram}
+        return results
+
+
+def _calculate_results_for_cell(
+    modal_category, cached_counts_per_item, *, repertoire_and_genre, analysis, units, metric, method, **kwargs
+):
+    # Calculate the results for all units of a single modal category (a "cell"). All units are
+    # calculated together so that the features of each item only need to be extracted once.
+    # `cached_counts_per_item` contains the cached counts for each item (or None if not cached).
+    # Any other keyword arguments are passed on to `calculate_results_for_modal_category()`.
+    logger.info(f"Calculating {analysis} results for {modal_category} (units: {', '.join(units)})")
+
+    # Count any items which were not found in the cache. The new counts are returned
+    # alongside the results so that the caller can add them to the cache (this function
+    # may run in a worker process, which doesn't have access to the caller's cache).
+    with timed("feature_extraction"):
+        new_counts = {
+            idx: calculate_counts_for_analyses_counted_together(item, analysis=analysis, units=units)
+            for idx, (item, counts) in enumerate(zip(modal_category.items, cached_counts_per_item))
+            if counts is None
+        }
+    counts_per_item = [
+        new_counts[idx][analysis] if counts is None else counts for idx, counts in enumerate(cached_counts_per_item)
+    ]
 
     results = {}
+    for unit in units:
+        # The counts are shared between units, so calculating each unit separately doesn't cost anything
+        # extra, and it allows attributing the instrumentation timings to the individual results.
+        result_descriptor = ResultDescriptor(
+            repertoire_and_genre, analysis, unit, modal_category, metric=metric, method=method
+        )
+        with tagged(result_descriptor), timed("calculation"), profiled("calculation", result_descriptor):
+            results[unit] = calculate_results_for_modal_category(
+                modal_category,
+                analysis=analysis,
+                units=[unit],
+                counts_per_item=counts_per_item,
+                metric=metric,
+                method=method,
+                **kwargs,
+            )[unit]
+    return results, new_counts
+
+
+def _get_subsamplers(
+    pieces,
+    *,
+    analysis,
+    modes,
+    min_num_phrases_per_monomodal_section,
+    min_num_notes_per_monomodal_section,
+    min_num_notes_per_organum_phrase,
+    metadata_index=None,
+):
+    """
+    Return a list of pairs `(mode, subsampler)`, where each subsampler draws
+    sub-samples from the analysis inputs for the corresponding mode.
+    """
+    assert isinstance(pieces, (PlainchantSequencePieces, ResponsorialChantPieces, OrganumPieces, OrganumPhrases))
+    subsamplers = []
     for mode in modes:
         if analysis == "tendency" and mode != "final":
             # Tendency results are only needed for mode="final"
@@ -69,21 +198,420 @@ def calculate_results(
             min_num_phrases_per_monomodal_section=min_num_phrases_per_monomodal_section,
             min_num_notes_per_monomodal_section=min_num_notes_per_monomodal_section,
             min_num_notes_per_organum_phrase=min_num_notes_per_organum_phrase,
+            metadata_index=metadata_index,
         )
-        analysis_inputs_subsample = get_subsample(analysis_inputs, sampling_fraction, seed=sampling_seed)
+        subsamplers.append((mode, Subsampler(analysis_inputs)))
+    return subsamplers
+
+
+def get_modal_categories(subsamplers, *, sampling_fraction, sampling_seed, modal_category_keys=None):
+    """
+    Draw a sub-sample of the analysis inputs from each of the given subsamplers and
+    group it by modal category.
 
+    Parameters
+    ----------
+    subsamplers : list
+        List of pairs `(mode, subsampler)` (see `Subsampler`).
+    modal_category_keys : list, optional
+        Keys of the modal categories to return. By default, all modal categories are returned.
+
+    Returns
+    -------
+    list
+        The modal categories for all subsamplers (in the same order).
+    """
+    modal_categories = []
+    for mode, subsampler in subsamplers:
+        analysis_inputs_subsample = subsampler.get_subsample(sampling_fraction, sampling_seed)
         grouping = GroupingByModalCategory(analysis_inputs_subsample, group_by=mode)
         keys = modal_category_keys or grouping.keys
-        for key in keys:
-            modal_category = grouping[key]
-            logger.info(f"Calculating {analysis} results for {modal_category}")
-            for unit in units:
-                result_descriptor = ResultDescriptor(pieces.repertoire_and_genre, analysis, unit, modal_category)
-                if analysis == "tendency":
-                    distribution = calculate_tendency_for_modal_category(modal_category, unit=unit)
-                    results[result_descriptor] = {"tendency_distribution": distribution}
-                else:
-                    dendrogram = calculate_dendrogram(modal_category, analysis=analysis, unit=unit)
-                    results[result_descriptor] = {"dendrogram": dendrogram}
+        modal_categories.extend(grouping[key] for key in keys)
+    return modal_categories
+
+
+def iter_results_for_modal_categories(
+    modal_categories,
+    *,
+    repertoire_and_genre,
+    analysis,
+    units,
+    counts_per_modal_category=None,
+    workers=None,
+    executor=None,
+    cache=default_item_cache,
+    metric=DEFAULT_METRIC,
+    method=DEFAULT_LINKAGE_METHOD,
+    leaf_ordering="auto",
+    num_bootstrap_replicates=0,
+    bootstrap_scales=(1.0,),
+    bootstrap_seed=None,
+):
+    """
+    Return a generator which yields the results for the given modal categories as
+    pairs `(result_descriptor, result)`. Note that this is not a generator function
+    itself: if `workers` is greater than 1 then the process pool is created right
+    away (in the calling thread) rather than when the results are first requested.
+
+    If `counts_per_modal_category` is given (a list containing the counts of the items in
+    each modal category, as returned by `get_counts_for_items()`), these counts are used
+    instead of looking them up in the cache (or counting them). See `calculate_results()`
+    for a description of the other arguments.
+    """
+    check_metric_and_method(metric, method)
+    analysis = AnalysisType(analysis)
+    if analysis in PAIR_COUNT_ANALYSES:
+        # These results don't involve any clustering, so there is nothing to record in the output paths.
+        metric, method = DEFAULT_METRIC, DEFAULT_LINKAGE_METHOD
+
+    units = [UnitType(unit) for unit in units]
+    is_serial = executor is None and (workers is None or workers <= 1 or len(modal_categories) <= 1)
+    calculate = functools.partial(
+        _calculate_results_for_cell,
+        repertoire_and_genre=repertoire_and_genre,
+        analysis=analysis,
+        units=units,
+        metric=metric,
+        method=method,
+        leaf_ordering=leaf_ordering,
+        num_bootstrap_replicates=num_bootstrap_replicates,
+        bootstrap_scales=bootstrap_scales,
+        bootstrap_seed=bootstrap_seed,
+        # If the modal categories are calculated serially, the bootstrap replicates can use the workers instead.
+        bootstrap_workers=workers if is_serial else None,
+    )
+
+    def lookup_cached_counts(idx):
+        # The cache is consulted just before each modal category is submitted (rather than counting
+        # all items up front), so that the first results are available as soon as possible, while
+        # any items counted for previous modal categories (e.g. for other modes) are reused.
+        if counts_per_modal_category is not None:
+            return counts_per_modal_category[idx]
+        return [
+            lookup_counts(item, analysis=analysis, units=units, cache=cache) for item in modal_categories[idx].items
+        ]
+
+    pool = None
+    if is_serial:
+        cell_results = (calculate(mc, lookup_cached_counts(idx)) for idx, mc in enumerate(modal_categories))
+    elif executor is not None:
+        submit = lambda idx: executor.submit(calculate, modal_categories[idx], lookup_cached_counts(idx))
+        cell_results = submit_and_yield_in_order(submit, len(modal_categories), max_pending=None)
+    else:
+        # Fork the worker processes now (in the calling thread), before the caller has a chance
+        # to consume the results in a different thread (see `export_results()`). The modal
+        # categories are shared with the workers; only the cached counts are pickled.
+        pool = SharedInputsPool(modal_categories, workers=workers)
+        submit = lambda idx: pool.submit(calculate, idx, lookup_cached_counts(idx))
+        # Limit the number of results which are calculated ahead of the caller (to bound memory
+        # usage). Items which occur in several modal categories that are calculated at the same
+        # time may be counted more than once, but the cache is still updated with their counts.
+        cell_results = submit_and_yield_in_order(submit, len(modal_categories), max_pending=2 * workers)
+
+    def generate_results():
+        try:
+            for modal_category, (results_per_unit, new_counts) in zip(modal_categories, cell_results):
+                for idx, counts_by_analysis in new_counts.items():
+                    put_counts(modal_category.items[idx], counts_by_analysis, units=units, cache=cache)
+                increment("items_counted", len(new_counts))
+                increment("items_served_from_cache", len(modal_category.items) - len(new_counts))
+                for unit in units:
+                    result_descriptor = ResultDescriptor(
+                        repertoire_and_genre, analysis, unit, modal_category, metric=metric, method=method
+                    )
+                    yield result_descriptor, results_per_unit[unit]
+            if cache is not None:
+                cache.log_stats()
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    return generate_results()
+
+
+def _get_profiles_dir(profile):
+    if profile is None:
+        profile = is_profiling_requested_by_env() and not profiler.enabled
+    if profile is True:
+        return os.path.abspath("profiles")
+    return profile or None
+
+
+def _iter_in_profiler_session(results, profiles_dir):
+    if profiler.enabled:
+        # The results are consumed within another profiling session (e.g. by `export_results()`).
+        yield from results
+        return
+    with profiler.session(profiles_dir):
+        yield from results
+
+
+def iter_results(
+    *,
+    pieces,
+    analysis,
+    sampling_fraction,
+    sampling_seed,
+    min_num_phrases_per_monomodal_section=3,
+    min_num_notes_per_monomodal_section=80,
+    min_num_notes_per_organum_phrase=12,
+    modes=None,
+    units=None,
+    modal_category_keys=None,
+    workers=None,
+    executor=None,
+    cache=default_item_cache,
+    metadata_index=None,
+    metric=DEFAULT_METRIC,
+    method=DEFAULT_LINKAGE_METHOD,
+    leaf_ordering="auto",
+    num_bootstrap_replicates=0,
+    bootstrap_scales=(1.0,),
+    bootstrap_seed=None,
+    profile=None,
+):
+    """
+    Calculate analysis results for all modal categories and units and yield
+    them one by one as pairs `(result_descriptor, result)`.
+
+    Each result is yielded as soon as it has been calculated, so the caller
+    can process (e.g. export) it while the remaining results are still being
+    calculated. See `calculate_results()` for a description of the arguments.
+    The results are always yielded in the same (deterministic) order.
 
+    The analysis inputs are prepared (and, if `workers` is greater than 1, the
+    worker processes are started) when this function is called, so it is safe
+    to consume the returned iterator in a different thread. If profiling is
+    enabled (see `calculate_results()`), the profiles cover the calculation of
+    the results while iterating over them and are written at the end.
+    """
+    profiles_dir = _get_profiles_dir(profile)
+    modes = modes or list(ModalCategoryType)
+    check_analysis_for_repertoire(analysis, pieces.repertoire_and_genre)
+    units = get_units_for_analysis(analysis, units or list(UnitType))
+
+    subsamplers = _get_subsamplers(
+        pieces,
+        analysis=analysis,
+        modes=modes,
+        min_num_phrases_per_monomodal_section=min_num_phrases_per_monomodal_section,
+        min_num_notes_per_monomodal_section=min_num_notes_per_monomodal_section,
+        min_num_notes_per_organum_phrase=min_num_notes_per_organum_phrase,
+        metadata_index=metadata_index,
+    )
+    modal_categories = get_modal_categories(
+        subsamplers,
+        sampling_fraction=sampling_fraction,
+        sampling_seed=sampling_seed,
+        modal_category_keys=modal_category_keys,
+    )
+    results = iter_results_for_modal_categories(
+        modal_categories,
+        repertoire_and_genre=pieces.repertoire_and_genre,
+        analysis=analysis,
+        units=units,
+        workers=workers,
+        executor=executor,
+        cache=cache,
+        metric=metric,
+        method=method,
+        leaf_ordering=leaf_ordering,
+        num_bootstrap_replicates=num_bootstrap_replicates,
+        bootstrap_scales=bootstrap_scales,
+        bootstrap_seed=bootstrap_seed,
+    )
+    if profiles_dir is not None:
+        results = _iter_in_profiler_session(results, profiles_dir)
     return results
+
+
+def calculate_results(
+    *,
+    pieces,
+    analysis,
+    sampling_fraction,
+    sampling_seed,
+    min_num_phrases_per_monomodal_section=3,
+    min_num_notes_per_monomodal_section=80,
+    min_num_notes_per_organum_phrase=12,
+    modes=None,
+    units=None,
+    modal_category_keys=None,
+    workers=None,
+    executor=None,
+    cache=default_item_cache,
+    metadata_index=None,
+    metric=DEFAULT_METRIC,
+    method=DEFAULT_LINKAGE_METHOD,
+    leaf_ordering="auto",
+    num_bootstrap_replicates=0,
+    bootstrap_scales=(1.0,),
+    bootstrap_seed=None,
+    profile=None,
+):
+    """
+    Calculate analysis results for all modal categories and units.
+
+    The results for each combination of modal category and unit are independent
+    of each other, so they can optionally be calculated in parallel (see the
+    arguments `workers` and `executor`). The returned dictionary is the same
+    (and has the same order) regardless of whether the calculation runs in
+    parallel or not.
+
+    Parameters
+    ----------
+    workers : int, optional
+        Number of worker processes to use. If this is None or 1 (the default),
+        all results are calculated serially. Worker processes are forked from
+        the current process, so they share the analysis inputs without pickling
+        them.
+    executor : concurrent.futures.Executor, optional
+        Executor to which the calculations are submitted instead (for example
+        a ThreadPoolExecutor, or a custom process pool). If a process-based
+        executor is used here then the analysis inputs must be picklable.
+    cache : ItemCache, optional
+        Cache for the per-item counts from which the results are calculated. By
+        default, a module-level cache is used so that each item is only processed
+        once across modes and across repeated calls. Pass `cache=None` to disable
+        caching.
+    metadata_index : MetadataIndex, optional
+        If given, the analysis inputs are not extracted from any pieces which the
+        index knows don't contain any inputs satisfying the filters (see
+        `MetadataIndex.get_qualifying_filenames()`). This doesn't change the results.
+    metric : str
+        Distance metric used for the dendrograms (one of the keys of `DISTANCE_METRICS`).
+        If this or `method` is not the default, it is recorded in the output paths of
+        the result descriptors so that results for different metrics can be exported
+        side by side.
+    method : str
+        Linkage method used for the dendrograms (one of `LINKAGE_METHODS`).
+    leaf_ordering : str
+        Leaf ordering of the dendrograms (see `order_leaves()` in `leaf_ordering.py`).
+    num_bootstrap_replicates : int
+        If this is greater than zero, the bootstrap support of the clusters in each
+        dendrogram is calculated from this many replicates, for each scale in
+        `bootstrap_scales` and using `bootstrap_seed` (see `calculate_dendrogram()`).
+    profile : bool or str, optional
+        If True, record a separate profile for each pipeline stage and each result and write
+        them to the folder `profiles` underneath the current directory (or to the given folder
+        if this is a string; see `Profiler`). If None (the default), profiling is enabled if
+        the environment variable CHANTSTATS_PROFILE is set. Note that results calculated in
+        worker processes (if `workers` is greater than 1) are not profiled.
+
+    Returns
+    -------
+    dict
+        Dictionary of the form {ResultDescriptor: result}.
+    """
+    profiles_dir = _get_profiles_dir(profile)
+    with profiler.session(profiles_dir) if profiles_dir is not None else contextlib.nullcontext():
+        return dict(
+            iter_results(
+                pieces=pieces,
+                analysis=analysis,
+                sampling_fraction=sampling_fraction,
+                sampling_seed=sampling_seed,
+                min_num_phrases_per_monomodal_section=min_num_phrases_per_monomodal_section,
+                min_num_notes_per_monomodal_section=min_num_notes_per_monomodal_section,
+                min_num_notes_per_organum_phrase=min_num_notes_per_organum_phrase,
+                modes=modes,
+                units=units,
+                modal_category_keys=modal_category_keys,
+                workers=workers,
+                executor=executor,
+                cache=cache,
+                metadata_index=metadata_index,
+                metric=metric,
+                method=method,
+                leaf_ordering=leaf_ordering,
+                num_bootstrap_replicates=num_bootstrap_replicates,
+                bootstrap_scales=bootstrap_scales,
+                bootstrap_seed=bootstrap_seed,
+                profile=False,  # the profiles are recorded in the session above
+            )
+        )
+
+
+def calculate_results_for_multiple_seeds(
+    *,
+    pieces,
+    analysis,
+    sampling_fraction,
+    sampling_seeds,
+    min_num_phrases_per_monomodal_section=3,
+    min_num_notes_per_monomodal_section=80,
+    min_num_notes_per_organum_phrase=12,
+    modes=None,
+    units=None,
+    modal_category_keys=None,
+    workers=None,
+    executor=None,
+    cache=default_item_cache,
+    metadata_index=None,
+    metric=DEFAULT_METRIC,
+    method=DEFAULT_LINKAGE_METHOD,
+    leaf_ordering="auto",
+    num_bootstrap_replicates=0,
+    bootstrap_scales=(1.0,),
+    bootstrap_seed=None,
+):
+    """
+    Same as `calculate_results()`, but for multiple sampling seeds (e.g. in order
+    to check how stable the resulting clusters are across different sub-samples).
+
+    The analysis inputs are only prepared once, and the features of each item are
+    only extracted once across all seeds. Thus each additional seed only adds the
+    cost of calculating the dendrograms (or tendency distributions) themselves.
+    The results for all seeds are calculated in parallel if `workers` is given.
+
+    Returns
+    -------
+    dict
+        Dictionary of the form {sampling_seed: {ResultDescriptor: result}}.
+    """
+    modes = modes or list(ModalCategoryType)
+    check_analysis_for_repertoire(analysis, pieces.repertoire_and_genre)
+    units = get_units_for_analysis(analysis, units or list(UnitType))
+    sampling_seeds = list(dict.fromkeys(sampling_seeds))  # remove duplicates (but preserve order)
+    if cache is None:
+        # We need a cache here so that the features are not extracted again for each seed.
+        cache = ItemCache()
+
+    subsamplers = _get_subsamplers(
+        pieces,
+        analysis=analysis,
+        modes=modes,
+        min_num_phrases_per_monomodal_section=min_num_phrases_per_monomodal_section,
+        min_num_notes_per_monomodal_section=min_num_notes_per_monomodal_section,
+        min_num_notes_per_organum_phrase=min_num_notes_per_organum_phrase,
+        metadata_index=metadata_index,
+    )
+    modal_categories_per_seed = {
+        seed: get_modal_categories(
+            subsamplers,
+            sampling_fraction=sampling_fraction,
+            sampling_seed=seed,
+            modal_category_keys=modal_category_keys,
+        )
+        for seed in sampling_seeds
+    }
+
+    all_results = iter_results_for_modal_categories(
+        [mc for modal_categories in modal_categories_per_seed.values() for mc in modal_categories],
+        repertoire_and_genre=pieces.repertoire_and_genre,
+        analysis=analysis,
+        units=units,
+        workers=workers,
+        executor=executor,
+        cache=cache,
+        metric=metric,
+        method=method,
+        leaf_ordering=leaf_ordering,
+        num_bootstrap_replicates=num_bootstrap_replicates,
+        bootstrap_scales=bootstrap_scales,
+        bootstrap_seed=bootstrap_seed,
+    )
+    return {
+        seed: dict(itertools.islice(all_results, len(modal_categories) * len(units)))
+        for seed, modal_categories in modal_categories_per_seed.items()
+    }
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import pickle
+from time import time
+from .logging import logger
+
+__all__ = ["CheckpointStore", "calculate_fingerprint"]
+
+
+def calculate_fingerprint(key, *, params=None, input_files=(), dep_fingerprints=()):
+    """
+    Return a fingerprint (hex digest) which identifies the output of a stage by all of its inputs:
+    the stage key, any other parameters, the size and modification time of its input files, and
+    (recursively) the fingerprints of the stages it depends on.
+    """
+    h = hashlib.sha1()
+    h.update(repr(tuple(getattr(x, "value", x) for x in key)).encode())
+    h.update(repr(sorted((params or {}).items())).encode())
+    for filename in input_files:
+        stat = os.stat(filename)
+        h.update(repr((os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)).encode())
+    for fingerprint in dep_fingerprints:
+        h.update(fingerprint.encode())
+    return h.hexdigest()
+
+
+class CheckpointStore:
+    """
+    Directory containing the (pickled) outputs of completed stages, so that an interrupted
+    run can be resumed without repeating any of the stages which completed before.
+
+    The file `manifest.json` maps the fingerprint of each completed stage (see
+    `calculate_fingerprint()`) to the file holding its output. Since a fingerprint
+    changes whenever any of the inputs of a stage change (including its input files
+    and the outputs of earlier stages), stale checkpoints are never used. Both the
+    output files and the manifest are written atomically, so a run which dies
+    while saving a checkpoint leaves the store in a consistent state.
+    """
+
+    manifest_filename = "manifest.json"
+
+    def __init__(self, checkpoint_dir):
+        self.checkpoint_dir = checkpoint_dir
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        self.manifest_path = os.path.join(self.checkpoint_dir, self.manifest_filename)
+        try:
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+
+    def __repr__(self):
+        return f"<CheckpointStore: '{self.checkpoint_dir}' ({len(self.manifest)} checkpoints)>"
+
+    def __len__(self):
+        return len(self.manifest)
+
+    def __contains__(self, fingerprint):
+        entry = self.manifest.get(fingerprint)
+        return entry is not None and os.path.exists(os.path.join(self.checkpoint_dir, entry["filename"]))
+
+    def load(self, fingerprint):
+        entry = self.manifest[fingerprint]
+        logger.debug(f"Loading checkpoint for stage {entry['stage']}")
+        with open(os.path.join(self.checkpoint_dir, entry["filename"]), "rb") as f:
+            return pickle.load(f)
+
+    def save(self, fingerprint, output, *, descr):
+        filename = f"{fingerprint}.pkl"
+        self._write_atomically(filename, lambda f: pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL), mode="wb")
+        self.manifest[fingerprint] = {"stage": descr, "filename": filename, "created": time()}
+        self._write_atomically(
+            self.manifest_filename, lambda f: json.dump(self.manifest, f, indent=2, sort_keys=True), mode="w"
+        )
+
+    def _write_atomically(self, filename, write, *, mode):
+        path = os.path.join(self.checkpoint_dir, filename)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
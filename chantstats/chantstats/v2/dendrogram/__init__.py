@@ -1 +1,2 @@
-from .dendrogram import Dendrogram, calculate_dendrogram
+from .dendrogram import Dendrogram, calculate_dendrogram, calculate_dendrogram_from_dataframe
+from .distance_metrics import DISTANCE_METRICS, LINKAGE_METHODS, calculate_distances
@@ -0,0 +1,123 @@
+import numpy as np
+from scipy.cluster.hierarchy import linkage
+from ..logging import logger
+from ..parallel import map_over_shared_inputs
+from .distance_metrics import DEFAULT_METRIC, DEFAULT_LINKAGE_METHOD, calculate_distances
+
+__all__ = ["calculate_bootstrap_support"]
+
+
+def calculate_cluster_hashes(Z, leaf_hashes):
+    """
+    Return an array containing a hash value for each cluster in the linkage matrix `Z`
+    (indexed by cluster id, i.e. the leaves come first, followed by the merged clusters).
+
+    The hash of each cluster is the sum (modulo 2**64) of the random hash values of its
+    leaves, so it only depends on the set of leaves in the cluster and not on the shape
+    of the tree. This allows to check cheaply whether a cluster occurs in another tree.
+    """
+    num_leaves = len(leaf_hashes)
+    hashes = np.empty(2 * num_leaves - 1, dtype=np.uint64)
+    hashes[:num_leaves] = leaf_hashes
+    children = Z[:, :2].astype(np.intp)
+    with np.errstate(over="ignore"):
+        for k, (left, right) in enumerate(children):
+            hashes[num_leaves + k] = hashes[left] + hashes[right]
+    return hashes
+
+
+def _count_cluster_occurrences_in_bootstrap_replicates(task):
+    """
+    Draw `num_replicates` bootstrap replicates by resampling the notes within each item,
+    recluster each replicate and count how often each of the given clusters occurs.
+    """
+    counts, leaf_hashes, cluster_hashes, scale, seed, num_replicates, metric, method = task
+    rng = np.random.default_rng(seed)
+    num_notes = counts.sum(axis=1)
+    probs = counts / num_notes[:, np.newaxis]
+    sample_sizes = np.maximum(np.rint(scale * num_notes), 1).astype(np.int64)
+
+    num_occurrences = np.zeros(len(cluster_hashes), dtype=np.int64)
+    for _ in range(num_replicates):
+        resampled_counts = rng.multinomial(sample_sizes, probs)
+        resampled_freqs = 100 * resampled_counts / sample_sizes[:, np.newaxis]
+        Z = linkage(calculate_distances(resampled_freqs, metric=metric), method=method)
+        num_occurrences += np.isin(cluster_hashes, calculate_cluster_hashes(Z, leaf_hashes))
+    return num_occurrences
+
+
+def calculate_bootstrap_support(
+    counts,
+    linkage_matrix,
+    *,
+    num_replicates=1000,
+    scales=(1.0,),
+    seed=None,
+    workers=None,
+    chunk_size=50,
+    metric=DEFAULT_METRIC,
+    method=DEFAULT_LINKAGE_METHOD,
+):
+    """
+    Estimate how stable the clusters in a dendrogram are by resampling the notes within each item.
+
+    For each replicate, the notes of each item are resampled from the item's original counts
+    (i.e. we draw from a multinomial distribution with the item's relative frequencies). The
+    number of notes drawn per item is `scale` times the original number of notes, which allows
+    a multiscale bootstrap analysis if multiple scales are given. Each replicate is clustered in
+    the same way as the original dendrogram, and the bootstrap support of a cluster is the
+    fraction of replicates in which a cluster with exactly the same leaves occurs.
+
+    Parameters
+    ----------
+    counts : numpy.ndarray
+        2D array with the absolute counts for each item (one row per leaf of the dendrogram).
+    linkage_matrix : numpy.ndarray
+        Linkage matrix of the original dendrogram.
+    num_replicates : int
+        Number of bootstrap replicates per scale.
+    scales : list of float
+        Relative sample sizes for which to draw the bootstrap replicates.
+    seed : int, optional
+        Seed for the random number generator (for reproducible results).
+    workers : int, optional
+        Number of worker processes. The replicates are distributed across
+        the workers in chunks of `chunk_size` replicates.
+    metric : str
+        Distance metric used for the original dendrogram (see `DISTANCE_METRICS`).
+    method : str
+        Linkage method used for the original dendrogram.
+
+    Returns
+    -------
+    dict
+        Dictionary of the form {scale: support}, where `support` is an array
+        containing the bootstrap support of each cluster (indexed by cluster id).
+    """
+    counts = np.asarray(counts, dtype=float)
+    assert counts.ndim == 2 and len(counts) == len(linkage_matrix) + 1
+    if (counts.sum(axis=1) == 0).any():
+        raise ValueError("Cannot resample items without any counts.")
+
+    seed_sequence = np.random.SeedSequence(seed)
+    if seed is None:
+        logger.info(f"Using random seed for bootstrap replicates: {seed_sequence.entropy}")
+    leaf_hashes = np.random.default_rng(seed_sequence.spawn(1)[0]).integers(
+        0, np.iinfo(np.uint64).max, size=len(counts), dtype=np.uint64, endpoint=True
+    )
+    cluster_hashes = calculate_cluster_hashes(linkage_matrix, leaf_hashes)
+
+    tasks = []
+    for scale in scales:
+        chunk_sizes = [chunk_size] * (num_replicates // chunk_size) + [num_replicates % chunk_size]
+        chunk_sizes = [n for n in chunk_sizes if n > 0]
+        for chunk_seed, n in zip(seed_sequence.spawn(len(chunk_sizes)), chunk_sizes):
+            tasks.append((counts, leaf_hashes, cluster_hashes, scale, chunk_seed, n, metric, method))
+
+    logger.info(f"Calculating {num_replicates} bootstrap replicates for each of the scales {list(scales)}")
+    num_occurrences = map_over_shared_inputs(_count_cluster_occurrences_in_bootstrap_replicates, tasks, workers=workers)
+
+    total_occurrences = {scale: np.zeros(len(cluster_hashes), dtype=np.int64) for scale in scales}
+    for (_, _, _, scale, _, _, _, _), occurrences in zip(tasks, num_occurrences):
+        total_occurrences[scale] += occurrences
+    return {scale: total_occurrences[scale] / num_replicates for scale in scales}
@@ -3,16 +3,26 @@ import numpy as np
 import pandas as pd
 import palettable
 import scipy.stats
+import time
 from scipy.cluster.hierarchy import dendrogram, linkage, set_link_color_palette, to_tree
-from scipy.spatial.distance import pdist
 from ..analysis_functions import get_analysis_function
 from ..analysis_type import AnalysisType
+from ..instrumentation import increment, timed
 from ..logging import logger
 from ..unit import UnitType
 from ..utils import plot_empty_figure
+from .bootstrap import calculate_bootstrap_support
+from .distance_metrics import (
+    DEFAULT_METRIC,
+    DEFAULT_LINKAGE_METHOD,
+    MIN_NUM_DISTANCES_FOR_PROGRESS_LOGGING,
+    calculate_distances,
+    check_metric_and_method,
+)
 from .dendrogram_node import DendrogramNode
+from .leaf_ordering import DEFAULT_MAX_NUM_LEAVES_FOR_OPTIMAL_ORDERING, order_leaves
 
-__all__ = ["calculate_dendrogram"]
+__all__ = ["calculate_dendrogram", "calculate_dendrogram_from_dataframe"]
 
 
 class EmptyDendrogramError(Exception):
@@ -46,19 +56,58 @@ def calculate_distribution_distance(freqs1, freqs2):
     return 1 - p_value
 
 
-def calculate_linkage_matrix_in_python_format(df_freq_distributions, *, optimal_ordering=True):
+def calculate_linkage_matrix_in_python_format(
+    df_freq_distributions,
+    *,
+    metric=DEFAULT_METRIC,
+    method=DEFAULT_LINKAGE_METHOD,
+    leaf_ordering="auto",
+    max_num_leaves_for_optimal_ordering=DEFAULT_MAX_NUM_LEAVES_FOR_OPTIMAL_ORDERING,
+):
     if len(df_freq_distributions) <= 1:
         raise EmptyDendrogramError("Cannot produce dendrogram for a single item (nothing to cluster).")
-    Z = linkage(
-        pdist(df_freq_distributions.values, metric=calculate_distribution_distance),
-        method="complete",
-        optimal_ordering=optimal_ordering,
+    num_items = len(df_freq_distributions)
+    num_distances = num_items * (num_items - 1) // 2
+    increment("dendrograms")
+    increment("distance_pairs", num_distances)
+    tic = time.perf_counter()
+    with timed("distances"):
+        # Note that the full condensed distance matrix is still held in memory (in double
+        # precision) because linkage() and the leaf ordering need it in this form anyway.
+        distances = calculate_distances(
+            df_freq_distributions.values,
+            metric=metric,
+            log_progress=num_distances >= MIN_NUM_DISTANCES_FOR_PROGRESS_LOGGING,
+        )
+    with timed("linkage"):
+        Z = linkage(distances, method=method)
+    toc = time.perf_counter()
+    with timed("leaf_ordering"):
+        Z, leaf_ordering = order_leaves(
+            Z,
+            distances,
+            leaf_ordering=leaf_ordering,
+            max_num_leaves_for_optimal_ordering=max_num_leaves_for_optimal_ordering,
+        )
+    logger.info(
+        f"Clustered {len(df_freq_distributions)} items in {toc - tic:.3f}s "
+        f"(leaf ordering '{leaf_ordering}' took {time.perf_counter() - toc:.3f}s)"
     )
     return Z
 
 
 class Dendrogram:
-    def __init__(self, df, *, analysis, optimal_ordering=True):
+    def __init__(
+        self,
+        df,
+        *,
+        analysis,
+        metric=DEFAULT_METRIC,
+        method=DEFAULT_LINKAGE_METHOD,
+        leaf_ordering="auto",
+        max_num_leaves_for_optimal_ordering=DEFAULT_MAX_NUM_LEAVES_FOR_OPTIMAL_ORDERING,
+    ):
+        check_metric_and_method(metric, method)
         if df.isnull().any(axis=None):
             raise RuntimeError(
                 "Dataframe contains NaN values. Please filter them out before calculating the dendrogram"
@@ -66,6 +115,8 @@ class Dendrogram:
 
         self.df_orig = df
         self.analysis = AnalysisType(analysis)
+        self.metric = metric
+        self.method = method
         cols_with_nonzero_entries = df.columns[(df != 0).any()]
         if sorted(cols_with_nonzero_entries) != sorted(df.columns):
             missing_columns = sorted([x for x in set(df.columns).difference(cols_with_nonzero_entries)])
@@ -82,33 +133,40 @@ class Dendrogram:
             )
             self.df = self.df[(self.df != 0).any(axis=1)]
 
-        self.L = calculate_linkage_matrix_in_python_format(self.df, optimal_ordering=optimal_ordering)
-        self.R = dendrogram(self.L, no_plot=True)
-        self.root_node, self.all_cluster_nodes = to_tree(self.L, rd=True)
-        self.leaf_ids = self.root_node.pre_order(lambda x: x.id)
-        self.all_cluster_nodes = [
-            DendrogramNode(
-                df,
-                cn,
-                analysis=self.analysis,
-                all_leaf_ids=self.leaf_ids,
-                cols_with_globally_nonzero_entries=cols_with_nonzero_entries,
-            )
-            for cn in self.all_cluster_nodes
-        ]
-        self.leaf_nodes = [n for n in self.all_cluster_nodes if n.is_leaf]
-        self.root_node = [n for n in self.all_cluster_nodes if n.cluster_node is self.root_node][
-            0
-        ]  # TODO: simplify this
-
-        # Retroactively assign left/right children to each DendrogramNode
-        for n in self.all_cluster_nodes:
-            if not n.is_leaf:
-                n.left = self.all_cluster_nodes[n.cluster_node.left.id]
-                n.right = self.all_cluster_nodes[n.cluster_node.right.id]
-                n.left.parent = n
-                n.right.parent = n
-        self.root_node.parent = None
+        self.L = calculate_linkage_matrix_in_python_format(
+            self.df,
+            metric=metric,
+            method=method,
+            leaf_ordering=leaf_ordering,
+            max_num_leaves_for_optimal_ordering=max_num_leaves_for_optimal_ordering,
+        )
+        with timed("node_construction"):
+            self.R = dendrogram(self.L, no_plot=True)
+            self.root_node, self.all_cluster_nodes = to_tree(self.L, rd=True)
+            self.leaf_ids = self.root_node.pre_order(lambda x: x.id)
+            self.all_cluster_nodes = [
+                DendrogramNode(
+                    df,
+                    cn,
+                    analysis=self.analysis,
+                    all_leaf_ids=self.leaf_ids,
+                    cols_with_globally_nonzero_entries=cols_with_nonzero_entries,
+                )
+                for cn in self.all_cluster_nodes
+            ]
+            self.leaf_nodes = [n for n in self.all_cluster_nodes if n.is_leaf]
+            self.root_node = [n for n in self.all_cluster_nodes if n.cluster_node is self.root_node][
+                0
+            ]  # TODO: simplify this
+
+            # Retroactively assign left/right children to each DendrogramNode
+            for n in self.all_cluster_nodes:
+                if not n.is_leaf:
+                    n.left = self.all_cluster_nodes[n.cluster_node.left.id]
+                    n.right = self.all_cluster_nodes[n.cluster_node.right.id]
+                    n.left.parent = n
+                    n.right.parent = n
+            self.root_node.parent = None
 
         # inspect dataframe
         print("printing df...")
@@ -117,6 +175,38 @@ class Dendrogram:
             print(df.mean())
         print(df)
 
+    def calculate_bootstrap_support(self, df_counts, *, num_replicates=1000, scales=(1.0,), seed=None, workers=None):
+        """
+        Calculate the bootstrap support of each cluster in this dendrogram by resampling
+        the notes within each item (see `calculate_bootstrap_support()` in `bootstrap.py`).
+        The replicates are clustered with the same distance metric and linkage method as
+        this dendrogram.
+        The result is stored in the attributes `bootstrap_support` (the support for scale
+        1.0, or for the first scale if 1.0 is not among the scales) and
+        `bootstrap_support_per_scale` of each node.
+
+        Parameters
+        ----------
+        df_counts : pandas.DataFrame
+            Absolute counts from which the frequency distributions of the leaves were
+            calculated (as returned by `ModalCategory.make_counts_dataframe()`).
+        """
+        counts = df_counts.loc[self.df.index, self.df.columns].values
+        support = calculate_bootstrap_support(
+            counts,
+            self.L,
+            num_replicates=num_replicates,
+            scales=scales,
+            seed=seed,
+            workers=workers,
+            metric=self.metric,
+            method=self.method,
+        )
+        main_scale = 1.0 if 1.0 in support else scales[0]
+        for n in self.all_cluster_nodes:
+            n.bootstrap_support_per_scale = {scale: support[scale][n.id] for scale in scales}
+            n.bootstrap_support = n.bootstrap_support_per_scale[main_scale]
+
     def get_nodes_below_cutoff(self, p_cutoff, *, include_leaf_nodes):
         proper_cluster_condition = lambda node: True if include_leaf_nodes else not node.is_leaf
 
@@ -230,10 +320,12 @@ class EmptyDendrogram:
     so that code which interacts with regular dendrograms still works).
     """
 
-    def __init__(self, df, *, analysis):
+    def __init__(self, df, *, analysis, metric=DEFAULT_METRIC, method=DEFAULT_LINKAGE_METHOD):
         self.df_orig = df
         self.df_trimmed = df[(df != 0).any(axis=1)]
         self.analysis = AnalysisType(analysis)
+        self.metric = metric
+        self.method = method
         if len(self.df_trimmed) > 1:
             raise RuntimeError(
                 f"Unexpected size of trimmed input data frame: {len(self.df_trimmed)}.\n\n{self.df_trimmed}"
@@ -254,13 +346,88 @@ class EmptyDendrogram:
     def get_nodes_below_cutoff(self, p_cutoff, *, include_leaf_nodes):
         return []
 
+    def calculate_bootstrap_support(self, df_counts, **kwargs):
+        # Nothing to do because there are no clusters.
+        pass
+
+
+def calculate_dendrogram(
+    modal_category,
+    *,
+    analysis,
+    unit,
+    analysis_func=None,
+    replace_nan_values_with_zeros=True,
+    metric=DEFAULT_METRIC,
+    method=DEFAULT_LINKAGE_METHOD,
+    leaf_ordering="auto",
+    max_num_leaves_for_optimal_ordering=DEFAULT_MAX_NUM_LEAVES_FOR_OPTIMAL_ORDERING,
+    num_bootstrap_replicates=0,
+    bootstrap_scales=(1.0,),
+    bootstrap_seed=None,
+    workers=None,
+):
+    """
+    Calculate the dendrogram for the given modal category.
+
+    The leaves are clustered using the distance metric `metric` (one of the keys of
+    `DISTANCE_METRICS`, by default 1-p where p is the p-value of the chi-square test)
+    and the linkage method `method` (one of `LINKAGE_METHODS`).
+
+    The order of the leaves is determined by `leaf_ordering` (see `order_leaves()` in
+    `leaf_ordering.py`). By default, the optimal leaf ordering is only used if there are
+    at most `max_num_leaves_for_optimal_ordering` leaves because it scales cubically;
+    for larger dendrograms a much cheaper greedy heuristic is used instead.
 
-def calculate_dendrogram(modal_category, *, analysis, unit, analysis_func=None, replace_nan_values_with_zeros=True):
+    If `num_bootstrap_replicates` is greater than zero then the bootstrap support of
+    each cluster is calculated as well (see `Dendrogram.calculate_bootstrap_support()`),
+    using `workers` worker processes. This is only supported for the default analysis
+    functions (because the resampling is based on the counts of the individual items).
+    """
     unit = UnitType(unit)
     analysis = AnalysisType(analysis)
     analysis_func = analysis_func or get_analysis_function(analysis)
 
     df = modal_category.make_results_dataframe(analysis_func=analysis_func, unit=unit)
+    dendrogram = calculate_dendrogram_from_dataframe(
+        df,
+        analysis=analysis,
+        replace_nan_values_with_zeros=replace_nan_values_with_zeros,
+        metric=metric,
+        method=method,
+        leaf_ordering=leaf_ordering,
+        max_num_leaves_for_optimal_ordering=max_num_leaves_for_optimal_ordering,
+    )
+
+    if num_bootstrap_replicates > 0:
+        df_counts = modal_category.make_counts_dataframe(analysis=analysis, unit=unit)
+        dendrogram.calculate_bootstrap_support(
+            df_counts,
+            num_replicates=num_bootstrap_replicates,
+            scales=bootstrap_scales,
+            seed=bootstrap_seed,
+            workers=workers,
+        )
+
+    return dendrogram
+
+
+def calculate_dendrogram_from_dataframe(
+    df,
+    *,
+    analysis,
+    replace_nan_values_with_zeros=True,
+    metric=DEFAULT_METRIC,
+    method=DEFAULT_LINKAGE_METHOD,
+    leaf_ordering="auto",
+    max_num_leaves_for_optimal_ordering=DEFAULT_MAX_NUM_LEAVES_FOR_OPTIMAL_ORDERING,
+):
+    """
+    Calculate the dendrogram for the given results dataframe (as returned
+    by `ModalCategory.make_results_dataframe()`), using the given distance
+    metric, linkage method and leaf ordering (see `calculate_dendrogram()`).
+    """
+    analysis = AnalysisType(analysis)
     if replace_nan_values_with_zeros:
         if df.isnull().values.any():
             logger.warning("Replacing NaN values with zeros in dendrogram dataframe.")
@@ -268,8 +435,15 @@ def calculate_dendrogram(modal_category, *, analysis, unit, analysis_func=None,
         df = df.fillna(0)
 
     try:
-        dendrogram = Dendrogram(df, analysis=analysis)
+        dendrogram = Dendrogram(
+            df,
+            analysis=analysis,
+            metric=metric,
+            method=method,
+            leaf_ordering=leaf_ordering,
+            max_num_leaves_for_optimal_ordering=max_num_leaves_for_optimal_ordering,
+        )
     except EmptyDendrogramError:
-        dendrogram = EmptyDendrogram(df, analysis=analysis)
+        dendrogram = EmptyDendrogram(df, analysis=analysis, metric=metric, method=method)
 
     return dendrogram
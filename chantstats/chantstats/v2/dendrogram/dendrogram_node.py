@@ -41,6 +41,10 @@ class DendrogramNode:
         self.xpos_left_boundary = self.leftmost_idx * 10.0
         self.xpos_right_boundary = (self.rightmost_idx + 1) * 10.0
 
+        # These are set by Dendrogram.calculate_bootstrap_support()
+        self.bootstrap_support = None
+        self.bootstrap_support_per_scale = None
+
     @property
     def xpos(self):
         if self.is_leaf:
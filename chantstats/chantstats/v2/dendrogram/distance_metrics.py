@@ -0,0 +1,288 @@
+import numpy as np
+import scipy.stats
+from ..logging import logger
+
+__all__ = [
+    "DISTANCE_METRICS",
+    "DEFAULT_METRIC",
+    "LINKAGE_METHODS",
+    "DEFAULT_LINKAGE_METHOD",
+    "calculate_distances",
+    "prepare_frequencies",
+    "calculate_distances_to_prepared_rows",
+    "calculate_chi_square_distances",
+    "calculate_jensen_shannon_distances",
+    "calculate_hellinger_distances",
+    "calculate_total_variation_distances",
+    "calculate_cosine_distances",
+]
+
+
+def calculate_chi_square_p_values_one_vs_many(freqs, other_freqs):
+    """
+    Vectorized version of `calculate_chi_square_p_value()` which calculates the p-values
+    of the chi-square test for the pairs `[freqs, other_freqs[k]]` for all rows k of
+    the 2D array `other_freqs` at once.
+
+    This follows `scipy.stats.chi2_contingency()` exactly: columns where both rows are
+    zero are discarded, Yates' correction is applied if there is only one degree of
+    freedom, and the p-value is 1.0 if there are no degrees of freedom.
+    """
+    row_sum = freqs.sum()
+    other_row_sums = other_freqs.sum(axis=1)
+    col_sums = freqs[np.newaxis, :] + other_freqs
+    totals = row_sum + other_row_sums
+    nonzero_columns = col_sums > 0
+    dof = nonzero_columns.sum(axis=1) - 1
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        expected = row_sum * col_sums / totals[:, np.newaxis]
+        other_expected = other_row_sums[:, np.newaxis] * col_sums / totals[:, np.newaxis]
+        # Note that the absolute deviation from the expected value is the same for both rows.
+        abs_diff = np.abs(freqs[np.newaxis, :] - expected)
+        abs_diff = np.where((dof == 1)[:, np.newaxis], np.maximum(abs_diff - 0.5, 0.0), abs_diff)
+        terms = np.where(nonzero_columns, abs_diff**2 / expected + abs_diff**2 / other_expected, 0.0)
+    chi2 = terms.sum(axis=1)
+
+    p_values = scipy.stats.chi2.sf(chi2, np.maximum(dof, 1))
+    p_values[dof <= 0] = 1.0
+    return p_values
+
+
+def _prepare_frequencies(freqs):
+    return np.asarray(freqs, dtype=float)
+
+
+def _normalize_rows(freqs):
+    """
+    Return the rows of `freqs` scaled to sum to 1 (so that it doesn't matter
+    whether the input contains absolute counts or percentages).
+    """
+    freqs = np.asarray(freqs, dtype=float)
+    return freqs / freqs.sum(axis=1, keepdims=True)
+
+
+def _xlog2x(x):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(x > 0, x * np.log2(x), 0.0)
+
+
+def _calculate_chi_square_distances_one_vs_many(freqs, other_freqs):
+    return 1 - calculate_chi_square_p_values_one_vs_many(freqs, other_freqs)
+
+
+def _prepare_jensen_shannon(freqs):
+    # The (negative) entropy of each distribution is stored in an extra column
+    probs = _normalize_rows(freqs)
+    neg_entropies = _xlog2x(probs).sum(axis=1)
+    return np.column_stack([probs, neg_entropies])
+
+
+def _calculate_jensen_shannon_distances_one_vs_many(prepared_row, prepared_rows):
+    probs, neg_entropy = prepared_row[:-1], prepared_row[-1]
+    other_probs, other_neg_entropies = prepared_rows[:, :-1], prepared_rows[:, -1]
+    neg_entropies_of_mixtures = _xlog2x(0.5 * (probs + other_probs)).sum(axis=1)
+    divergences = 0.5 * (neg_entropy + other_neg_entropies) - neg_entropies_of_mixtures
+    return np.sqrt(np.clip(divergences, 0.0, 1.0))
+
+
+def _prepare_hellinger(freqs):
+    return np.sqrt(_normalize_rows(freqs))
+
+
+def _calculate_hellinger_distances_one_vs_many(sqrt_probs, other_sqrt_probs):
+    bhattacharyya_coefficients = other_sqrt_probs @ sqrt_probs
+    return np.sqrt(np.clip(1.0 - bhattacharyya_coefficients, 0.0, 1.0))
+
+
+def _calculate_total_variation_distances_one_vs_many(probs, other_probs):
+    return 0.5 * np.abs(other_probs - probs).sum(axis=1)
+
+
+def _prepare_cosine(freqs):
+    freqs = np.asarray(freqs, dtype=float)
+    return freqs / np.linalg.norm(freqs, axis=1, keepdims=True)
+
+
+def _calculate_cosine_distances_one_vs_many(unit_vector, other_unit_vectors):
+    return np.clip(1.0 - other_unit_vectors @ unit_vector, 0.0, 1.0)
+
+
+# Each metric is given by a pair of functions `(prepare, calculate_one_vs_many)`. The first one
+# is applied once to the whole input (e.g. to calculate relative frequencies) and works row by
+# row, and the second one returns the distances between a single prepared row and each row of
+# a 2D array of prepared rows. Thus the distance matrix can be filled in blocks of rows without
+# ever calculating all of it at once.
+#
+# All of these distances lie between 0 and 1 for non-negative frequencies,
+# so the same p_cutoff values and plot limits can be used for each of them.
+DISTANCE_METRICS = {
+    "chi_square": (_prepare_frequencies, _calculate_chi_square_distances_one_vs_many),
+    "jensen_shannon": (_prepare_jensen_shannon, _calculate_jensen_shannon_distances_one_vs_many),
+    "hellinger": (_prepare_hellinger, _calculate_hellinger_distances_one_vs_many),
+    "total_variation": (_normalize_rows, _calculate_total_variation_distances_one_vs_many),
+    "cosine": (_prepare_cosine, _calculate_cosine_distances_one_vs_many),
+}
+DEFAULT_METRIC = "chi_square"
+
+# Note that "centroid", "median" and "ward" linkage are not supported
+# because they are only meaningful for Euclidean distances.
+LINKAGE_METHODS = ["complete", "average", "single", "weighted"]
+DEFAULT_LINKAGE_METHOD = "complete"
+
+# Maximum number of distances which are held in memory at once while filling a distance matrix.
+DEFAULT_BLOCK_SIZE = 2**22
+
+# Dendrograms whose distance matrix contains at least this many distances log the progress
+# of the distance calculation (which takes a while for such a large number of items).
+MIN_NUM_DISTANCES_FOR_PROGRESS_LOGGING = 10**7
+
+
+def check_metric_and_method(metric, method):
+    if metric not in DISTANCE_METRICS:
+        raise ValueError(f"Invalid distance metric: '{metric}'. Allowed metrics: {list(DISTANCE_METRICS)}")
+    if method not in LINKAGE_METHODS:
+        raise ValueError(f"Invalid linkage method: '{method}'. Allowed methods: {LINKAGE_METHODS}")
+
+
+def _iter_row_blocks(num_rows, block_size):
+    """
+    Yield triples `(start, stop, num_pairs)` for consecutive blocks of rows such that the
+    distances between the rows in each block and all subsequent rows (of which there are
+    `num_pairs`) fill a contiguous part of the condensed distance matrix of size at most
+    `block_size` (unless a single row has more than `block_size` subsequent rows).
+    """
+    start = 0
+    while start < num_rows - 1:
+        stop = start
+        num_pairs = 0
+        while stop < num_rows - 1 and (stop == start or num_pairs + num_rows - 1 - stop <= block_size):
+            num_pairs += num_rows - 1 - stop
+            stop += 1
+        yield start, stop, num_pairs
+        start = stop
+
+
+def calculate_distances(freqs, *, metric=DEFAULT_METRIC, out=None, block_size=DEFAULT_BLOCK_SIZE, log_progress=False):
+    """
+    Calculate the pairwise distances between the rows of the 2D array `freqs` using
+    the given metric (which must be one of the keys of `DISTANCE_METRICS`).
+
+    The distances are calculated in blocks of rows, and each block is written to
+    the output array in one go (converting it to the dtype of `out`).
+
+    Parameters
+    ----------
+    out : numpy.ndarray, optional
+        Array of length `n * (n - 1) / 2` in which to store the distances (this
+        can also be a memory-mapped array). If not given, a new array is created.
+    block_size : int
+        Maximum number of distances per block.
+    log_progress : bool
+        If True, log the progress (roughly after every 10% of the distances).
+
+    Returns
+    -------
+    numpy.ndarray
+        Condensed distance matrix (in the same format as returned by `pdist()`).
+    """
+    if metric not in DISTANCE_METRICS:
+        raise ValueError(f"Invalid distance metric: '{metric}'. Allowed metrics: {list(DISTANCE_METRICS)}")
+    prepare, calculate_one_vs_many = DISTANCE_METRICS[metric]
+
+    num_rows = len(freqs)
+    num_distances = num_rows * (num_rows - 1) // 2
+    if out is None:
+        out = np.empty(num_distances)
+    elif out.shape != (num_distances,):
+        raise ValueError(f"Output array has wrong shape: {out.shape} (expected: {(num_distances,)})")
+
+    prepared = prepare(freqs)
+    pos = 0
+    next_progress_report = 0.1
+    for start, stop, num_pairs in _iter_row_blocks(num_rows, block_size):
+        block = np.empty(num_pairs)
+        block_pos = 0
+        for i in range(start, stop):
+            block[block_pos : block_pos + num_rows - 1 - i] = calculate_one_vs_many(prepared[i], prepared[i + 1 :])
+            block_pos += num_rows - 1 - i
+        out[pos : pos + num_pairs] = block
+        pos += num_pairs
+        if log_progress and pos >= next_progress_report * num_distances:
+            next_progress_report = np.floor(10 * pos / num_distances + 1) / 10
+            logger.info(
+                f"Calculated {metric} distances for {stop}/{num_rows} rows "
+                f"({pos}/{num_distances} distances, {100 * pos / num_distances:.0f}%)"
+            )
+    return out
+
+
+def prepare_frequencies(freqs, *, metric=DEFAULT_METRIC):
+    """
+    Transform the rows of the 2D array `freqs` into the form which is expected by
+    `calculate_distances_to_prepared_rows()` (e.g. relative frequencies, depending
+    on the metric). This allows to prepare a large set of rows only once and then
+    calculate the distances from many different rows to them.
+    """
+    if metric not in DISTANCE_METRICS:
+        raise ValueError(f"Invalid distance metric: '{metric}'. Allowed metrics: {list(DISTANCE_METRICS)}")
+    prepare, _ = DISTANCE_METRICS[metric]
+    return prepare(freqs)
+
+
+def calculate_distances_to_prepared_rows(prepared_row, prepared_rows, *, metric=DEFAULT_METRIC, block_size=2**16):
+    """
+    Calculate the distances between a single row and each row of the 2D array `prepared_rows`
+    (both of which must have been prepared with `prepare_frequencies()` for the same metric).
+    The rows are processed in blocks of `block_size` rows to limit the size of temporary arrays.
+    """
+    _, calculate_one_vs_many = DISTANCE_METRICS[metric]
+    distances = np.empty(len(prepared_rows))
+    for start in range(0, len(prepared_rows), block_size):
+        distances[start : start + block_size] = calculate_one_vs_many(
+            prepared_row, prepared_rows[start : start + block_size]
+        )
+    return distances
+
+
+def calculate_chi_square_distances(freqs):
+    """
+    Calculate the pairwise distances between the rows of the 2D array `freqs`.
+
+    This returns the same values as `pdist(freqs, metric=calculate_distribution_distance)`
+    (i.e., a condensed distance matrix containing 1-p for each pair of rows, where p is
+    the p-value of the chi-square test), but is much faster because it doesn't call back
+    into Python for each pair of rows.
+    """
+    return calculate_distances(freqs, metric="chi_square")
+
+
+def calculate_jensen_shannon_distances(freqs):
+    """
+    Calculate the pairwise Jensen-Shannon distances (i.e. the square root of the
+    Jensen-Shannon divergence with base 2, which lies between 0 and 1) between the
+    rows of the 2D array `freqs`.
+    """
+    return calculate_distances(freqs, metric="jensen_shannon")
+
+
+def calculate_hellinger_distances(freqs):
+    """
+    Calculate the pairwise Hellinger distances between the rows of the 2D array `freqs`.
+    """
+    return calculate_distances(freqs, metric="hellinger")
+
+
+def calculate_total_variation_distances(freqs):
+    """
+    Calculate the pairwise total variation distances (i.e. half the L1 distance
+    between the relative frequencies) between the rows of the 2D array `freqs`.
+    """
+    return calculate_distances(freqs, metric="total_variation")
+
+
+def calculate_cosine_distances(freqs):
+    """
+    Calculate the pairwise cosine distances between the rows of the 2D array `freqs`.
+    """
+    return calculate_distances(freqs, metric="cosine")
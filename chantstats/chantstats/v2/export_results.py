@@ -1,5 +1,9 @@
+import contextlib
 import matplotlib.pyplot as plt
 import os
+import pandas as pd
+from collections.abc import Mapping
+from .analysis_functions import PAIR_COUNT_ANALYSES, VERTICAL_INTERVAL_ANALYSES
 from .color_palettes import get_color_palette_for_unit
 from .dendrogram.plotting import (
     plot_pc_freq_distributions,
@@ -7,7 +11,10 @@ from .dendrogram.plotting import (
     plot_LMO_freq_distributions,
     plot_tendency_distribution_NEW,
 )
+from .instrumentation import increment, tagged, timed
 from .logging import logger
+from .parallel import iter_in_background_thread
+from .profiling import is_profiling_requested_by_env, profiled, profiler
 from .utils import plot_empty_figure
 
 
@@ -17,14 +24,21 @@ class MissingDendrogramNodesError(Exception):
     """
 
 
+def save_figure(fig, outfilename):
+    with timed("savefig"):
+        fig.savefig(outfilename)
+    increment("figures_saved")
+
+
 def export_empty_figure(output_root_dir, result_descriptor):
     # raise NotImplementedError("TODO: implement this if required")
     msg_text = "This plot is deliberately empty\nbecause there is no data to export."
-    fig = plot_empty_figure(msg_text, result_descriptor=result_descriptor, figsize=(22, 4))
+    with timed("plotting"):
+        fig = plot_empty_figure(msg_text, result_descriptor=result_descriptor, figsize=(22, 4))
     outfilename = result_descriptor.get_full_output_path(
         output_root_dir, filename_prefix="stacked_bar_chart", filename_suffix=""
     )
-    fig.savefig(outfilename)
+    save_figure(fig, outfilename)
     return fig
 
 
@@ -45,32 +59,34 @@ def export_empty_figure(output_root_dir, result_descriptor):
 def export_stacked_bar_chart_for_pc_freqs(nodes_below_cutoff, output_root_dir, result_descriptor):
     assert len(nodes_below_cutoff) > 0
     color_palette = get_color_palette_for_unit(result_descriptor.unit)
-    figs = plot_pc_freq_distributions(
-        nodes_below_cutoff, result_descriptor=result_descriptor, color_palette=color_palette
-    )
+    with timed("plotting"):
+        figs = plot_pc_freq_distributions(
+            nodes_below_cutoff, result_descriptor=result_descriptor, color_palette=color_palette
+        )
     num_figs = len(figs)
     for i, fig in enumerate(figs, start=1):
         outfilename = result_descriptor.get_full_output_path(
             output_root_dir, filename_prefix="stacked_bar_chart", filename_suffix=f"__{i:02d}_of_{num_figs:02d}"
         )
-        fig.savefig(outfilename)
+        save_figure(fig, outfilename)
 
 
 def export_stacked_bar_chart_for_tendency(nodes_below_cutoff, output_root_dir, result_descriptor, height_per_axes=2.5):
     assert len(nodes_below_cutoff) > 0
     color_palette = get_color_palette_for_unit(result_descriptor.unit)
-    fig, axes = plt.subplots(
-        nrows=len(nodes_below_cutoff), ncols=1, figsize=(7, len(nodes_below_cutoff) * height_per_axes)
-    )
-    if len(nodes_below_cutoff) == 1:
-        axes = [axes]
-    for ax, node in zip(axes, nodes_below_cutoff):
-        plot_tendency_distributions(node, result_descriptor=result_descriptor, ax=ax, color_palette=color_palette)
-    fig.tight_layout()
+    with timed("plotting"):
+        fig, axes = plt.subplots(
+            nrows=len(nodes_below_cutoff), ncols=1, figsize=(7, len(nodes_below_cutoff) * height_per_axes)
+        )
+        if len(nodes_below_cutoff) == 1:
+            axes = [axes]
+        for ax, node in zip(axes, nodes_below_cutoff):
+            plot_tendency_distributions(node, result_descriptor=result_descriptor, ax=ax, color_palette=color_palette)
+        fig.tight_layout()
     outfilename = result_descriptor.get_full_output_path(
         output_root_dir, filename_prefix="stacked_bar_chart", filename_suffix=""
     )
-    fig.savefig(outfilename)
+    save_figure(fig, outfilename)
     plt.close(fig)
 
 
@@ -79,38 +95,66 @@ def export_individual_stacked_bar_charts_for_tendency(nodes_below_cutoff, output
     color_palette = get_color_palette_for_unit(result_descriptor.unit)
 
     for idx, node in enumerate(nodes_below_cutoff, start=1):
-        fig = plot_tendency_distributions(node, result_descriptor=result_descriptor, color_palette=color_palette)
-        fig.tight_layout()
+        with timed("plotting"):
+            fig = plot_tendency_distributions(node, result_descriptor=result_descriptor, color_palette=color_palette)
+            fig.tight_layout()
         outfilename = result_descriptor.get_full_output_path(
             output_root_dir, filename_prefix="stacked_bar_chart", filename_suffix=f"{idx:02d}"
         )
-        fig.savefig(outfilename)
+        save_figure(fig, outfilename)
         plt.close(fig)
 
 
 def export_stacked_bar_chart_for_modal_category_tendency(distribution, output_root_dir, result_descriptor):
     color_palette = get_color_palette_for_unit(result_descriptor.unit)
-    fig = plot_tendency_distribution_NEW(distribution, result_descriptor=result_descriptor, color_palette=color_palette)
-    fig.tight_layout()
+    with timed("plotting"):
+        fig = plot_tendency_distribution_NEW(
+            distribution, result_descriptor=result_descriptor, color_palette=color_palette
+        )
+        fig.tight_layout()
     outfilename = result_descriptor.get_full_output_path(
         output_root_dir, filename_prefix="stacked_bar_chart", filename_suffix=""
     )
-    fig.savefig(outfilename)
+    save_figure(fig, outfilename)
     plt.close(fig)
 
 
 def export_stacked_bar_chart_for_leaps_and_melodic_outlines(nodes_below_cutoff, output_root_dir, result_descriptor):
     assert len(nodes_below_cutoff) > 0
     color_palette = get_color_palette_for_unit(result_descriptor.unit)
-    figs = plot_LMO_freq_distributions(
-        nodes_below_cutoff, result_descriptor=result_descriptor, color_palette=color_palette
-    )
+    with timed("plotting"):
+        figs = plot_LMO_freq_distributions(
+            nodes_below_cutoff, result_descriptor=result_descriptor, color_palette=color_palette
+        )
     num_figs = len(figs)
     for i, fig in enumerate(figs, start=1):
         outfilename = result_descriptor.get_full_output_path(
             output_root_dir, filename_prefix="stacked_bar_chart", filename_suffix=f"__{i:02d}_of_{num_figs:02d}"
         )
-        fig.savefig(outfilename)
+        save_figure(fig, outfilename)
+
+
+def export_freq_distributions(nodes_below_cutoff, output_root_dir, result_descriptor, *, index_label):
+    """
+    Export the average frequency distributions of the given dendrogram nodes as a CSV file,
+    with one column per node and one row per value (e.g. phrase ending) which occurs in any
+    of them.
+
+    This is used for analyses with too many possible values to show them in a stacked bar
+    chart (which would need a separate colour for each of them).
+    """
+    assert len(nodes_below_cutoff) > 0
+    df = pd.DataFrame(
+        {f"Cluster #{node.cluster_id} ({node.num_leaves} leaves)": node.avg_distribution for node in nodes_below_cutoff}
+    )
+    df = df[(df.fillna(0) != 0).any(axis=1)]
+    df = df.loc[df.mean(axis=1).sort_values(ascending=False).index]
+    df.index = [x.label_for_plots for x in df.index]
+    outfilename = result_descriptor.get_full_output_path(
+        output_root_dir, filename_prefix="freq_distributions", filename_suffix="", filetype=".csv"
+    )
+    with timed("csv_export"):
+        df.to_csv(outfilename, index_label=index_label, float_format="%.3f")
 
 
 # def export_stacked_bar_chart_for_leaps_and_melodic_outlines_OLD(nodes_below_cutoff, output_root_dir, result_descriptor):
@@ -126,15 +170,97 @@ def export_stacked_bar_chart_for_leaps_and_melodic_outlines(nodes_below_cutoff,
 #     plt.close(fig)
 
 
-def export_results(results, output_root_dir, p_cutoff=0.4, include_leaf_nodes_in_clusters=True, overwrite=False):
+def export_result(result_descriptor, result, output_root_dir, *, p_cutoff, include_leaf_nodes_in_clusters=True):
+    """
+    Export a single analysis result (i.e., the result for one modal category and unit).
+
+    Note that, unlike `export_results()`, this does not append the p_cutoff
+    stub to output_root_dir.
+    """
+    with tagged(result_descriptor), timed("export"), profiled("export", result_descriptor):
+        _export_result(
+            result_descriptor,
+            result,
+            output_root_dir,
+            p_cutoff=p_cutoff,
+            include_leaf_nodes_in_clusters=include_leaf_nodes_in_clusters,
+        )
+
+
+def _export_result(result_descriptor, result, output_root_dir, *, p_cutoff, include_leaf_nodes_in_clusters):
+    output_dir = result_descriptor.get_output_dir(output_root_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    logger.info(f"Exporting results to folder: {output_dir}")
+
+    if result_descriptor.analysis in PAIR_COUNT_ANALYSES:
+        distribution = result["tendency_distribution"]
+        export_stacked_bar_chart_for_modal_category_tendency(distribution, output_root_dir, result_descriptor)
+    else:
+        # Export dendrogram
+        dendrogram = result["dendrogram"]
+        with timed("plotting"):
+            fig = dendrogram.plot_dendrogram(p_cutoff=p_cutoff, result_descriptor=result_descriptor)
+        outfilename = result_descriptor.get_full_output_path(
+            output_root_dir, filename_prefix="dendrogram", filename_suffix=""
+        )
+        save_figure(fig, outfilename)
+
+        # Export stacked bar chart(s)
+        nodes_below_cutoff = dendrogram.get_nodes_below_cutoff(
+            p_cutoff, include_leaf_nodes=include_leaf_nodes_in_clusters
+        )
+        if nodes_below_cutoff == []:
+            msg = (
+                f"Exporting empty figure because no dendrogram nodes are below p_cutoff={p_cutoff} {result_descriptor}."
+            )
+            logger.warning(msg)
+            export_empty_figure(output_root_dir, result_descriptor)
+            return
+
+        if result_descriptor.analysis == "pc_freqs":
+            export_stacked_bar_chart_for_pc_freqs(nodes_below_cutoff, output_root_dir, result_descriptor)
+        # elif result_descriptor.analysis == "tendency":
+        #     # export_stacked_bar_charts_for_tendency(nodes_below_cutoff, output_root_dir, result_descriptor)
+        #     # export_individual_stacked_bar_charts_for_tendency(nodes_below_cutoff, output_root_dir, result_descriptor)
+        elif result_descriptor.analysis == "L_and_M__L5_u_M5" or result_descriptor.analysis == "L_and_M__L4_u_M4":
+            export_stacked_bar_chart_for_leaps_and_melodic_outlines(
+                nodes_below_cutoff, output_root_dir, result_descriptor
+            )
+        elif result_descriptor.analysis.phrase_ending_length is not None:
+            export_freq_distributions(
+                nodes_below_cutoff, output_root_dir, result_descriptor, index_label="phrase_ending"
+            )
+        elif result_descriptor.analysis in VERTICAL_INTERVAL_ANALYSES:
+            export_freq_distributions(
+                nodes_below_cutoff, output_root_dir, result_descriptor, index_label="vertical_interval"
+            )
+        else:
+            raise NotImplementedError()
+
+
+def export_results(
+    results,
+    output_root_dir,
+    p_cutoff=0.4,
+    include_leaf_nodes_in_clusters=True,
+    overwrite=False,
+    queue_size=2,
+    profile=None,
+):
     """
     Export analysis results as dendrogram plots and stacked bar charts
     into a folder hierarchy underneath output_root_dir.
 
     Parameters
     ----------
-    results : dict
+    results : dict or iterable
         Analysis results (as a dictionary of the form {path_stubs: {'dendrogram': <dendrogram>}}).
+        Alternatively, this can be an iterable of pairs (result_descriptor, result), such as
+        the one returned by `iter_results()`. In this case the results are consumed in a
+        background thread via a bounded queue, so that the calculation of the next results
+        overlaps with the export of the current one. Note that `iter_results()` starts its
+        worker processes (if any) when it is called, so they are never forked from the
+        background thread.
     output_root_dir : str
         Path to the root directory under which the results will be exported.
     p_cutoff : float
@@ -144,46 +270,35 @@ def export_results(results, output_root_dir, p_cutoff=0.4, include_leaf_nodes_in
         leaf node. Otherwise include only proper clusters (with at least two leaf nodes). Default: True.
     overwrite : bool
         If True, delete the output root folder (if it exists) before exporting results. Default: False.
+    queue_size : int
+        Maximum number of calculated results which are waiting to be exported at any time
+        (only relevant if `results` is an iterable rather than a dictionary). Default: 2.
+    profile : bool, optional
+        If True, record a separate profile for each pipeline stage and each result (including
+        the calculation of the results if `results` is an iterable) and write them to the folder
+        `profiles/p_cutoff_<p_cutoff>` underneath output_root_dir (see `Profiler`). If None (the
+        default), profiling is enabled if the environment variable CHANTSTATS_PROFILE is set.
+        To profile several calls together, use `profiler.session()` instead.
     """
     # Tweak output root folder
     p_cutoff_path_stub = f"p_cutoff_{p_cutoff:.2f}"
+    profiles_dir = os.path.join(output_root_dir, "profiles", p_cutoff_path_stub)
     output_root_dir = os.path.join(output_root_dir, p_cutoff_path_stub)
 
-    for result_descriptor in results.keys():
-        output_dir = result_descriptor.get_output_dir(output_root_dir)
-        os.makedirs(output_dir, exist_ok=True)
-        logger.info(f"Exporting results to folder: {output_dir}")
+    if profile is None:
+        profile = is_profiling_requested_by_env() and not profiler.enabled
 
-        if result_descriptor.analysis == "tendency":
-            distribution = results[result_descriptor]["tendency_distribution"]
-            export_stacked_bar_chart_for_modal_category_tendency(distribution, output_root_dir, result_descriptor)
+    with profiler.session(profiles_dir) if profile else contextlib.nullcontext():
+        if isinstance(results, Mapping):
+            results_iter = iter(results.items())
         else:
-            # Export dendrogram
-            dendrogram = results[result_descriptor]["dendrogram"]
-            fig = dendrogram.plot_dendrogram(p_cutoff=p_cutoff, result_descriptor=result_descriptor)
-            outfilename = result_descriptor.get_full_output_path(
-                output_root_dir, filename_prefix="dendrogram", filename_suffix=""
-            )
-            fig.savefig(outfilename)
+            results_iter = iter_in_background_thread(results, maxsize=queue_size)
 
-            # Export stacked bar chart(s)
-            nodes_below_cutoff = dendrogram.get_nodes_below_cutoff(
-                p_cutoff, include_leaf_nodes=include_leaf_nodes_in_clusters
+        for result_descriptor, result in results_iter:
+            export_result(
+                result_descriptor,
+                result,
+                output_root_dir,
+                p_cutoff=p_cutoff,
+                include_leaf_nodes_in_clusters=include_leaf_nodes_in_clusters,
             )
-            if nodes_below_cutoff == []:
-                msg = f"Exporting empty figure because no dendrogram nodes are below p_cutoff={p_cutoff} {result_descriptor}."
-                logger.warning(msg)
-                export_empty_figure(output_root_dir, result_descriptor)
-                continue
-
-            if result_descriptor.analysis == "pc_freqs":
-                export_stacked_bar_chart_for_pc_freqs(nodes_below_cutoff, output_root_dir, result_descriptor)
-            # elif result_descriptor.analysis == "tendency":
-            #     # export_stacked_bar_charts_for_tendency(nodes_below_cutoff, output_root_dir, result_descriptor)
-            #     # export_individual_stacked_bar_charts_for_tendency(nodes_below_cutoff, output_root_dir, result_descriptor)
-            elif result_descriptor.analysis == "L_and_M__L5_u_M5" or result_descriptor.analysis == "L_and_M__L4_u_M4":
-                export_stacked_bar_chart_for_leaps_and_melodic_outlines(
-                    nodes_below_cutoff, output_root_dir, result_descriptor
-                )
-            else:
-                raise NotImplementedError()
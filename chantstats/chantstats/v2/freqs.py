@@ -3,7 +3,9 @@ import textwrap
 from collections import Counter
 from .leaps_and_melodic_outlines import L5M5, L5M5inMD, L4M4, L4M4inMD
 from .mode_degree import ModeDegree
+from .phrase_endings import PhraseEnding, PhraseEndingInMD
 from .pitch_class import PC
+from .vertical_intervals import VerticalInterval, SimpleVerticalInterval
 
 
 class BaseFreqsMeta(type):
@@ -43,6 +45,18 @@ class BaseFreqs(metaclass=BaseFreqsMeta):
         else:  # pragma: no cover
             raise ValueError(f"Cannot instantiate {self.__class__.__name__} from object: {list_or_freqs}")
 
+    @classmethod
+    def from_counts(cls, counts):
+        """
+        Instantiate from a mapping {value: count} (for example a `collections.Counter`)
+        instead of a list containing each value as many times as it occurs.
+        """
+        if not set(counts).issubset(cls.ALLOWED_VALUES):
+            raise ValueError(
+                f"Unexpected values: {set(counts)}. Must be a subset of allowed values: {cls.ALLOWED_VALUES}"
+            )
+        return cls(pd.Series(dict(counts), index=cls.ALLOWED_VALUES).fillna(0, downcast="infer"))
+
     def __add__(self, other):
         assert isinstance(other, self.__class__)
         return self.__class__(self.abs_freqs + other.abs_freqs)
@@ -88,6 +102,30 @@ class L4M4inMDFreqs(BaseFreqs):
     ALLOWED_VALUES = L4M4inMD.allowed_values
 
 
+class PhraseEnding2Freqs(BaseFreqs):
+    ALLOWED_VALUES = PhraseEnding.allowed_values[2]
+
+
+class PhraseEnding2inMDFreqs(BaseFreqs):
+    ALLOWED_VALUES = PhraseEndingInMD.allowed_values[2]
+
+
+class PhraseEnding3Freqs(BaseFreqs):
+    ALLOWED_VALUES = PhraseEnding.allowed_values[3]
+
+
+class PhraseEnding3inMDFreqs(BaseFreqs):
+    ALLOWED_VALUES = PhraseEndingInMD.allowed_values[3]
+
+
+class VerticalIntervalFreqs(BaseFreqs):
+    ALLOWED_VALUES = VerticalInterval.allowed_values
+
+
+class SimpleVerticalIntervalFreqs(BaseFreqs):
+    ALLOWED_VALUES = SimpleVerticalInterval.allowed_values
+
+
 # def convert_pc_based_freqs_to_mode_degree_based_freqs(freqs, *, base_pc):
 #     assert isinstance(freqs, BaseFreqs)
 #     abs_freqs = freqs.abs_freqs
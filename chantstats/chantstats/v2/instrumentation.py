@@ -0,0 +1,454 @@
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from time import perf_counter, time
+from .logging import logger
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None  # not available on Windows
+
+__all__ = ["Instrumentation", "instrumentation", "timed", "instrumented", "increment", "tagged", "format_tag"]
+
+#
+# Tag which is attached to all timings recorded in the current context (unless a
+# timer is given an explicit tag). This is a context variable so that threads
+# (e.g. the workers of a run plan) each have their own current tag.
+#
+_current_tag = contextvars.ContextVar("chantstats_instrumentation_tag", default=None)
+
+
+class _NullTimer:
+    """
+    Context manager which does nothing (returned by `timed()` if instrumentation is disabled).
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+def format_tag(obj):
+    """
+    Return the string under which timings for `obj` are reported. For a ResultDescriptor
+    this is its output directory together with the modal category, which identifies the
+    result uniquely (e.g. 'plainchant_sequences/pc_freqs/.../pcs/06.G_1.final').
+    """
+    if obj is None or isinstance(obj, str):
+        return obj
+    if hasattr(obj, "output_dirname") and hasattr(obj, "modal_category"):
+        return "/".join([obj.output_dirname.replace(os.sep, "/"), obj.modal_category.output_path_stub_2])
+    return str(obj)
+
+
+def get_current_rss():
+    """
+    Return the current resident set size of this process in bytes (or None if it
+    can't be determined on this platform).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def get_peak_rss():
+    """
+    Return the peak resident set size of this process in bytes (or None if it can't be determined).
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024  # bytes on macOS, kilobytes on Linux
+
+
+def _count_open_figures():
+    # Only check for figures if matplotlib has been imported already (so that we don't import it here).
+    plt = sys.modules.get("matplotlib.pyplot")
+    return len(plt.get_fignums()) if plt is not None else 0
+
+
+class _Timer:
+    def __init__(self, instr, stage, tag):
+        self.instr = instr
+        self.stage = stage
+        self.tag = tag
+
+    def __enter__(self):
+        self.memory = self.instr.memory
+        if self.memory is not None:
+            self.memory.start_section(self)
+        self.tic = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instr.record(self.stage, perf_counter() - self.tic, tag=self.tag)
+        if self.memory is not None:
+            self.memory.finish_section(self)
+        return False
+
+
+class _MemoryTracker:
+    """
+    Tracks the memory usage during each timed section (see `Instrumentation.enable()`).
+
+    For each section we record the traced memory (i.e. memory allocated by Python objects,
+    as reported by tracemalloc) and the resident set size of the process at the start and
+    end, and the peak values in between. The peaks are sampled by a background thread,
+    except that the peak traced memory is exact if a new overall peak was reached during
+    the section. Note that all of these are properties of the whole process, so sections
+    running concurrently in different threads affect each other.
+
+    Tracemalloc snapshots are only taken when the tracking starts (or is cleared) and when
+    a report is requested, because comparing snapshots of a large heap is very expensive.
+    Their difference gives the allocation sites of the memory retained in between. The time
+    spent by the tracker itself (e.g. taking snapshots) is reported as its overhead.
+    """
+
+    def __init__(self, *, top_allocation_sites, sampling_interval):
+        self.top_allocation_sites = top_allocation_sites
+        self.sampling_interval = sampling_interval
+        self.started_tracemalloc = not tracemalloc.is_tracing()
+        if self.started_tracemalloc:
+            tracemalloc.start()
+        self._lock = threading.Lock()
+        self._active_sections = set()
+        self.stats = {}  # {stage: dict of memory statistics}
+        self.overhead = 0.0  # seconds spent in the tracker (outside the sampler thread)
+        self._baseline_snapshot = self._take_snapshot()
+        self._stop_sampling = threading.Event()
+        self._sampler_thread = threading.Thread(target=self._sample, name="chantstats-memory", daemon=True)
+        self._sampler_thread.start()
+
+    def stop(self):
+        self._stop_sampling.set()
+        self._sampler_thread.join()
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+
+    def clear(self):
+        with self._lock:
+            self.stats.clear()
+            self.overhead = 0.0
+        self._baseline_snapshot = self._take_snapshot()
+
+    def _add_overhead(self, tic):
+        with self._lock:
+            self.overhead += perf_counter() - tic
+
+    def _take_snapshot(self):
+        if self.top_allocation_sites == 0:
+            return None
+        tic = perf_counter()
+        # Ignore the memory used by the snapshots themselves.
+        filters = [tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__)]
+        snapshot = tracemalloc.take_snapshot().filter_traces(filters)
+        self._add_overhead(tic)
+        return snapshot
+
+    def _sample(self):
+        while not self._stop_sampling.wait(self.sampling_interval):
+            traced = tracemalloc.get_traced_memory()[0]
+            rss = get_current_rss()
+            with self._lock:
+                for section in self._active_sections:
+                    section.peak_traced = max(section.peak_traced, traced)
+                    if rss is not None:
+                        section.peak_rss = max(section.peak_rss, rss)
+
+    def start_section(self, section):
+        tic = perf_counter()
+        section.traced_before, section.overall_peak_traced_before = tracemalloc.get_traced_memory()
+        section.rss_before = get_current_rss()
+        section.peak_traced = section.traced_before
+        section.peak_rss = section.rss_before or 0
+        with self._lock:
+            self._active_sections.add(section)
+        self._add_overhead(tic)
+
+    def finish_section(self, section):
+        tic = perf_counter()
+        traced_after, overall_peak_traced_after = tracemalloc.get_traced_memory()
+        rss_after = get_current_rss()
+        with self._lock:
+            self._active_sections.discard(section)
+
+        peak_traced = max(section.peak_traced, traced_after)
+        if overall_peak_traced_after > section.overall_peak_traced_before:
+            peak_traced = max(peak_traced, overall_peak_traced_after)
+        open_figures = _count_open_figures()
+
+        with self._lock:
+            stats = self.stats.setdefault(
+                section.stage,
+                {
+                    "count": 0,
+                    "peak_traced": 0,
+                    "peak_traced_increase": 0,
+                    "retained_traced": 0,
+                    "peak_rss": 0,
+                    "peak_rss_increase": 0,
+                    "retained_rss": 0,
+                    "max_open_figures": 0,
+                },
+            )
+            stats["count"] += 1
+            stats["peak_traced"] = max(stats["peak_traced"], peak_traced)
+            stats["peak_traced_increase"] = max(stats["peak_traced_increase"], peak_traced - section.traced_before)
+            stats["retained_traced"] += traced_after - section.traced_before
+            if rss_after is not None and section.rss_before is not None:
+                peak_rss = max(section.peak_rss, rss_after)
+                stats["peak_rss"] = max(stats["peak_rss"], peak_rss)
+                stats["peak_rss_increase"] = max(stats["peak_rss_increase"], peak_rss - section.rss_before)
+                stats["retained_rss"] += rss_after - section.rss_before
+            stats["max_open_figures"] = max(stats["max_open_figures"], open_figures)
+        self._add_overhead(tic)
+
+    def get_top_allocation_sites(self):
+        """
+        Return the allocation sites which retained the most memory since the tracking started.
+        """
+        if self._baseline_snapshot is None:
+            return []
+        snapshot = self._take_snapshot()
+        tic = perf_counter()
+        diff = snapshot.compare_to(self._baseline_snapshot, "lineno")
+        sites = [
+            {"site": f"{x.traceback[0].filename}:{x.traceback[0].lineno}", "size": x.size_diff, "count": x.count_diff}
+            for x in diff[: self.top_allocation_sites]
+            if x.size_diff > 0
+        ]
+        self._add_overhead(tic)
+        return sites
+
+    def get_report(self):
+        top_allocation_sites = self.get_top_allocation_sites()
+        with self._lock:
+            return {
+                "stages": {stage: dict(stats) for stage, stats in sorted(self.stats.items())},
+                "top_allocation_sites": top_allocation_sites,
+                "overhead": {"seconds": self.overhead, "tracemalloc_memory": tracemalloc.get_tracemalloc_memory()},
+            }
+
+
+class _TagContext:
+    def __init__(self, tag):
+        self.tag = tag
+
+    def __enter__(self):
+        self.token = _current_tag.set(self.tag)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current_tag.reset(self.token)
+        return False
+
+
+class Instrumentation:
+    """
+    Collects wall-clock timings and counters for the various stages of a run (loading the
+    pieces, extracting the analysis inputs and their features, calculating distances and
+    linkages, constructing dendrogram nodes, plotting, saving figures, ...).
+
+    Instrumentation is disabled by default, in which case the timers and counters return
+    immediately without recording anything. Use `enable()` and then `get_report()` or
+    `write_report()` at the end of the run to obtain a machine-readable summary. Note that
+    timings are recorded per stage and stages can be nested (for example, `plotting`
+    includes the time needed by the plotting functions themselves but not `savefig`,
+    whereas a run plan stage includes everything that runs within it). Timings recorded
+    in worker processes (when using `workers > 1`) are not collected.
+
+    Optionally, the memory usage of each stage can be tracked as well (see `enable()`).
+    The report then additionally contains the peak and retained memory for each stage
+    (all values are in bytes), together with the allocation sites of the memory retained
+    during the run and the overhead of the memory tracking itself.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.memory = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __repr__(self):
+        status = "enabled" if self.enabled else "disabled"
+        return f"<Instrumentation ({status}): {len(self._timings)} stages, {len(self.counters)} counters>"
+
+    def enable(self, *, memory=False, top_allocation_sites=10, memory_sampling_interval=0.01):
+        """
+        Enable the instrumentation.
+
+        Parameters
+        ----------
+        memory : bool
+            If True, also track the memory usage of each timed section (using tracemalloc and
+            by sampling the resident set size of the process). Note that this slows down the
+            run considerably, because tracemalloc records every allocation.
+        top_allocation_sites : int
+            Number of allocation sites of retained memory to report. These are obtained by
+            comparing tracemalloc snapshots taken when the tracking starts and when the report
+            is created (which is expensive for a large heap). Set this to 0 to skip the snapshots.
+        memory_sampling_interval : float
+            Interval (in seconds) at which the peak memory usage is sampled.
+        """
+        self.enabled = True
+        if memory and self.memory is None:
+            self.memory = _MemoryTracker(
+                top_allocation_sites=top_allocation_sites, sampling_interval=memory_sampling_interval
+            )
+
+    def disable(self):
+        self.enabled = False
+        self.disable_memory_tracking()
+
+    def disable_memory_tracking(self):
+        if self.memory is not None:
+            memory, self.memory = self.memory, None
+            self._memory_report = memory.get_report()
+            memory.stop()
+
+    def reset(self):
+        with self._lock:
+            self._timings = {}  # {stage: {tag: [count, total, min, max]}}
+            self.counters = Counter()
+            self._start_time = time()
+            self._memory_report = None
+        if self.memory is not None:
+            self.memory.clear()
+
+    def record(self, stage, seconds, *, tag=None):
+        """
+        Record a single timing for the given stage (and tag).
+        """
+        with self._lock:
+            stats = self._timings.setdefault(stage, {}).get(tag)
+            if stats is None:
+                self._timings[stage][tag] = [1, seconds, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = min(stats[2], seconds)
+                stats[3] = max(stats[3], seconds)
+
+    def timed(self, stage, tag=None):
+        """
+        Context manager which records the time spent in its body under the given stage.
+        If no tag is given, the current tag (see `tagged()`) is used.
+        """
+        if not self.enabled:
+            return _null_timer
+        return _Timer(self, stage, format_tag(tag) if tag is not None else _current_tag.get())
+
+    def instrumented(self, stage):
+        """
+        Decorator which records the time spent in each call of the decorated function under the
+        given stage. Whether the timing is recorded is decided at call time, so this can be applied
+        at import time (when instrumentation is usually still disabled).
+        """
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Timer(self, stage, _current_tag.get()):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def tagged(self, tag):
+        """
+        Context manager which attaches the given tag (e.g. a ResultDescriptor) to all timings
+        recorded in its body.
+        """
+        if not self.enabled:
+            return _null_timer
+        return _TagContext(format_tag(tag))
+
+    def increment(self, counter, n=1):
+        """
+        Increase the given counter by `n`.
+        """
+        if self.enabled:
+            with self._lock:
+                self.counters[counter] += n
+
+    def get_report(self):
+        """
+        Return a dictionary summarising the recorded timings and counters. For each stage
+        it contains the number of calls, total/min/mean/max duration (in seconds), as well
+        as the same statistics for each tag which occurred in this stage.
+
+        If memory tracking was enabled, the report also contains the peak RSS of the process
+        and the following values for each stage: the largest peak of the traced memory and RSS
+        during any of its sections (absolute, and relative to the start of the section), the
+        memory retained by all of its sections (i.e., the sum of the differences between the
+        end and start of each section), and the largest number of open matplotlib figures at
+        the end of a section. In addition, it contains the allocation sites which retained the
+        most memory since the tracking started, and the overhead of the tracking (the time spent
+        in the tracker and the memory used by tracemalloc itself).
+        """
+
+        def summarise(stats):
+            count, total, min_, max_ = stats
+            return {"count": count, "total": total, "min": min_, "mean": total / count, "max": max_}
+
+        def combine(stats_per_tag):
+            all_stats = list(stats_per_tag.values())
+            return [
+                sum(s[0] for s in all_stats),
+                sum(s[1] for s in all_stats),
+                min(s[2] for s in all_stats),
+                max(s[3] for s in all_stats),
+            ]
+
+        with self._lock:
+            stages = {}
+            for stage, stats_per_tag in sorted(self._timings.items()):
+                stages[stage] = summarise(combine(stats_per_tag))
+                tags = {tag: summarise(stats) for tag, stats in stats_per_tag.items() if tag is not None}
+                if tags:
+                    stages[stage]["tags"] = dict(sorted(tags.items()))
+            report = {
+                "start_time": self._start_time,
+                "wall_time": time() - self._start_time,
+                "stages": stages,
+                "counters": dict(sorted(self.counters.items())),
+            }
+        memory_report = self.memory.get_report() if self.memory is not None else self._memory_report
+        if memory_report is not None:
+            report["memory"] = {"peak_rss": get_peak_rss(), **memory_report}
+        return report
+
+    def write_report(self, filename):
+        """
+        Write the report returned by `get_report()` to the given file (in JSON format).
+        """
+        dirname = os.path.dirname(filename)
+        if dirname != "":
+            os.makedirs(dirname, exist_ok=True)
+        with open(filename, "w") as f:
+            json.dump(self.get_report(), f, indent=2)
+        logger.info(f"Wrote instrumentation report to {filename}")
+
+
+instrumentation = Instrumentation()
+
+timed = instrumentation.timed
+instrumented = instrumentation.instrumented
+increment = instrumentation.increment
+tagged = instrumentation.tagged
@@ -1,6 +1,14 @@
+import numpy as np
 from enum import Enum
+from .logging import logger
 
-__all__ = ["IntervalType"]
+__all__ = ["IntervalType", "LargeIntervalError", "classify_intervals"]
+
+
+class LargeIntervalError(Exception):
+    """
+    Indicates unexpectedly large intervals between consecutive notes.
+    """
 
 
 class IntervalType(str, Enum):
@@ -18,3 +26,43 @@ class IntervalType(str, Enum):
 
 
 IntervalType.allowed_values = list(IntervalType)
+
+# Smallest interval (in semitones) which counts as a leap rather than a step
+MIN_SEMITONES_LEAP = {"v1": 3, "v2": 4}
+
+
+def classify_intervals(semitones, *, version="v1"):
+    """
+    Classify the given intervals as common tones, steps or leaps in a single vectorized pass.
+    This uses the same thresholds as `NotePair.interval_type_v1` and `NotePair.interval_type_v2`.
+
+    Parameters
+    ----------
+    semitones : array-like
+        Sizes of the intervals in semitones (the sign is ignored).
+    version : str
+        Either "v1" (minor thirds are leaps) or "v2" (minor thirds are steps). The approaches
+        analysis uses "v1" for analysis="approaches" and "v2" for analysis="approaches__interval_types_v2".
+
+    Returns
+    -------
+    numpy.ndarray
+        Integer array with the position of each interval type in `IntervalType.allowed_values`
+        (i.e. 0 for common tones, 1 for steps and 2 for leaps).
+    """
+    try:
+        min_semitones_leap = MIN_SEMITONES_LEAP[version]
+    except KeyError:
+        raise ValueError(f"Invalid interval type version: '{version}'")
+
+    semitones = np.abs(np.asarray(semitones))
+    if (semitones > 12).any():
+        raise LargeIntervalError(
+            f"Found {(semitones > 12).sum()} intervals larger than an octave "
+            f"(largest: {semitones.max():g} semitones). Please investigate!"
+        )
+    num_octaves = (semitones == 12).sum()
+    if num_octaves > 0:
+        logger.warning(f"Found {num_octaves} intervals which are an octave (these are classified as leaps).")
+
+    return (semitones > 0).astype(np.intp) + (semitones >= min_semitones_leap)
@@ -0,0 +1,193 @@
+from collections import OrderedDict
+from .analysis_functions import calculate_counts_for_analyses_counted_together
+from .analysis_type import AnalysisType
+from .instrumentation import increment, instrumented
+from .logging import logger
+from .parallel import map_over_shared_inputs
+from .profiling import profiled_function
+from .unit import UnitType
+
+__all__ = [
+    "ItemCache",
+    "default_item_cache",
+    "get_counts_for_units",
+    "get_counts_for_items",
+    "lookup_counts",
+    "put_counts",
+]
+
+
+class ItemCache:
+    """
+    Bounded cache for the per-item counts which are the input for the various
+    analyses (see `calculate_counts_for_units()` in `analysis_functions.py`).
+
+    Entries are keyed by `(item.cache_key, analysis, unit)`, where `item.cache_key`
+    identifies an analysis item by the file of its piece and its position within
+    the piece (e.g. its phrase range). This means that items are recognised even
+    if they are re-created (for example when grouping the same monomodal sections
+    by final and by final and ambitus, or in repeated calls to `calculate_results()`).
+    If the cache contains more than `maxsize` entries then the least recently used
+    ones are evicted.
+
+    Note that the cache assumes that the contents of a piece don't change while
+    it is in use. Call `clear()` after modifying any of the input files.
+    """
+
+    def __init__(self, maxsize=100_000):
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"<ItemCache: {len(self)} entries (maxsize={self.maxsize}), {self.hits} hits, {self.misses} misses>"
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """
+        Return the cached value for `key` (or None if there is no entry for this key).
+        """
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        num_lookups = self.hits + self.misses
+        return self.hits / num_lookups if num_lookups > 0 else None
+
+    def log_stats(self, prefix="Item cache"):
+        hit_rate = "n/a" if self.hit_rate is None else f"{100 * self.hit_rate:.1f}%"
+        logger.info(
+            f"{prefix}: {self.hits} hits, {self.misses} misses (hit rate: {hit_rate}); "
+            f"{len(self)} entries (maxsize={self.maxsize})"
+        )
+
+
+default_item_cache = ItemCache()
+
+
+def get_counts_for_units(item, *, analysis, units, cache=default_item_cache):
+    """
+    Same as `calculate_counts_for_units()`, but the results are looked up
+    in (and added to) the given cache. If `cache` is None, the counts are
+    always calculated from scratch.
+    """
+    return get_counts_for_items([item], analysis=analysis, units=units, cache=cache)[0]
+
+
+def lookup_counts(item, *, analysis, units, cache=default_item_cache):
+    """
+    Return the cached counts for the given item as a dictionary of the form {unit: Counter},
+    or None if they are not all in the cache (or if the item has no stable identity).
+    """
+    item_key = getattr(item, "cache_key", None) if cache is not None else None
+    if item_key is None:
+        return None
+    counts = {unit: cache.get((item_key, AnalysisType(analysis), UnitType(unit))) for unit in units}
+    return counts if all(x is not None for x in counts.values()) else None
+
+
+def put_counts(item, counts_by_analysis, *, units, cache=default_item_cache):
+    """
+    Add the counts for the given item (as returned by `calculate_counts_for_analyses_counted_together()`)
+    to the cache. This does nothing if `cache` is None or if the item has no stable identity.
+    """
+    item_key = getattr(item, "cache_key", None) if cache is not None else None
+    if item_key is None:
+        return
+    for analysis, counts in counts_by_analysis.items():
+        for unit in units:
+            cache.put((item_key, analysis, UnitType(unit)), counts[unit])
+
+
+def _calculate_counts_for_item(args):
+    # Helper function which unpacks its argument (this is needed for map_over_shared_inputs()).
+    item, analysis, units = args
+    return calculate_counts_for_analyses_counted_together(item, analysis=analysis, units=units)
+
+
+@instrumented("feature_extraction")
+@profiled_function("feature_extraction")
+def get_counts_for_items(items, *, analysis, units, cache=default_item_cache, workers=None):
+    """
+    Return a list containing the counts for each of the given items (in the same order),
+    where each entry is a dictionary of the form {unit: Counter}.
+
+    Any counts which are not yet in the cache are calculated (in parallel if
+    `workers` is greater than 1) and added to the cache. Each item is only
+    calculated once, even if it occurs multiple times in `items`. Items
+    without a stable identity (i.e., whose `cache_key` is None) are always
+    calculated from scratch.
+
+    Counts which are obtained in the same pass over an item (e.g. the phrase
+    endings of all lengths, see `get_analyses_counted_together()`) are added
+    to the cache as well, so they are only calculated once per item.
+    """
+    analysis = AnalysisType(analysis)
+    units = [UnitType(unit) for unit in units]
+
+    indices_by_key = OrderedDict()  # {item_key: [indices of all items with this key]}
+    uncached_indices = []
+    for idx, item in enumerate(items):
+        item_key = getattr(item, "cache_key", None) if cache is not None else None
+        if item_key is None:
+            uncached_indices.append(idx)
+        else:
+            indices_by_key.setdefault(item_key, []).append(idx)
+
+    def lookup(item_key):
+        counts = {unit: cache.get((item_key, analysis, unit)) for unit in units}
+        return counts if all(x is not None for x in counts.values()) else None
+
+    results = [None] * len(items)
+    keys_to_calculate = []
+    for item_key, indices in indices_by_key.items():
+        results[indices[0]] = lookup(item_key)
+        if results[indices[0]] is None:
+            keys_to_calculate.append(item_key)
+
+    indices_to_calculate = [indices_by_key[item_key][0] for item_key in keys_to_calculate] + uncached_indices
+    inputs = [(items[idx], analysis, units) for idx in indices_to_calculate]
+    calculated_counts = map_over_shared_inputs(_calculate_counts_for_item, inputs, workers=workers)
+    increment("items_counted", len(indices_to_calculate))
+    increment("items_served_from_cache", len(items) - len(indices_to_calculate))
+    for idx, counts_by_analysis in zip(indices_to_calculate, calculated_counts):
+        results[idx] = counts_by_analysis[analysis]
+    for item_key, counts_by_analysis in zip(keys_to_calculate, calculated_counts):
+        for other_analysis, counts in counts_by_analysis.items():
+            for unit in units:
+                cache.put((item_key, other_analysis, unit), counts[unit])
+
+    # Any repeated occurrences of an item are served from the cache.
+    for item_key, indices in indices_by_key.items():
+        for idx in indices[1:]:
+            results[idx] = lookup(item_key) or results[indices[0]]
+
+    return results
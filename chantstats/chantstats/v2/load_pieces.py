@@ -3,14 +3,26 @@ from .responsorial_chants import ResponsorialChantPieces
 from .old_code.organum_piece import OrganumPieces, OrganumPhrases
 
 
-def load_pieces(repertoire_and_genre, cfg, filename_pattern=None):
+def load_pieces(repertoire_and_genre, cfg, filename_pattern=None, *, metadata_index=None, **analysis_input_filters):
+    """
+    Load the pieces for the given repertoire and genre.
+
+    If a `metadata_index` is given, the metadata of the loaded pieces is added to it, and
+    any `analysis_input_filters` (`min_num_phrases_per_monomodal_section`, etc., with the
+    same meaning as for `get_analysis_inputs()`) are used to skip pieces which the index
+    knows don't contain any qualifying analysis inputs. Note that this is only safe if
+    the filters are at most as strict as those later passed to `get_analysis_inputs()`.
+    A ValueError is raised if any of the filters don't apply to the given repertoire and
+    genre (see `ANALYSIS_INPUT_FILTERS` in `metadata_index.py`).
+    """
+    kwargs = dict(filename_pattern=filename_pattern, metadata_index=metadata_index, **analysis_input_filters)
     if repertoire_and_genre == "plainchant_sequences":
-        return PlainchantSequencePieces.from_musicxml_files(cfg, filename_pattern=filename_pattern)
+        return PlainchantSequencePieces.from_musicxml_files(cfg, **kwargs)
     elif repertoire_and_genre == "responsorial_chants":
-        return ResponsorialChantPieces.from_musicxml_files(cfg, filename_pattern=filename_pattern)
+        return ResponsorialChantPieces.from_musicxml_files(cfg, **kwargs)
     elif repertoire_and_genre == "organum_pieces":
-        return OrganumPieces.from_musicxml_files(cfg, filename_pattern=filename_pattern)
+        return OrganumPieces.from_musicxml_files(cfg, **kwargs)
     elif repertoire_and_genre == "organum_phrases":
-        return OrganumPhrases.from_musicxml_files(cfg, filename_pattern=filename_pattern)
+        return OrganumPhrases.from_musicxml_files(cfg, **kwargs)
     else:
         raise NotImplementedError()
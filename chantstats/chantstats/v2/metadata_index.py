@@ -0,0 +1,270 @@
+import os
+import pandas as pd
+import sqlite3
+from enum import Enum
+from .logging import logger
+from .repertoire_and_genre import RepertoireAndGenreType
+
+__all__ = ["MetadataIndex", "ANALYSIS_INPUT_FILTERS", "check_analysis_input_filters"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pieces (
+    filename TEXT PRIMARY KEY,  -- absolute path of the MusicXML file
+    mtime REAL NOT NULL,  -- modification time of the file when it was indexed
+    repertoire_and_genre TEXT NOT NULL,
+    descr TEXT,
+    final TEXT,
+    num_phrases INTEGER,
+    num_notes INTEGER
+);
+CREATE TABLE IF NOT EXISTS items (
+    filename TEXT NOT NULL REFERENCES pieces(filename) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    mode TEXT,  -- grouping of the phrases into monomodal sections ("final" or "final_and_ambitus")
+    descr TEXT,
+    final TEXT,
+    ambitus TEXT,
+    num_phrases INTEGER,
+    num_notes INTEGER,
+    phrase_numbers TEXT  -- comma-separated
+);
+CREATE INDEX IF NOT EXISTS items_by_kind ON items (kind, filename);
+"""
+
+# Values of the `kind` column in the `items` table
+PHRASE = "phrase"
+MONOMODAL_SECTION = "monomodal_section"
+STANZA = "stanza"
+ORGANUM_PHRASE = "organum_phrase"
+ORGANUM_PURUM_DUPLUM_PART = "organum_purum_duplum_part"
+
+#
+# Filters for the analysis inputs (with the same meaning as for `get_analysis_inputs()`)
+# which apply to each repertoire and genre, i.e. which can be used to skip files.
+#
+ANALYSIS_INPUT_FILTERS = {
+    RepertoireAndGenreType.PLAINCHANT_SEQUENCES: [
+        "min_num_phrases_per_monomodal_section",
+        "min_num_notes_per_monomodal_section",
+    ],
+    RepertoireAndGenreType.RESPONSORIAL_CHANTS: [],
+    RepertoireAndGenreType.ORGANUM_PIECES: [],
+    RepertoireAndGenreType.ORGANUM_PHRASES: ["min_num_notes_per_organum_phrase"],
+}
+
+
+def check_analysis_input_filters(repertoire_and_genre, **filters):
+    """
+    Raise a ValueError if any of the given filters (other than those which are None)
+    don't apply to the analysis inputs of the given repertoire and genre.
+    """
+    rep_and_genre = RepertoireAndGenreType(repertoire_and_genre)
+    allowed = ANALYSIS_INPUT_FILTERS[rep_and_genre]
+    invalid = [name for name, value in filters.items() if value is not None and name not in allowed]
+    if invalid != []:
+        raise ValueError(
+            f"Filters {invalid} don't apply to {rep_and_genre.value} (allowed filters: {allowed or 'none'})."
+        )
+
+
+def _to_str(value):
+    if value is None:
+        return None
+    elif isinstance(value, Enum):
+        return str(value.value)
+    else:
+        return str(value)
+
+
+def _make_item_row(filename, kind, item, *, phrase_numbers, mode=None):
+    return (
+        filename,
+        kind,
+        mode,
+        getattr(item, "descr", None),
+        _to_str(getattr(item, "final", None)),
+        _to_str(getattr(item, "ambitus", None)),
+        len(phrase_numbers),
+        len(item.notes),
+        ",".join(str(n) for n in phrase_numbers),
+    )
+
+
+def extract_metadata(piece, repertoire_and_genre):
+    """
+    Return the metadata of the given piece and of its analysis items, i.e. a pair
+    `(piece_row, item_rows)` containing the rows for the tables `pieces` and `items`.
+    """
+    rep_and_genre = RepertoireAndGenreType(repertoire_and_genre)
+    filename = piece.filename_full
+
+    item_rows = []
+    if rep_and_genre in ["plainchant_sequences", "responsorial_chants"]:
+        item_rows.extend(_make_item_row(filename, PHRASE, p, phrase_numbers=[p.phrase_number]) for p in piece.phrases)
+        num_notes = sum(len(p.notes) for p in piece.phrases)
+        final = piece.phrases[-1].final
+    if rep_and_genre == "plainchant_sequences":
+        for mode, enforce_same_phrase_ambitus in [("final", False), ("final_and_ambitus", True)]:
+            sections = piece.get_monomodal_sections(
+                enforce_same_phrase_ambitus=enforce_same_phrase_ambitus, min_num_phrases=0, min_num_notes=0
+            )
+            item_rows.extend(
+                _make_item_row(
+                    filename,
+                    MONOMODAL_SECTION,
+                    s,
+                    phrase_numbers=list(range(s.idx_start, s.idx_end + 1)),
+                    mode=mode,
+                )
+                for s in sections
+            )
+    elif rep_and_genre == "responsorial_chants":
+        item_rows.extend(
+            _make_item_row(filename, STANZA, s, phrase_numbers=s.phrase_numbers)
+            for s in piece.get_stanzas_without_modulatory_phrases()
+        )
+    elif rep_and_genre in ["organum_pieces", "organum_phrases"]:
+        item_rows.extend(
+            _make_item_row(filename, ORGANUM_PHRASE, p, phrase_numbers=[p.phrase_number]) for p in piece.phrases
+        )
+        duplum_part = piece.organum_purum_duplum_part
+        item_rows.append(
+            _make_item_row(
+                filename,
+                ORGANUM_PURUM_DUPLUM_PART,
+                duplum_part,
+                phrase_numbers=[p.phrase_number for s in duplum_part.sections for p in s.phrases],
+            )
+        )
+        num_notes = len(duplum_part.notes)
+        final = piece.final
+
+    piece_row = (
+        filename,
+        os.path.getmtime(filename),
+        rep_and_genre.value,
+        getattr(piece, "descr", None) or piece.filename_short,
+        _to_str(final),
+        len(piece.phrases),
+        num_notes,
+    )
+    return piece_row, item_rows
+
+
+class MetadataIndex:
+    """
+    Index of the metadata of the pieces in the corpus and of their phrases, monomodal
+    sections, stanzas etc. (final, ambitus, number of phrases and notes, descriptions),
+    stored in a local SQLite database.
+
+    The index is filled when pieces are loaded (see the `metadata_index` argument of
+    `load_pieces()`), and it can then be used to answer simple questions about the corpus
+    without parsing any MusicXML files, for example:
+
+        >>> index = MetadataIndex("metadata.sqlite")
+        >>> index.query("SELECT descr FROM items WHERE kind = 'stanza' AND num_notes < 80")
+
+    The loaders also consult the index to skip pieces which don't contain any analysis
+    inputs satisfying the given filters (see `get_qualifying_filenames()`). Entries are
+    keyed by the absolute path of the MusicXML file and are replaced if the file has
+    been modified since it was indexed.
+    """
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        self._conn.executescript(SCHEMA)
+
+    def __repr__(self):
+        num_pieces = self._conn.execute("SELECT COUNT(*) FROM pieces").fetchone()[0]
+        return f"<MetadataIndex: '{self.path}' ({num_pieces} pieces)>"
+
+    def close(self):
+        self._conn.close()
+
+    def query(self, sql, params=()):
+        """
+        Run the given SQL query against the index and return the result as a pandas DataFrame.
+        """
+        return pd.read_sql_query(sql, self._conn, params=params)
+
+    def is_up_to_date(self, filename):
+        """
+        Return True if the index contains an entry for the given file which is newer than the file itself.
+        """
+        filename = os.path.abspath(filename)
+        row = self._conn.execute("SELECT mtime FROM pieces WHERE filename = ?", (filename,)).fetchone()
+        return row is not None and os.path.exists(filename) and row[0] >= os.path.getmtime(filename)
+
+    def add_piece(self, piece, repertoire_and_genre):
+        """
+        Add the metadata of the given piece and its analysis items to the index
+        (replacing any existing entries for the same file).
+        """
+        piece_row, item_rows = extract_metadata(piece, repertoire_and_genre)
+        with self._conn:
+            self._conn.execute("DELETE FROM pieces WHERE filename = ?", (piece_row[0],))
+            self._conn.execute("INSERT INTO pieces VALUES (?, ?, ?, ?, ?, ?, ?)", piece_row)
+            self._conn.executemany("INSERT INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", item_rows)
+
+    def add_pieces(self, pieces, repertoire_and_genre):
+        """
+        Add all given pieces whose entries are missing or out of date.
+        """
+        for piece in pieces:
+            if not self.is_up_to_date(piece.filename_full):
+                self.add_piece(piece, repertoire_and_genre)
+
+    def get_qualifying_filenames(
+        self,
+        filenames,
+        repertoire_and_genre,
+        *,
+        min_num_phrases_per_monomodal_section=None,
+        min_num_notes_per_monomodal_section=None,
+        min_num_notes_per_organum_phrase=None,
+        mode=None,
+    ):
+        """
+        Return the subset of the given files which need to be loaded to obtain all analysis inputs
+        for the given repertoire and genre that satisfy the given filters (which have the same
+        meaning as for `get_analysis_inputs()`). Files which are missing in the index (or whose
+        entry is out of date) are always included. A ValueError is raised if any of the filters
+        don't apply to the given repertoire and genre (see `ANALYSIS_INPUT_FILTERS`).
+
+        For plainchant sequences, `mode` can be given to only consider the monomodal sections
+        for this grouping; otherwise a file qualifies if it does so for any grouping.
+        """
+        rep_and_genre = RepertoireAndGenreType(repertoire_and_genre)
+        check_analysis_input_filters(
+            rep_and_genre,
+            min_num_phrases_per_monomodal_section=min_num_phrases_per_monomodal_section,
+            min_num_notes_per_monomodal_section=min_num_notes_per_monomodal_section,
+            min_num_notes_per_organum_phrase=min_num_notes_per_organum_phrase,
+        )
+        conditions = []
+        if rep_and_genre == "plainchant_sequences":
+            kind = MONOMODAL_SECTION
+            if mode is not None:
+                conditions.append(("mode", "=", _to_str(mode)))
+            if min_num_phrases_per_monomodal_section is not None:
+                conditions.append(("num_phrases", ">=", min_num_phrases_per_monomodal_section))
+            if min_num_notes_per_monomodal_section is not None:
+                conditions.append(("num_notes", ">=", min_num_notes_per_monomodal_section))
+        elif rep_and_genre == "organum_phrases":
+            kind = ORGANUM_PHRASE
+            if min_num_notes_per_organum_phrase is not None:
+                conditions.append(("num_notes", ">=", min_num_notes_per_organum_phrase))
+
+        if conditions == []:
+            return list(filenames)
+
+        sql = "SELECT DISTINCT filename FROM items WHERE kind = ?" + "".join(
+            f" AND {column} {op} ?" for column, op, _ in conditions
+        )
+        qualifying = set(row[0] for row in self._conn.execute(sql, [kind] + [value for _, _, value in conditions]))
+        result = [f for f in filenames if os.path.abspath(f) in qualifying or not self.is_up_to_date(f)]
+        if len(result) < len(filenames):
+            logger.debug(f"Skipping {len(filenames) - len(result)} files without qualifying analysis inputs.")
+        return result
@@ -2,10 +2,13 @@ import pandas as pd
 from collections import defaultdict
 from enum import Enum
 from .ambitus import AmbitusType
+from .analysis_functions import COUNTED_CLASSES, PAIR_COUNT_ANALYSES, calculate_result_from_counts
+from .analysis_type import AnalysisType
+from .item_cache import default_item_cache, get_counts_for_items
 from .pitch_class import PC
 from .unit import UnitType
 
-__all__ = ["ModalCategoryType"]
+__all__ = ["ModalCategoryType", "make_counts_dataframe"]
 
 
 class ModalCategoryType(str, Enum):
@@ -68,6 +71,32 @@ class ModalCategoryType(str, Enum):
             raise NotImplementedError(f"Unexpected grouping type: {self}")
 
 
+def make_counts_dataframe(items, counts_per_item, *, analysis, unit):
+    """
+    Return a dataframe containing the absolute counts for the given analysis and unit,
+    with one row per item (labelled by the item's description) and one column for each
+    possible value (e.g. each pitch class).
+
+    Parameters
+    ----------
+    items : list
+        Analysis inputs (e.g. monomodal sections).
+    counts_per_item : list
+        Counts for each item (as returned by `get_counts_for_items()`).
+    """
+    analysis = AnalysisType(analysis)
+    unit = UnitType(unit)
+    if analysis in PAIR_COUNT_ANALYSES:
+        raise NotImplementedError("Counts dataframe is only available for analyses based on frequencies.")
+
+    allowed_values = COUNTED_CLASSES[analysis][unit].ALLOWED_VALUES
+    return pd.DataFrame(
+        [[counts[unit].get(value, 0) for value in allowed_values] for counts in counts_per_item],
+        index=[x.descr for x in items],
+        columns=allowed_values,
+    )
+
+
 class ModalCategory:
     """
     Represents a "modal category".
@@ -99,6 +128,49 @@ class ModalCategory:
         #     raise NotImplementedError()
         return df
 
+    def calculate_counts_for_units(self, *, analysis, units, cache=default_item_cache):
+        """
+        Return a list containing the counts for each item in this modal category
+        (see `calculate_counts_for_units()` in `analysis_functions.py`). Counts
+        which have been calculated before are looked up in the given cache.
+        """
+        return get_counts_for_items(self.items, analysis=analysis, units=units, cache=cache)
+
+    def make_counts_dataframe(self, *, analysis, unit, counts_per_item=None):
+        """
+        Return a dataframe containing the absolute counts from which the results of the given
+        analysis are calculated (with one row per item, and the same columns as the dataframe
+        returned by `make_results_dataframe()`). This is only supported for analyses whose
+        results are frequency distributions.
+        """
+        if AnalysisType(analysis) in PAIR_COUNT_ANALYSES:
+            raise NotImplementedError("Counts dataframe is only available for analyses based on frequencies.")
+        counts_per_item = counts_per_item or self.calculate_counts_for_units(analysis=analysis, units=[unit])
+        return make_counts_dataframe(self.items, counts_per_item, analysis=analysis, unit=unit)
+
+    def make_results_dataframes(self, *, analysis, units, counts_per_item=None):
+        """
+        Same as `make_results_dataframe()`, but for multiple units at once. This
+        is faster than calling `make_results_dataframe()` for each unit separately
+        because the notes of each item are only processed once.
+
+        Returns
+        -------
+        dict
+            Dictionary of the form {unit: dataframe}.
+        """
+        units = [UnitType(unit) for unit in units]
+        counts_per_item = counts_per_item or self.calculate_counts_for_units(analysis=analysis, units=units)
+        return {
+            unit: pd.DataFrame(
+                {
+                    x.descr: calculate_result_from_counts(counts[unit], analysis=analysis, unit=unit)
+                    for x, counts in zip(self.items, counts_per_item)
+                }
+            ).T
+            for unit in units
+        }
+
 
 class GroupingByModalCategory:
     """
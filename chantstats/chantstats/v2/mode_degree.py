@@ -1,6 +1,7 @@
 __all__ = ["ModeDegree"]
 
 import pandas as pd
+from music21.note import Note
 from .pitch_class import PC
 
 __all__ = ["ModeDegree"]
@@ -167,6 +168,24 @@ for base_pc in df_mode_degrees.columns:
         df_mode_degrees[base_pc][pc].base_pc = base_pc
 
 
+#
+# Lookup tables {(pc, base_pc): mode_degree} for all occurring pitch classes. These allow
+# to convert PC-based results into mode-degree-based results without going back to the
+# individual notes. Note that `ModeDegree.from_note_pair()` (which is used for the
+# per-note mode degrees of each analysis item) differs from `df_mode_degrees` in a few
+# cases (e.g. for B-flat and F-sharp finals), so we need separate lookup tables for both.
+#
+mode_degrees_from_note_pairs = {
+    (pc, base_pc): ModeDegree.from_note_pair(note=Note(pc.value), base_note=Note(base_pc.value))
+    for base_pc in PC.allowed_values
+    for pc in PC.allowed_values
+}
+
+mode_degrees_from_pc_pairs = {
+    (pc, base_pc): df_mode_degrees[base_pc][pc] for base_pc in PC.allowed_values for pc in PC.allowed_values
+}
+
+
 def convert_pc_to_mode_degree(self, *, base_pc):
     return ModeDegree.from_pc_pair(pc=self, base_pc=base_pc)
 
@@ -1,15 +1,9 @@
 from music21.interval import Interval, Direction
 from music21.note import Note
-from .interval_type import IntervalType
+from .interval_type import IntervalType, LargeIntervalError
 from .logging import logger
 
 
-class LargeIntervalError(Exception):
-    """
-    Indicates unexpectedly large intervals between consecutive notes.
-    """
-
-
 class NotePair:
     def __init__(self, note1, note2):
         assert isinstance(note1, Note)
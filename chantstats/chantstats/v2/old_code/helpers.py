@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from itertools import tee
 
@@ -26,6 +27,23 @@ def group_by_contiguous_values(df, col):
     return df.groupby(value_groups)
 
 
+def get_contiguous_ranges(values):
+    """
+    Return the ranges `(start, stop)` of the runs of contiguous equal values in the
+    given array. This is the array-based equivalent of `group_by_contiguous_values()`.
+
+    Example:
+
+        >>> get_contiguous_ranges(['a', 'a', 'a', 'b', 'c', 'c', 'c', 'c', 'd', 'd'])
+        [(0, 3), (3, 4), (4, 8), (8, 10)]
+    """
+    values = np.asarray(values)
+    boundaries = np.flatnonzero(values[1:] != values[:-1]) + 1
+    starts = [0] + boundaries.tolist()
+    stops = boundaries.tolist() + [len(values)]
+    return list(zip(starts, stops)) if len(values) > 0 else []
+
+
 # def pairwise(it):
 #     it1, it2 = tee(it)
 #     next(it2)
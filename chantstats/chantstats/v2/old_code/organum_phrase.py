@@ -1,3 +1,5 @@
+import numpy as np
+import pandas as pd
 from music21.note import Note
 from .helpers import pairwise
 from ..ambitus import calculate_ambitus
@@ -5,96 +7,105 @@ from ..melodic_outline import calculate_melodic_outline_candidates, get_melodic_
 from ..mode_degree import ModeDegree
 from ..note_pair import NotePair
 from ..pitch_class import PC
+from ..vertical_intervals import calculate_vertical_intervals
 
 # from .melodic_outlines import calculate_melodic_outline_candidates
 # from .pc_pair_condprobs import PCPairCondProbs
 
 
 class OrganumPhrase:
-    def __init__(self, df, piece_filename, piece_descr_stub):
-        self.df = df
+    """
+    Phrase in an organum purum section, i.e. the duplum notes above a single tenor note.
+
+    The phrase is defined by the rows `start:stop` of the piece dataframe, and the
+    note arrays passed to the constructor are the corresponding slices of the arrays
+    of the piece (see `OrganumPiece._calculate_structure()`).
+    """
+
+    def __init__(
+        self,
+        *,
+        phrase_number,
+        offsets,
+        measures,
+        tenor_notes,
+        duplum_notes,
+        duplum_pitches,
+        tenor_pitches,
+        piece_filename,
+        piece_filename_full,
+        piece_descr_stub,
+    ):
         self.piece_filename = piece_filename
-        self.phrase_number = df["common", "phrase"].iloc[0]
-        self._run_sanity_checks()
-
-        tenor_notes = self.df["tenor", "note"].dropna().apply(lambda n: n.nameWithOctave).unique()
-        tenor_pcs = self.df["tenor", "pitch_class"].dropna().unique()
-        if len(tenor_notes) != 1 or len(tenor_pcs) != 1:
+        self.piece_filename_full = piece_filename_full
+        self.phrase_number = phrase_number
+        self.offsets = offsets
+        self.measures = measures
+
+        tenor_notes = [n for n in tenor_notes if isinstance(n, Note)]
+        tenor_note_names = sorted(set(n.nameWithOctave for n in tenor_notes))
+        tenor_pcs = sorted(set(n.name for n in tenor_notes))
+        if len(tenor_note_names) != 1 or len(tenor_pcs) != 1:
             raise RuntimeError(
-                f"[DDD] Missing or non-unique tenor PC: tenor_notes={tenor_notes}, tenor_pcs={tenor_pcs}, piece={self.piece_filename}, df={self.df}"
+                f"[DDD] Missing or non-unique tenor PC: tenor_notes={tenor_note_names}, tenor_pcs={tenor_pcs}, "
+                f"piece={self.piece_filename}, offsets={self.offsets[0]}-{self.offsets[-1]}"
             )
-        self.tenor_note = Note(tenor_notes[0])
+        self.tenor_note = Note(tenor_note_names[0])
         self.tenor_pc = tenor_pcs[0]
         # FIXME: adding the attribute 'final' is a hack; instead, we should call it 'reference_pc'
         # and also add reference_pc attributes to the other analysis input classes
         self.final = self.tenor_pc
         self.note_of_final = self.tenor_note
 
-        s_duplum_notes = self.df[("duplum", "note")]
-        if any(s_duplum_notes.isnull()):
-            raise RuntimeError("Some duplum notes in organum phrase are null: {}".format(s_duplum_notes))
-        self.duplum_notes = list(s_duplum_notes)
+        if pd.isnull(duplum_notes).any():
+            raise RuntimeError("Some duplum notes in organum phrase are null: {}".format(list(duplum_notes)))
+        self.duplum_notes = list(duplum_notes)
         self.duplum_note_pairs = [NotePair(n1, n2) for n1, n2 in pairwise(self.duplum_notes)]
 
-        self.has_voice_crossing = any([n < self.note_of_final for n in self.duplum_notes])
-        s_voice_crossing = self.df[("duplum", "note")] < self.note_of_final
-        if s_voice_crossing.any():
-            self.offset_of_first_voice_crossing = s_voice_crossing.where(s_voice_crossing == True).dropna().index[0]
-            self.idx_of_first_voice_crossing = s_voice_crossing.index.get_loc(self.offset_of_first_voice_crossing)
+        is_voice_crossing = duplum_pitches < self.note_of_final.pitch.ps
+        self.has_voice_crossing = bool(is_voice_crossing.any())
+        if self.has_voice_crossing:
+            self.idx_of_first_voice_crossing = int(np.argmax(is_voice_crossing))
+            self.offset_of_first_voice_crossing = self.offsets[self.idx_of_first_voice_crossing]
         else:
-            # self.idx_of_first_voice_crossing = len(s_voice_crossing)
-            self.offset_of_first_voice_crossing = s_voice_crossing.index[-1] + 1
-            self.idx_of_first_voice_crossing = len(s_voice_crossing)
+            self.idx_of_first_voice_crossing = len(self.offsets)
+            self.offset_of_first_voice_crossing = self.offsets[-1] + 1
 
-        self.notes = list(s_duplum_notes[s_duplum_notes.index < self.offset_of_first_voice_crossing])
+        self.notes = self.duplum_notes[: self.idx_of_first_voice_crossing]
         self.pitch_classes = [PC.from_note(n) for n in self.notes]
-        self.note_pairs = [NotePair(n1, n2) for n1, n2 in pairwise(self.notes)]
+        self.note_pairs = self.duplum_note_pairs[: max(self.idx_of_first_voice_crossing - 1, 0)]
         self.mode_degrees = [ModeDegree.from_note_pair(note=n, base_note=self.note_of_final) for n in self.notes]
         self.pc_pairs = list(zip(self.pitch_classes, self.pitch_classes[1:]))
         self.mode_degree_pairs = list(zip(self.mode_degrees, self.mode_degrees[1:]))
+        self.vertical_intervals = calculate_vertical_intervals(duplum_pitches, tenor_pitches)
 
-        # # self.notes = list(self.df["duplum", "note"])
-        # # self.pitch_classes = [PC.from_note(n) for n in self.notes]
-        # self.mode_degrees = [ModeDegree.from_note_pair(note=n, base_note=self.note_of_final) for n in self.notes]
-        # self.pc_pairs = list(zip(self.pitch_classes, self.pitch_classes[1:]))
-        # # self.note_pairs = [NotePair(n1, n2) for (n1, n2) in zip(self.notes, self.notes[1:])]
-        # self.mode_degree_pairs = list(zip(self.mode_degrees, self.mode_degrees[1:]))
-
-        # self.lowest_note = min(self.notes)
-        # self.ambitus = calculate_ambitus(self)
-
-        # self._melodic_outline_candidates = calculate_melodic_outline_candidates(self.notes, self.note_pairs)
         self._melodic_outline_candidates = calculate_melodic_outline_candidates(
             self.duplum_notes, self.duplum_note_pairs, before_idx=self.idx_of_first_voice_crossing
         )
+        self.descr = f"{piece_descr_stub}.p{self.phrase_number:02d}.{self._measure_descr_short}"
 
-        if not df["common", "phrase"].isnull().any():
-            # FIXME: the only reason the phrase numbers can be null here is because we use this class
-            # when constructing the organum piece dataframe in calculate_dataframe_from_music21_stream().
-            # The values should only be null the first time around, and should be non-null the second time.
-            # However, this is really a hack and should be fixed properly.
-            self.descr = f"{piece_descr_stub}.p{self.phrase_number:02d}.{self._measure_descr_short}"
-
-    def _run_sanity_checks(self):
-        texture = list(self.df[("common", "texture")].unique())
-        assert texture == ["organum_purum"], "Phrases are only defined for organum purum sections"
-        assert list(self.df["common", "phrase"].unique()) == [self.phrase_number]
+    @property
+    def cache_key(self):
+        """
+        Stable identifier of this phrase (used for caching analysis results).
+        """
+        return ("organum_phrase", self.piece_filename_full, int(self.phrase_number))
 
     @property
     def _measure_descr(self):
-        measures = self.df[("common", "measure")].unique()
-        if len(measures) == 1:
-            return "measure {}".format(measures[0])
+        first_measure, last_measure = self.measures[0], self.measures[-1]
+        if first_measure == last_measure:
+            return "measure {}".format(first_measure)
         else:
-            return "measures {}-{}".format(measures[0], measures[-1])
+            return "measures {}-{}".format(first_measure, last_measure)
 
     @property
     def _measure_descr_short(self):
-        measures = self.df[("common", "measure")].unique()
-        if len(measures) == 1:
-            return f"m{measures[0]:02d}"
+        first_measure, last_measure = self.measures[0], self.measures[-1]
+        if first_measure == last_measure:
+            return f"m{first_measure:02d}"
         else:
-            return f"m.{measures[0]:02d}-{measures[-1]:02d}"
+            return f"m.{first_measure:02d}-{last_measure:02d}"
 
     def __repr__(self):
         return "<OrganumPhrase #{} of length {} on tenor PC '{}', piece '{}', contained in {}>".format(
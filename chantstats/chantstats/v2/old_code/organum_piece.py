@@ -1,4 +1,5 @@
 import music21
+import numpy as np
 import os
 import pandas as pd
 import re
@@ -6,12 +7,17 @@ from functools import lru_cache
 from glob import glob
 from tqdm import tqdm
 from time import time
+from music21.common import opFrac
 from music21.note import Note
 
+from ..instrumentation import increment, instrumented, timed
 from ..logging import logger
+from ..metadata_index import check_analysis_input_filters
+from ..profiling import profiled, profiled_function
 from ..pitch_class import PC
 from ..repertoire_and_genre import RepertoireAndGenreType
-from .helpers import group_by_contiguous_values, pairwise
+from ..utils import get_barline_type
+from .helpers import get_contiguous_ranges
 from .organum_piece_section import OrganumPieceSection
 from .organum_phrase import OrganumPhrase
 from .organum_purum_duplum_part import OrganumPurumDuplumPart
@@ -24,7 +30,7 @@ from ..analysis_functions import (
 
 
 def warn_if_tenor_does_not_start_on_first_note_of_each_measure(df):
-    df_first_row_of_each_group = df.groupby([("common", "measure")]).apply(lambda grp: grp.iloc[0])
+    df_first_row_of_each_group = df[~df[("common", "measure")].duplicated()]
     df_first_row_of_each_group = df_first_row_of_each_group[
         df_first_row_of_each_group[("common", "texture")] != "discant_or_copula"
     ]
@@ -41,81 +47,117 @@ def merge_series(s1, s2, dtype=None):
     If values at corresponding positions in s1, s2 are different from each other
     or if the result contains any null values then an error will be raised.
     """
+    is_conflict = s1.notnull() & s2.notnull() & (s1 != s2)
+    assert not is_conflict.any(), "Conflicting values at offsets: {}".format(list(s1.index[is_conflict]))
 
-    def merge_values(x, y):
-        if pd.isnull(x):
-            assert not pd.isnull(y)
-            return y
-        else:
-            assert (x == y) or pd.isnull(y)
-            return x
-
-    result = s1.combine(s2, merge_values)
+    result = s1.combine_first(s2)
+    assert not result.isnull().any()
     if dtype:
         result = result.astype(dtype)
     return result
 
 
-def is_single_measure(df):
-    return len(df[("common", "measure")].unique()) == 1
+COMPOUND_TIME_SIGNATURE_PATTERN = "^[0-9]+/8$"
 
 
-def get_unique_column_value(df, col):
-    vals = df[col].unique()
-    assert len(vals) == 1, "Column value must be unique but got: {}".format(vals)
-    return vals[0]
+def calculate_textures(df):
+    """
+    Return the texture of each row in the dataframe, which is determined per measure:
+    measures in compound meter are "discant_or_copula", measures without any notes
+    in the duplum are "chant" and all remaining measures are "organum_purum".
+    """
+    measures = df[("common", "measure")].values
+    time_signatures = df[("common", "time_signature")]
+    num_time_signatures = time_signatures.groupby(measures).transform("nunique")
+    assert (num_time_signatures == 1).all(), "Time signature must be unique within each measure"
 
+    has_compound_meter = time_signatures.str.match(COMPOUND_TIME_SIGNATURE_PATTERN)
+    has_empty_duplum = df[("duplum", "note")].isnull().groupby(measures).transform("all")
+    textures = np.select(
+        [has_compound_meter.values, has_empty_duplum.values], ["discant_or_copula", "chant"], default="organum_purum"
+    )
+    return pd.Series(textures, index=df.index, dtype=object)
 
-def has_compound_meter(df):
-    assert is_single_measure(df)
-    time_signature = get_unique_column_value(df, ("common", "time_signature"))
-    compound_time_signature_pattern = "^[0-9]+/8$"
-    if re.match(compound_time_signature_pattern, time_signature):
-        return True
-    else:
-        return False
 
+def calculate_phrase_numbers(df):
+    """
+    Return the phrase number of each row in the dataframe (or None for rows which are not part
+    of a phrase). Phrases are the contiguous runs of rows within the organum purum sections which
+    share the same (forward-filled) tenor note; rows before the first tenor note of a section do
+    not belong to any phrase.
+    """
+    texture = df[("common", "texture")]
+    texture_blocks = (texture != texture.shift()).cumsum()
+    tenor_notes = df[("tenor", "note")].groupby(texture_blocks.values).ffill()
+    is_in_phrase = (texture == "organum_purum") & tenor_notes.notnull()
 
-def get_texture(df):
-    if has_compound_meter(df):
-        return "discant_or_copula"
-    elif df[("duplum", "note")].isnull().all():
-        return "chant"
-    else:
-        return "organum_purum"
+    blocks = texture_blocks[is_in_phrase]
+    notes = tenor_notes[is_in_phrase]
+    is_phrase_start = (blocks != blocks.shift()) | (notes != notes.shift())
 
+    phrase_numbers = np.full(len(df), None, dtype=object)
+    phrase_numbers[is_in_phrase.values] = is_phrase_start.cumsum().tolist()
+    return pd.Series(phrase_numbers, index=df.index, dtype=object)
 
-def add_texture(df):
-    res = df.copy()
-    res[("common", "texture")] = get_texture(df)
-    return res
 
+def traverse_single_part_stream(stream):
+    """
+    Traverse the measures of the given part once and return a dataframe containing
+    information about all its notes together with a list of the barlines in the part.
 
-def calculate_dataframe_from_single_part_stream(stream):
-    assert isinstance(stream, music21.stream.Part)
+    The current time signature is carried forward from measure to measure (rather than
+    looking up the context of each individual note, which is very slow).
 
-    def get_current_time_signature(note):
-        return note.getContextByClass("TimeSignature").ratioString
+    Returns
+    -------
+    tuple
+        Pair `(df, barlines)`, where `df` is indexed by the note offsets (relative to the
+        start of the part) and `barlines` is a list of tuples `(offset, type, measure)`.
+    """
+    assert isinstance(stream, music21.stream.Part)
 
     def get_lyric(note):
         return note.lyric if note.lyric is not None else ""
 
-    def get_note_info(note):
-        return (
-            note.offset,
-            note.name,
-            # note.nameWithOctave,
-            note,
-            note.pitch.ps,
-            note.duration.quarterLength,
-            note.measureNumber,
-            get_current_time_signature(note),
-            get_lyric(note),
-        )
+    note_infos = []
+    barlines = []
+    time_signature = None
+    for m in stream.getElementsByClass("Measure"):
+        measure_offset = stream.elementOffset(m)
+        time_signatures = [(m.elementOffset(ts), ts.ratioString) for ts in m.getElementsByClass("TimeSignature")]
+
+        notes_with_offsets = [(opFrac(measure_offset + m.elementOffset(n)), n) for n in m.notes]
+        for v in m.voices:
+            voice_offset = measure_offset + m.elementOffset(v)
+            notes_with_offsets.extend((opFrac(voice_offset + v.elementOffset(n)), n) for n in v.notes)
+
+        for offset, n in sorted(notes_with_offsets, key=lambda x: x[0]):
+            for ts_offset, ts in time_signatures:
+                if measure_offset + ts_offset <= offset:
+                    time_signature = ts
+            assert time_signature is not None, f"No time signature found for note at offset {offset}"
+            note_infos.append(
+                (
+                    offset,
+                    n.name,
+                    n,
+                    n.pitch.ps,
+                    n.duration.quarterLength,
+                    m.number,
+                    time_signature,
+                    get_lyric(n),
+                )
+            )
+
+        for b in m.getElementsByClass("Barline"):
+            barlines.append((opFrac(measure_offset + m.elementOffset(b)), get_barline_type(b), m.number))
+
+        if time_signatures:
+            time_signature = time_signatures[-1][1]
 
     columns = ["offset", "pitch_class", "note", "pitch", "duration", "measure", "time_signature", "lyric"]
-    df = pd.DataFrame([get_note_info(n) for n in stream.flat.notes], columns=columns)
-    return df.set_index("offset")
+    df = pd.DataFrame(note_infos, columns=columns)
+    return df.set_index("offset"), barlines
 
 
 def merge_corresponding_columns(df, colname, dtype=None):
@@ -124,22 +166,21 @@ def merge_corresponding_columns(df, colname, dtype=None):
     del df[("duplum", colname)]
 
 
-# TODO: to make things more efficient, avoid all this iteration over streams!
-def get_stanza_boundary_offsets(stream):
-    duplum_barlines = list(stream.parts[0].recurse(classFilter="Barline"))
-    tenor_barlines = list(stream.parts[1].recurse(classFilter="Barline"))
-
+def get_stanza_boundary_offsets(duplum_barlines, tenor_barlines):
+    """
+    Return the offsets of the stanza boundaries (the start of the piece and all final barlines),
+    given the lists of barlines `(offset, type, measure)` in the duplum and tenor parts.
+    """
     # sanity check that barlines in duplum and tenor parts coincide
-    assert [(b.offset, b.style) for b in duplum_barlines] == [(b.offset, b.style) for b in tenor_barlines]
+    assert [b[:2] for b in duplum_barlines] == [b[:2] for b in tenor_barlines]
 
     barline_offsets = []
-    for b in duplum_barlines:
-        assert b.style in ["double", "final"], "Unexpected barline type: '{}' (measure: {})".format(
-            b.style, b.measureNumber
+    for offset, barline_type, measure in duplum_barlines:
+        assert barline_type in ["double", "final"], "Unexpected barline type: '{}' (measure: {})".format(
+            barline_type, measure
         )
-        if b.style == "final":
-            offset = b.getOffsetInHierarchy(stream.parts[0])
-            logger.debug("Found barline '{}' at offset {}, measure {}".format(b.style, offset, b.measureNumber))
+        if barline_type == "final":
+            logger.debug("Found barline '{}' at offset {}, measure {}".format(barline_type, offset, measure))
             barline_offsets.append(offset)
     barline_offsets.insert(0, 0.0)
 
@@ -155,10 +196,10 @@ def calculate_dataframe_from_music21_stream(stream, filename, descr_stub):
     duplum = stream.parts[0]
     tenor = stream.parts[1]
 
-    df_duplum = calculate_dataframe_from_single_part_stream(duplum)
-    df_tenor = calculate_dataframe_from_single_part_stream(tenor)
+    df_duplum, duplum_barlines = traverse_single_part_stream(duplum)
+    df_tenor, tenor_barlines = traverse_single_part_stream(tenor)
 
-    df = pd.concat([df_tenor, df_duplum], axis=1, keys=["tenor", "duplum"])
+    df = pd.concat([df_tenor, df_duplum], axis=1, keys=["tenor", "duplum"], sort=True)
     merge_corresponding_columns(df, "measure", dtype=int)
     merge_corresponding_columns(df, "time_signature")
 
@@ -171,60 +212,19 @@ def calculate_dataframe_from_music21_stream(stream, filename, descr_stub):
             f"{sorted(set(measures_expected).difference(measures_found))}"
         )
 
-    # df['tenor'] = forward_fill_each_measure(df['tenor'])
-    # assert not df[('tenor', 'measure')].isnull().any()
-    # assert not df[('tenor', 'time_signature')].isnull().any()
-
-    # df.groupby([('common', 'measure')]).apply(add_texture)
-    # df[('common', 'texture')] = pd.concat([add_texture(x) for _, x in df.groupby([('common', 'measure')])])
-    ggg = df.groupby([("common", "measure")])
-    df = pd.concat([add_texture(x) for _, x in ggg], axis=0)
-
-    note_of_chant_final = df.iloc[-1]["tenor"]["note"]
-
-    #
-    # Fill phrase numbers
-    #
-    df[("common", "phrase")] = None
-
-    ### OLD CODE. This relies on OrganumPieceSection, which is not great.
-    # phrase_num = 0
-    # for _, df_grp in group_by_contiguous_values(df, ("common", "texture")):
-    #     sec = OrganumPieceSection(df_grp, filename, descr_stub, note_of_chant_final)
-    #     for phrase in sec.phrases:
-    #         phrase_num += 1
-    #         df.loc[phrase.df.index, ("common", "phrase")] = phrase_num
-
-    ### NEW CODE: self-contained and cleaner
-    phrase_num = 0
-    for _, df_texture in group_by_contiguous_values(df, ("common", "texture")):
-        cur_texture = df_texture["common", "texture"].unique()[0]
-        if cur_texture != "organum_purum":
-            continue
-
-        tenor_ffilled = df_texture["tenor"].ffill().dropna()
-        for i, df_phrase in group_by_contiguous_values(df_texture, tenor_ffilled["note"]):
-            phrase_num += 1
-            # tenor_note = df_phrase["tenor", "note"].iloc[0]
-            # print(f"Filling in phrase: {phrase_num} (tenor note: {tenor_note})")
-            # print(f"   {df_phrase.index[0]}-{df_phrase.index[-1]}")
-            df.loc[df_phrase.index, ("common", "phrase")] = phrase_num
+    df[("common", "texture")] = calculate_textures(df)
+    df[("common", "phrase")] = calculate_phrase_numbers(df)
 
     #
     # Calculate stanzas
     #
-    stanza_boundary_offsets = get_stanza_boundary_offsets(stream)
+    stanza_boundary_offsets = get_stanza_boundary_offsets(duplum_barlines, tenor_barlines)
 
     # sanity check that last barline was found at the end of the piece (after all notes)
     assert all(df.index < stanza_boundary_offsets[-1])
 
-    df[("common", "stanza")] = None
-    for stanza_num, (start_offset, end_offset) in enumerate(pairwise(stanza_boundary_offsets), start=1):
-        # TODO: this raises a pandas warning because we're altering a copy; rewrite this in a safer way!
-        df.loc[(start_offset <= df.index) & (df.index < end_offset), ("common", "stanza")] = stanza_num
-
-    # verify that all entries have been assigned to some stanza
-    assert not df[("common", "stanza")].isnull().any()
+    stanza_numbers = np.searchsorted(stanza_boundary_offsets, df.index.values, side="right")
+    df[("common", "stanza")] = pd.Series(stanza_numbers, index=df.index).astype(object)
 
     df = df[["common", "tenor", "duplum"]]  # rearrange columns
 
@@ -259,6 +259,7 @@ class OrganumPiece:
         self.note_of_final = self.note_of_chant_final  # alias
         self.chant_final = PC.from_note(self.note_of_final)
         self.final = self.chant_final  # alias
+        self._calculate_structure()
         self.organum_purum_duplum_part = OrganumPurumDuplumPart(self)
 
     def __repr__(self):
@@ -268,22 +269,79 @@ class OrganumPiece:
     def descr(self):
         return self.filename_short
 
+    def _calculate_structure(self):
+        """
+        Extract the columns of the piece dataframe which are needed by the phrases and sections
+        into numpy arrays, and determine the row ranges `(start, stop)` of all phrases and sections.
+        The phrase and section objects themselves are only created once, on first access.
+        """
+        self._offsets = self.df.index.values
+        self._measures = self.df[("common", "measure")].values
+        self._textures = self.df[("common", "texture")].values
+        self._tenor_notes = self.df[("tenor", "note")].values
+        self._duplum_notes = self.df[("duplum", "note")].values
+        self._duplum_pitches = self.df[("duplum", "pitch")].values.astype(float)
+        self._tenor_pitches = self.df[("tenor", "pitch")].values.astype(float)
+
+        # rows which don't belong to any phrase are assigned phrase number 0
+        self._phrase_numbers = self.df[("common", "phrase")].fillna(0).values.astype(int)
+        self._phrase_ranges = [
+            (start, stop)
+            for start, stop in get_contiguous_ranges(self._phrase_numbers)
+            if self._phrase_numbers[start] > 0
+        ]
+        assert len(set(self._phrase_numbers[start] for start, _ in self._phrase_ranges)) == len(self._phrase_ranges)
+        self._section_ranges = get_contiguous_ranges(self._textures)
+
+        self._phrases = None
+        self._sections = None
+
     @property
     def phrases(self):
         """
-        Iterate over all phrases in this OrganumPiece
+        Return a list of all phrases in this OrganumPiece
         """
-        return [
-            OrganumPhrase(df_phrase, self.filename_short, self.descr_stub)
-            for _, df_phrase in self.df.dropna(subset=[("common", "phrase")]).groupby([("common", "phrase")])
-        ]
+        if self._phrases is None:
+            self._phrases = [
+                OrganumPhrase(
+                    phrase_number=int(self._phrase_numbers[start]),
+                    offsets=self._offsets[start:stop],
+                    measures=self._measures[start:stop],
+                    tenor_notes=self._tenor_notes[start:stop],
+                    duplum_notes=self._duplum_notes[start:stop],
+                    duplum_pitches=self._duplum_pitches[start:stop],
+                    tenor_pitches=self._tenor_pitches[start:stop],
+                    piece_filename=self.filename_short,
+                    piece_filename_full=self.filename_full,
+                    piece_descr_stub=self.descr_stub,
+                )
+                for start, stop in self._phrase_ranges
+            ]
+        return self._phrases
 
     @property
     def sections(self):
-        sections = []
-        for _, df_grp in group_by_contiguous_values(self.df, ("common", "texture")):
-            sections.append(OrganumPieceSection(df_grp, self.filename_short, self.descr_stub, self.note_of_chant_final))
-        return sections
+        """
+        Return a list of all sections (contiguous measures with the same texture) in this OrganumPiece
+        """
+        if self._sections is None:
+            self._sections = [self._make_section(start, stop) for start, stop in self._section_ranges]
+        return self._sections
+
+    def _make_section(self, start, stop):
+        texture = self._textures[start]
+        if texture != "organum_purum":
+            return OrganumPieceSection(piece=self, texture=texture, measures=self._measures[start:stop])
+        return OrganumPieceSection(
+            piece=self,
+            texture=texture,
+            measures=self._measures[start:stop],
+            duplum_notes=self._duplum_notes[start:stop],
+            duplum_pitches=self._duplum_pitches[start:stop],
+            tenor_pitches=self._tenor_pitches[start:stop],
+            # the phrases which start in this section
+            phrase_numbers={int(self._phrase_numbers[s]) for s, _ in self._phrase_ranges if start <= s < stop},
+        )
 
     def get_occurring_mode_degrees(self):
         return set(self.organum_purum_duplum_part.mode_degrees)
@@ -299,7 +357,7 @@ class OrganumPiece:
 
 
 @lru_cache(maxsize=10)
-def load_organum_pieces(input_dir, *, pattern="*.xml"):
+def load_organum_pieces(input_dir, *, pattern="*.xml", metadata_index=None, min_num_notes_per_organum_phrase=None):
     """
     Load responsorial chant pieces from MusicXML files in a given input directory.
 
@@ -310,6 +368,13 @@ def load_organum_pieces(input_dir, *, pattern="*.xml"):
     pattern : str, optional
         Filename pattern; this can be used to filter the files
         to be loaded to a subset (for example during testing).
+    metadata_index : MetadataIndex, optional
+        If given, the metadata of the loaded pieces is added to this index,
+        and pieces which the index knows don't contain any phrase with at
+        least `min_num_notes_per_organum_phrase` notes are skipped.
+    min_num_notes_per_organum_phrase : int, optional
+        Filter for skipping pieces via the metadata index (same meaning
+        as for `OrganumPhrases.get_analysis_inputs()`).
 
     Returns
     -------
@@ -318,9 +383,17 @@ def load_organum_pieces(input_dir, *, pattern="*.xml"):
     pattern = pattern if pattern is not None else "*.xml"
     filenames = sorted(glob(os.path.join(input_dir, pattern)))
     logger.debug(f"Found {len(filenames)} pieces matching the pattern '{pattern}'.")
+    if metadata_index is not None:
+        filenames = metadata_index.get_qualifying_filenames(
+            filenames, "organum_phrases", min_num_notes_per_organum_phrase=min_num_notes_per_organum_phrase
+        )
     logger.debug(f"Loading pieces... ")
     tic = time()
-    pieces = [OrganumPiece(f) for f in tqdm(filenames)]
+    with timed("loading"), profiled("loading"):
+        pieces = [OrganumPiece(f) for f in tqdm(filenames)]
+    increment("pieces_loaded", len(pieces))
+    if metadata_index is not None:
+        metadata_index.add_pieces(pieces, "organum_pieces")
     toc = time()
     logger.debug(f"Done. Loaded {len(pieces)} pieces.")
     logger.debug(f"Loading pieces took {toc-tic:.2f} seconds.")
@@ -343,17 +416,35 @@ class OrganumPieces:
         yield from self.pieces
 
     @classmethod
-    def from_musicxml_files(cls, cfg, filename_pattern=None):
+    def from_musicxml_files(
+        cls,
+        cfg,
+        filename_pattern=None,
+        *,
+        metadata_index=None,
+        min_num_phrases_per_monomodal_section=None,
+        min_num_notes_per_monomodal_section=None,
+        min_num_notes_per_organum_phrase=None,
+    ):
+        check_analysis_input_filters(
+            "organum_pieces",
+            min_num_phrases_per_monomodal_section=min_num_phrases_per_monomodal_section,
+            min_num_notes_per_monomodal_section=min_num_notes_per_monomodal_section,
+            min_num_notes_per_organum_phrase=min_num_notes_per_organum_phrase,
+        )
         musicxml_path = cfg.get_musicxml_path("organum_pieces")
-        pieces = load_organum_pieces(musicxml_path, pattern=filename_pattern)
+        pieces = load_organum_pieces(musicxml_path, pattern=filename_pattern, metadata_index=metadata_index)
         return cls(pieces)
 
+    @instrumented("input_extraction")
+    @profiled_function("input_extraction")
     def get_analysis_inputs(
         self,
         mode=None,
         min_num_phrases_per_monomodal_section=None,
         min_num_notes_per_monomodal_section=None,
         min_num_notes_per_organum_phrase=None,
+        metadata_index=None,  # not needed because the inputs are cheap to extract from the loaded pieces
     ):
         return [piece.organum_purum_duplum_part for piece in self.pieces]
 
@@ -404,18 +495,41 @@ class OrganumPhrases:
         yield from self.phrases
 
     @classmethod
-    def from_musicxml_files(cls, cfg, filename_pattern=None):
+    def from_musicxml_files(
+        cls,
+        cfg,
+        filename_pattern=None,
+        *,
+        metadata_index=None,
+        min_num_phrases_per_monomodal_section=None,
+        min_num_notes_per_monomodal_section=None,
+        min_num_notes_per_organum_phrase=None,
+    ):
+        check_analysis_input_filters(
+            "organum_phrases",
+            min_num_phrases_per_monomodal_section=min_num_phrases_per_monomodal_section,
+            min_num_notes_per_monomodal_section=min_num_notes_per_monomodal_section,
+            min_num_notes_per_organum_phrase=min_num_notes_per_organum_phrase,
+        )
         musicxml_path = cfg.get_musicxml_path("organum_pieces")
-        pieces = load_organum_pieces(musicxml_path, pattern=filename_pattern)
+        pieces = load_organum_pieces(
+            musicxml_path,
+            pattern=filename_pattern,
+            metadata_index=metadata_index,
+            min_num_notes_per_organum_phrase=min_num_notes_per_organum_phrase,
+        )
         phrases = sum([piece.phrases for piece in pieces], [])
         return cls(phrases)
 
+    @instrumented("input_extraction")
+    @profiled_function("input_extraction")
     def get_analysis_inputs(
         self,
         mode=None,
         min_num_phrases_per_monomodal_section=None,
         min_num_notes_per_monomodal_section=None,
         min_num_notes_per_organum_phrase=12,
+        metadata_index=None,  # not needed because the inputs are cheap to extract from the loaded pieces
     ):
         return [p for p in self.phrases if len(p.notes) >= min_num_notes_per_organum_phrase]
 
@@ -1,8 +1,7 @@
 from ..mode_degree import ModeDegree
 from ..note_pair import NotePair
 from ..pitch_class import PC
-from .helpers import group_by_contiguous_values
-from .organum_phrase import OrganumPhrase
+from ..vertical_intervals import calculate_vertical_intervals
 
 
 class BaseOrganumPieceSection:
@@ -11,26 +10,27 @@ class BaseOrganumPieceSection:
     organum piece, i.e. a contiguous set of measures with
     the same texture (= organum purum, discant/copula or
     chant).
-    """
-
-    def __init__(self, df, piece_filename, piece_descr_stub):
-        self.df = df
 
-        texture_vals = self.df[("common", "texture")].unique()
-        if len(texture_vals) != 1:
-            raise ValueError("Section does not have a unique texture: {}".format(texture_vals))
+    The section is defined by the rows `start:stop` of the
+    piece dataframe, and the arrays passed to the constructor
+    are the corresponding slices of the arrays of the piece
+    (see `OrganumPiece._calculate_structure()`).
+    """
 
-        self.texture = texture_vals[0]
-        self.piece_filename = piece_filename
-        self.piece_descr_stub = piece_descr_stub
+    def __init__(self, *, piece, texture, measures):
+        self.piece = piece
+        self.texture = texture
+        self.measures = measures
+        self.piece_filename = piece.filename_short
+        self.piece_descr_stub = piece.descr_stub
 
     @property
     def _measure_descr(self):
-        measures = self.df[("common", "measure")].unique()
-        if len(measures) == 1:
-            return "measure {}".format(measures[0])
+        first_measure, last_measure = self.measures[0], self.measures[-1]
+        if first_measure == last_measure:
+            return "measure {}".format(first_measure)
         else:
-            return "measures {}-{}".format(measures[0], measures[-1])
+            return "measures {}-{}".format(first_measure, last_measure)
 
     def __repr__(self):
         return "<Section of piece '{}': {}, texture '{}'>".format(
@@ -47,33 +47,31 @@ class BaseOrganumPieceSection:
 
 
 class OrganumPieceOrganumPurumSection(BaseOrganumPieceSection):
-    def __init__(self, df, piece_filename, piece_descr_stub, note_of_chant_final):
-        super().__init__(df, piece_filename, piece_descr_stub)
+    def __init__(self, *, piece, texture, measures, duplum_notes, duplum_pitches, tenor_pitches, phrase_numbers):
+        super().__init__(piece=piece, texture=texture, measures=measures)
         assert self.texture == "organum_purum"
-        self.duplum_notes = list(self.df["duplum", "note"])
+        self.duplum_notes = list(duplum_notes)
         self.notes = self.duplum_notes  # alias
         self.pitch_classes = [PC.from_note(n) for n in self.notes]
-        self.mode_degrees = [ModeDegree.from_note_pair(note=n, base_note=note_of_chant_final) for n in self.notes]
+        self.mode_degrees = [ModeDegree.from_note_pair(note=n, base_note=piece.note_of_chant_final) for n in self.notes]
         self.pc_pairs = list(zip(self.pitch_classes, self.pitch_classes[1:]))
         self.note_pairs = [NotePair(n1, n2) for (n1, n2) in zip(self.notes, self.notes[1:])]
         self.mode_degree_pairs = list(zip(self.mode_degrees, self.mode_degrees[1:]))
+        self.vertical_intervals = calculate_vertical_intervals(duplum_pitches, tenor_pitches)
+        self.phrase_numbers = phrase_numbers
 
     @property
     def phrases(self):
-        phrases = []
-        tenor_ffilled = self.df["tenor"].ffill().dropna()
-        for i, df_grp in group_by_contiguous_values(self.df, tenor_ffilled["note"]):
-            phrases.append(OrganumPhrase(self.df.loc[df_grp.index], self.piece_filename, self.piece_descr_stub))
-        return phrases
+        return [phrase for phrase in self.piece.phrases if phrase.phrase_number in self.phrase_numbers]
 
 
-def OrganumPieceSection(df, piece_filename, piece_descr_stub, note_of_chant_final):
-    texture_vals = df[("common", "texture")].unique()
-    if len(texture_vals) != 1:
-        raise ValueError("Section does not have a unique texture: {}".format(texture_vals))
-    texture = texture_vals[0]
-
+def OrganumPieceSection(*, piece, texture, measures, **kwargs):
+    """
+    Return an `OrganumPieceOrganumPurumSection` for organum purum sections (which need the
+    keyword arguments `duplum_notes`, `duplum_pitches`, `tenor_pitches` and `phrase_numbers`)
+    and a `BaseOrganumPieceSection` for all other textures.
+    """
     if texture == "organum_purum":
-        return OrganumPieceOrganumPurumSection(df, piece_filename, piece_descr_stub, note_of_chant_final)
+        return OrganumPieceOrganumPurumSection(piece=piece, texture=texture, measures=measures, **kwargs)
     else:
-        return BaseOrganumPieceSection(df, piece_filename, piece_descr_stub)
+        return BaseOrganumPieceSection(piece=piece, texture=texture, measures=measures)
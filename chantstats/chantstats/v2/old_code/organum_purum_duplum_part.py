@@ -1,3 +1,4 @@
+import numpy as np
 from ..ambitus import calculate_ambitus
 from ..mode_degree import ModeDegree
 from ..pitch_class import PC
@@ -22,12 +23,23 @@ class OrganumPurumDuplumPart:
         self.note_pairs = sum([s.note_pairs for s in self.sections], [])
         self.pc_pairs = sum([s.pc_pairs for s in self.sections], [])
         self.mode_degree_pairs = sum([s.mode_degree_pairs for s in self.sections], [])
+        self.vertical_intervals = np.concatenate(
+            [np.zeros(0, dtype=int)] + [s.vertical_intervals for s in self.sections]
+        )
         self._melodic_outline_candidates = calculate_melodic_outline_candidates(self.notes, self.note_pairs)
         # self.ambitus = calculate_ambitus(self)
 
     def __repr__(self):
         return "<OrganumPurumDuplumPart of piece: '{}'>".format(self.piece.descr_stub)
 
+    @property
+    def cache_key(self):
+        """
+        Stable identifier of this duplum part (used for caching analysis results).
+        """
+        filename = getattr(self.piece, "filename_full", None)
+        return None if filename is None else ("organum_purum_duplum_part", filename)
+
     def __lt__(self, other):
         return self.piece.descr_stub < other.piece.descr_stub
 
@@ -0,0 +1,251 @@
+import itertools
+import multiprocessing
+import queue
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from .logging import logger
+
+__all__ = [
+    "SharedInputsPool",
+    "submit_and_yield_in_order",
+    "map_over_shared_inputs",
+    "imap_over_shared_inputs",
+    "iter_in_background_thread",
+]
+
+#
+# Inputs which are shared with worker processes. They are registered here in the
+# parent process *before* the process pool is created so that forked workers
+# inherit them (copy-on-write) instead of receiving a pickled copy of each input.
+# Only the index of each input is sent to the workers.
+#
+_shared_inputs = {}
+_token_counter = itertools.count()
+
+
+def _call_with_shared_input(func, token, idx, *args):
+    return func(_shared_inputs[token][idx], *args)
+
+
+def _get_fork_context():
+    try:
+        return multiprocessing.get_context("fork")
+    except ValueError:  # pragma: no cover
+        # The 'fork' start method is not available on all platforms (e.g. Windows).
+        return None
+
+
+def _get_non_fork_context():
+    for method in ["forkserver", "spawn"]:
+        try:
+            return multiprocessing.get_context(method)
+        except ValueError:  # pragma: no cover
+            pass
+    return None  # pragma: no cover
+
+
+def submit_and_yield_in_order(submit, num_inputs, max_pending):
+    """
+    Submit the tasks with indices 0, ..., num_inputs - 1 and yield their results in order,
+    keeping at most `max_pending` tasks in flight (or all of them if max_pending is None).
+    """
+    max_pending = max_pending or num_inputs
+    indices = iter(range(num_inputs))
+    pending = deque(submit(idx) for idx in itertools.islice(indices, max_pending))
+    while pending:
+        result = pending.popleft().result()
+        for idx in itertools.islice(indices, 1):
+            pending.append(submit(idx))
+        yield result
+
+
+def _shutdown_pool(pool, token):
+    pool.shutdown()
+    _shared_inputs.pop(token, None)
+
+
+class SharedInputsPool:
+    """
+    Process pool whose workers share a fixed list of inputs.
+
+    The worker processes are forked in the constructor (i.e., in the calling thread, while
+    the inputs are registered), so that they inherit the inputs instead of receiving a pickled
+    copy of each one. Create the pool in the main thread *before* starting any other threads
+    which use it (e.g. before consuming results via `iter_in_background_thread()`), because
+    forking a process while other threads may hold locks can deadlock the child processes.
+    If the pool is created in any other thread (or if the 'fork' start method is not available)
+    then the workers are started via 'forkserver' or 'spawn' instead and the inputs are pickled.
+
+    The pool is shut down when `shutdown()` is called, when it is used as a context manager
+    and the block exits, or when it is garbage collected.
+    """
+
+    def __init__(self, inputs, *, workers):
+        self.inputs = list(inputs)
+        self._token = next(_token_counter)
+
+        mp_context = _get_fork_context()
+        if threading.current_thread() is not threading.main_thread():
+            mp_context = None
+            logger.warning(
+                "Process pool created outside the main thread; the workers are not forked and the inputs will be "
+                "pickled. Create the pool in the main thread to share the inputs with the workers."
+            )
+        elif mp_context is None:  # pragma: no cover
+            logger.warning("The 'fork' start method is not available; inputs will be pickled for the worker processes.")
+        self.shares_inputs = mp_context is not None
+
+        if self.shares_inputs:
+            _shared_inputs[self._token] = self.inputs
+            self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=mp_context)
+            # Fork all worker processes right away. With the 'fork' start method the executor
+            # starts all of them on the first submission and never forks again afterwards.
+            self._pool.submit(int).result()
+        else:
+            self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=_get_non_fork_context())
+        self._finalizer = weakref.finalize(self, _shutdown_pool, self._pool, self._token)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        return False
+
+    def shutdown(self):
+        self._finalizer()
+
+    def submit(self, func, idx, *args):
+        """
+        Submit the calculation of `func(inputs[idx], *args)` and return a future for its result.
+        Any additional arguments are pickled (so they should be small).
+        """
+        if self.shares_inputs:
+            return self._pool.submit(_call_with_shared_input, func, self._token, idx, *args)
+        else:
+            return self._pool.submit(func, self.inputs[idx], *args)
+
+    def imap(self, func, *, max_pending=None):
+        """
+        Apply `func` to each input and yield the results in the same order as the inputs.
+        See `imap_over_shared_inputs()` for the meaning of `max_pending`.
+        """
+        submit = lambda idx: self.submit(func, idx)
+        yield from submit_and_yield_in_order(submit, len(self.inputs), max_pending)
+
+
+def imap_over_shared_inputs(func, inputs, *, workers=None, executor=None, max_pending=None):
+    """
+    Apply `func` to each element of `inputs` and yield the results
+    in the same order as the inputs (regardless of the order in which
+    the individual calculations finish).
+
+    Parameters
+    ----------
+    func : callable
+        Function to apply to each input. If the calculation runs in a process pool
+        this must be a module-level function (so that it can be pickled by reference).
+    inputs : iterable
+        Inputs to which `func` is applied. These are treated as read-only. In the serial
+        case each input is only requested from `inputs` just before it is needed.
+    workers : int, optional
+        Number of worker processes. If this is None or 1, the calculation runs
+        serially in the current process. Otherwise the inputs are shared with
+        forked worker processes (which avoids pickling them, see `SharedInputsPool`).
+        Note that the process pool is only created once the returned generator is
+        first advanced, so in order to consume the results in a different thread,
+        create a `SharedInputsPool` up front and use `SharedInputsPool.imap()`.
+    executor : concurrent.futures.Executor, optional
+        If given, use this executor instead of creating a process pool. Note that
+        in this case each input is passed to `executor.submit()` directly, so for
+        process-based executors the inputs need to be picklable.
+    max_pending : int, optional
+        Maximum number of calculations which are submitted but whose results have
+        not been yielded yet. This bounds the number of results held in memory
+        at any time. By default all inputs are submitted at once.
+    """
+    if executor is None and (workers is None or workers <= 1):
+        for x in inputs:
+            yield func(x)
+        return
+
+    inputs = list(inputs)
+
+    if executor is not None:
+        submit = lambda idx: executor.submit(func, inputs[idx])
+        yield from submit_and_yield_in_order(submit, len(inputs), max_pending)
+        return
+
+    if len(inputs) <= 1:
+        for x in inputs:
+            yield func(x)
+        return
+
+    with SharedInputsPool(inputs, workers=workers) as pool:
+        yield from pool.imap(func, max_pending=max_pending)
+
+
+def map_over_shared_inputs(func, inputs, *, workers=None, executor=None):
+    """
+    Same as `imap_over_shared_inputs()`, but return the results as a list.
+    """
+    return list(imap_over_shared_inputs(func, inputs, workers=workers, executor=executor))
+
+
+class _ExceptionInBackgroundThread:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+_END_OF_ITERATION = object()
+
+
+def iter_in_background_thread(iterable, *, maxsize):
+    """
+    Consume `iterable` in a background thread and yield its elements via a
+    bounded queue. This allows the caller to process each element while the
+    next one is being produced (for example, exporting plots for one result
+    while the next result is being calculated). At most `maxsize` elements
+    are held in the queue at any time.
+
+    Any exception raised while producing the elements is re-raised in the
+    calling thread.
+    """
+    q = queue.Queue(maxsize=maxsize)
+    stop_event = threading.Event()
+
+    def put(item):
+        # Use a timeout so that the producer notices if the consumer has stopped early.
+        while not stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as exc:
+            put(_ExceptionInBackgroundThread(exc))
+        else:
+            put(_END_OF_ITERATION)
+
+    producer = threading.Thread(target=produce, name="chantstats-producer", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = q.get()
+            if item is _END_OF_ITERATION:
+                break
+            elif isinstance(item, _ExceptionInBackgroundThread):
+                raise item.exc
+            yield item
+    finally:
+        stop_event.set()
+        producer.join()
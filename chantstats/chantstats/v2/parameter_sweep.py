@@ -0,0 +1,179 @@
+import itertools
+import pandas as pd
+from .analysis_functions import PAIR_COUNT_ANALYSES
+from .analysis_type import AnalysisType
+from .dendrogram import calculate_dendrogram_from_dataframe
+from .dendrogram.distance_metrics import DEFAULT_METRIC, DEFAULT_LINKAGE_METHOD, check_metric_and_method
+from .item_cache import default_item_cache, get_counts_for_items
+from .logging import logger
+from .modal_category import ModalCategoryType, GroupingByModalCategory
+from .repertoire_and_genre import RepertoireAndGenreType
+from .subsampling import Subsampler
+from .unit import UnitType
+
+__all__ = ["sweep_parameters", "filter_analysis_inputs"]
+
+# Parameters which can be swept, and the values used for any parameters not contained in the grid.
+DEFAULT_SWEEP_PARAMS = {
+    "min_num_phrases_per_monomodal_section": 3,
+    "min_num_notes_per_monomodal_section": 80,
+    "min_num_notes_per_organum_phrase": 12,
+    "sampling_fraction": 1.0,
+    "p_cutoff": 0.4,
+}
+
+
+def filter_analysis_inputs(
+    items,
+    repertoire_and_genre,
+    *,
+    min_num_phrases_per_monomodal_section,
+    min_num_notes_per_monomodal_section,
+    min_num_notes_per_organum_phrase,
+):
+    """
+    Return the subset of the given (unfiltered) analysis inputs which satisfy the given filters.
+
+    If `items` is the result of `pieces.get_analysis_inputs(mode, ...)` with all filters set
+    to zero, this returns the same items (in the same order) as calling `get_analysis_inputs()`
+    with the given filters, but without extracting the analysis inputs from the pieces again.
+    """
+    rep_and_genre = RepertoireAndGenreType(repertoire_and_genre)
+    if rep_and_genre == "plainchant_sequences":
+        return [
+            x
+            for x in items
+            if x.num_phrases >= min_num_phrases_per_monomodal_section
+            and x.num_notes >= min_num_notes_per_monomodal_section
+        ]
+    elif rep_and_genre == "organum_phrases":
+        return [x for x in items if len(x.notes) >= min_num_notes_per_organum_phrase]
+    else:
+        return list(items)
+
+
+def _iter_grid_points(param_grid):
+    unknown_params = set(param_grid).difference(DEFAULT_SWEEP_PARAMS)
+    if unknown_params:
+        raise ValueError(
+            f"Cannot sweep parameters: {sorted(unknown_params)}. Valid parameters: {list(DEFAULT_SWEEP_PARAMS)}"
+        )
+    names = list(param_grid)
+    for values in itertools.product(*[param_grid[name] for name in names]):
+        yield {**DEFAULT_SWEEP_PARAMS, **dict(zip(names, values))}
+
+
+def sweep_parameters(
+    *,
+    pieces,
+    analysis,
+    param_grid,
+    sampling_seed=None,
+    modes=None,
+    units=None,
+    cache=default_item_cache,
+    metric=DEFAULT_METRIC,
+    method=DEFAULT_LINKAGE_METHOD,
+    include_leaf_nodes_in_clusters=True,
+):
+    """
+    Calculate the clusterings for every point of a grid of parameter values and summarise them.
+
+    The analysis inputs are extracted from the pieces and their features are counted only once
+    (without any filtering). Each grid point is then derived by filtering and sub-sampling these
+    inputs, grouping them by modal category and clustering them. Clusterings are shared between
+    grid points which lead to the same items in a modal category (e.g. if a filter doesn't apply
+    to the given repertoire), and all cutoffs share the same dendrograms. Thus the cost of a sweep
+    is proportional to the number of distinct clusterings.
+
+    Parameters
+    ----------
+    pieces : PlainchantSequencePieces, ResponsorialChantPieces, OrganumPieces or OrganumPhrases
+        The pieces (as returned by `load_pieces()`).
+    analysis : str
+        The analysis to perform. This must be an analysis whose results are dendrograms.
+    param_grid : dict
+        Dictionary of the form {parameter_name: list of values}, where the parameter names
+        are any of `min_num_phrases_per_monomodal_section`, `min_num_notes_per_monomodal_section`,
+        `min_num_notes_per_organum_phrase`, `sampling_fraction` and `p_cutoff`. The sweep covers
+        all combinations of the given values. Parameters which are not contained in the grid
+        are set to their defaults (see `DEFAULT_SWEEP_PARAMS`).
+    sampling_seed : int, optional
+        Seed for the sub-samples (this must be given if any sampling fraction is less than 1.0).
+
+    See `calculate_results()` for a description of the remaining arguments.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Summary table with one row per grid point, mode, unit and modal category, containing
+        the parameter values, the number of items in the modal category, the number of clusters
+        below the cutoff and their sizes (in descending order).
+    """
+    analysis = AnalysisType(analysis)
+    if analysis in PAIR_COUNT_ANALYSES:
+        raise ValueError(f"Parameter sweeps are only supported for analyses with dendrograms, not for '{analysis}'.")
+    check_metric_and_method(metric, method)
+    modes = [ModalCategoryType(mode) for mode in (modes or list(ModalCategoryType))]
+    units = [UnitType(unit) for unit in (units or list(UnitType))]
+    grid_points = list(_iter_grid_points(param_grid))
+
+    # Extract the analysis inputs and count their features once, without any filtering.
+    all_items = {}
+    counts_per_item = {}  # {id(item): {unit: Counter}}
+    for mode in modes:
+        all_items[mode] = pieces.get_analysis_inputs(
+            mode,
+            min_num_phrases_per_monomodal_section=0,
+            min_num_notes_per_monomodal_section=0,
+            min_num_notes_per_organum_phrase=0,
+        )
+        counts = get_counts_for_items(all_items[mode], analysis=analysis, units=units, cache=cache)
+        counts_per_item.update((id(item), c) for item, c in zip(all_items[mode], counts))
+
+    dendrograms = {}  # {(unit, ids of the items in the modal category): dendrogram}
+    rows = []
+    for params in grid_points:
+        filters = {name: value for name, value in params.items() if name.startswith("min_num_")}
+        for mode in modes:
+            items = filter_analysis_inputs(all_items[mode], pieces.repertoire_and_genre, **filters)
+            items = Subsampler(items).get_subsample(params["sampling_fraction"], sampling_seed)
+            grouping = GroupingByModalCategory(items, group_by=mode)
+            for key in grouping.keys:
+                modal_category = grouping[key]
+                item_ids = tuple(id(item) for item in modal_category.items)
+                for unit in units:
+                    if (unit, item_ids) not in dendrograms:
+                        df = modal_category.make_results_dataframes(
+                            analysis=analysis,
+                            units=[unit],
+                            counts_per_item=[counts_per_item[item_id] for item_id in item_ids],
+                        )[unit]
+                        dendrograms[(unit, item_ids)] = calculate_dendrogram_from_dataframe(
+                            df, analysis=analysis, metric=metric, method=method
+                        )
+                    nodes = dendrograms[(unit, item_ids)].get_nodes_below_cutoff(
+                        params["p_cutoff"], include_leaf_nodes=include_leaf_nodes_in_clusters
+                    )
+                    rows.append(
+                        {
+                            **params,
+                            "mode": mode.value,
+                            "unit": unit.value,
+                            "modal_category": modal_category.output_path_stub_2,
+                            "num_items": len(modal_category.items),
+                            "num_clusters": len(nodes),
+                            "cluster_sizes": tuple(node.num_leaves for node in nodes),
+                        }
+                    )
+
+    logger.info(f"Parameter sweep over {len(grid_points)} grid points needed {len(dendrograms)} distinct clusterings.")
+    columns = list(DEFAULT_SWEEP_PARAMS) + [
+        "mode",
+        "unit",
+        "modal_category",
+        "num_items",
+        "num_clusters",
+        "cluster_sizes",
+    ]
+    return pd.DataFrame(rows, columns=columns)
@@ -0,0 +1,285 @@
+import numpy as np
+import pandas as pd
+from .logging import logger
+from .modal_category import ModalCategoryType
+from .mode_degree import ModeDegree
+from .pitch_class import PC
+from .utils import EnumWithDescription
+
+__all__ = ["MelodicPatternIndex", "PatternUnit"]
+
+
+class PatternUnit(EnumWithDescription):
+    PCS = ("pcs", "pitch classes")
+    MODE_DEGREES = ("mode_degrees", "mode degrees")
+    INTERVALS = ("intervals", "melodic intervals (in semitones)")
+
+
+# Code which separates the sequences of consecutive phrases in the concatenated sequence
+# (this ensures that no pattern can match across a phrase boundary).
+SEPARATOR = 0
+
+
+def build_suffix_array(codes):
+    """
+    Return the suffix array of the given sequence of non-negative integers (i.e. the
+    starting positions of all suffixes, in lexicographic order of the suffixes).
+
+    This uses prefix doubling, where each round sorts the suffixes by their first 2^k
+    symbols using the ranks from the previous round, so that all the work is done by
+    (vectorized) numpy sorting operations.
+    """
+    num_codes = len(codes)
+    rank = np.asarray(codes, dtype=np.int64)
+    suffix_array = np.argsort(rank, kind="stable")
+    k = 1
+    while k < num_codes:
+        next_rank = np.full(num_codes, -1, dtype=np.int64)  # suffixes which end earlier come first
+        next_rank[: num_codes - k] = rank[k:]
+        suffix_array = np.lexsort((next_rank, rank))
+        is_new_rank = np.ones(num_codes, dtype=bool)
+        is_new_rank[1:] = (np.diff(rank[suffix_array]) != 0) | (np.diff(next_rank[suffix_array]) != 0)
+        rank = np.empty(num_codes, dtype=np.int64)
+        rank[suffix_array] = np.cumsum(is_new_rank) - 1
+        if rank[suffix_array[-1]] == num_codes - 1:
+            break  # all ranks are unique
+        k *= 2
+    return suffix_array
+
+
+def _get_piece_name(phrase):
+    if hasattr(phrase, "piece_filename"):  # organum phrase
+        return phrase.piece_filename
+    return getattr(phrase.piece, "filename_short", None)
+
+
+def _get_measure_numbers(phrase):
+    if hasattr(phrase, "measure_stream"):  # chant phrase (each phrase is a single measure)
+        return [phrase.measure_stream.number] * len(phrase.notes)
+    else:  # organum phrase
+        return list(phrase.measures[: len(phrase.notes)])
+
+
+def _get_keys(phrase, unit):
+    """
+    Return the sequence of (hashable) values of the given phrase for the given unit.
+    """
+    if unit == "pcs":
+        return list(phrase.pitch_classes)
+    elif unit == "mode_degrees":
+        return [(md.value, md.alter) for md in phrase.mode_degrees]
+    elif unit == "intervals":
+        return [int(x) for x in np.diff([n.pitch.midi for n in phrase.notes])]
+    else:  # pragma: no cover
+        raise NotImplementedError(f"Unexpected unit: {unit}")
+
+
+def _get_pattern_keys(pattern, unit):
+    if unit == "pcs":
+        return [PC(x) for x in pattern]
+    elif unit == "mode_degrees":
+        return [(md.value, md.alter) for md in map(ModeDegree.from_other, pattern)]
+    elif unit == "intervals":
+        return [int(x) for x in pattern]
+    else:  # pragma: no cover
+        raise NotImplementedError(f"Unexpected unit: {unit}")
+
+
+class _SequenceIndex:
+    """
+    Suffix array over the integer-coded concatenation of the sequences of all phrases for a single unit.
+    """
+
+    def __init__(self, sequences):
+        all_keys = set(key for seq in sequences for key in seq)
+        self.codes_by_key = {key: code for code, key in enumerate(sorted(all_keys), start=SEPARATOR + 1)}
+
+        codes = []
+        self.phrase_starts = np.empty(len(sequences), dtype=np.int64)
+        for idx, seq in enumerate(sequences):
+            self.phrase_starts[idx] = len(codes)
+            codes.extend(self.codes_by_key[key] for key in seq)
+            codes.append(SEPARATOR)
+        self.codes = codes  # we keep a list because slices of lists are faster to compare than numpy arrays
+        self.suffix_array = build_suffix_array(codes)
+
+    def encode(self, pattern_keys):
+        """
+        Return the codes for the given pattern, or None if the pattern contains
+        a value which doesn't occur anywhere (so the pattern can't occur either).
+        """
+        try:
+            return [self.codes_by_key[key] for key in pattern_keys]
+        except KeyError:
+            return None
+
+    def find_range(self, pattern_codes):
+        """
+        Return the range `(lo, hi)` of entries in the suffix array whose suffixes start with the given pattern.
+        """
+        codes, suffix_array, m = self.codes, self.suffix_array, len(pattern_codes)
+
+        lo, hi = 0, len(suffix_array)
+        while lo < hi:  # find first suffix whose prefix is >= pattern
+            mid = (lo + hi) // 2
+            pos = suffix_array[mid]
+            if codes[pos : pos + m] < pattern_codes:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = lo
+
+        hi = len(suffix_array)
+        while lo < hi:  # find first suffix whose prefix is > pattern
+            mid = (lo + hi) // 2
+            pos = suffix_array[mid]
+            if codes[pos : pos + m] <= pattern_codes:
+                lo = mid + 1
+            else:
+                hi = mid
+        return start, lo
+
+
+class MelodicPatternIndex:
+    """
+    Index for finding melodic patterns (sequences of pitch classes, mode degrees
+    or melodic intervals) in the phrases of a collection of analysis items.
+
+    For each unit, the sequences of all phrases are integer-coded and concatenated
+    (separated by a special code so that patterns never extend across phrase
+    boundaries), and a suffix array is built over the concatenated sequence. All
+    occurrences of a pattern are then adjacent in the suffix array and can be found
+    with a binary search, which takes a fraction of a millisecond even for the full
+    corpus. The suffix arrays are built lazily when a unit is first queried.
+    """
+
+    def __init__(self, items):
+        """
+        Parameters
+        ----------
+        items : list
+            Phrases (e.g. `BasePhrase` or `OrganumPhrase` instances) or items which consist
+            of phrases (e.g. monomodal sections or stanzas). For the latter, occurrences are
+            grouped by the modal category of the item rather than of the individual phrase.
+        """
+        self.items = list(items)
+        self.phrases = []
+        self.item_indices = []
+        for idx, item in enumerate(self.items):
+            phrases = getattr(item, "phrases", [item])
+            self.phrases.extend(phrases)
+            self.item_indices.extend([idx] * len(phrases))
+        self.item_indices = np.array(self.item_indices, dtype=np.intp)
+
+        self._sequence_indices = {}
+        self._measure_numbers = None
+        self._modal_category_codes = {}
+
+    @classmethod
+    def from_pieces(cls, *pieces):
+        """
+        Create an index over all phrases of one or more collections of pieces (e.g. `PlainchantSequencePieces`,
+        `ResponsorialChantPieces`, `OrganumPieces` or `OrganumPhrases`).
+        """
+        phrases = []
+        for collection in pieces:
+            for x in collection:
+                phrases.extend(getattr(x, "phrases", [x]))
+        return cls(phrases)
+
+    def __repr__(self):
+        return f"<MelodicPatternIndex with {len(self.phrases)} phrases from {len(self.items)} items>"
+
+    def _get_sequence_index(self, unit):
+        unit = PatternUnit(unit)
+        if unit not in self._sequence_indices:
+            logger.debug(f"Building suffix array over the {unit.description} of {len(self.phrases)} phrases.")
+            self._sequence_indices[unit] = _SequenceIndex([_get_keys(p, unit) for p in self.phrases])
+        return self._sequence_indices[unit]
+
+    def _find_positions(self, pattern, unit):
+        """
+        Return the positions in the concatenated sequence where the pattern occurs (in ascending order).
+        """
+        unit = PatternUnit(unit)
+        if len(pattern) == 0:
+            raise ValueError("Pattern must not be empty.")
+        seq_index = self._get_sequence_index(unit)
+        pattern_codes = seq_index.encode(_get_pattern_keys(pattern, unit))
+        if pattern_codes is None:
+            return seq_index, np.array([], dtype=np.int64)
+        lo, hi = seq_index.find_range(pattern_codes)
+        return seq_index, np.sort(seq_index.suffix_array[lo:hi])
+
+    def count(self, pattern, unit):
+        """
+        Return the total number of occurrences of the given pattern.
+        """
+        seq_index, positions = self._find_positions(pattern, unit)
+        return len(positions)
+
+    def find(self, pattern, unit):
+        """
+        Return all occurrences of the given pattern.
+
+        Parameters
+        ----------
+        pattern : list
+            Sequence of pitch classes (e.g. `["D", "F", "A"]`), mode degrees (e.g. `[1, 3, 5]`
+            or a list of `ModeDegree` instances) or melodic intervals in semitones (e.g. `[2, 2, -4]`).
+        unit : str
+            One of "pcs", "mode_degrees" or "intervals".
+
+        Returns
+        -------
+        pandas.DataFrame
+            Dataframe with one row per occurrence, containing the description of the item
+            (if available), the piece, the phrase number, the measure and the index of the
+            first note of the occurrence within the phrase.
+        """
+        seq_index, positions = self._find_positions(pattern, unit)
+        phrase_indices = np.searchsorted(seq_index.phrase_starts, positions, side="right") - 1
+        note_indices = positions - seq_index.phrase_starts[phrase_indices]
+        measure_numbers = self._get_measure_numbers()
+        return pd.DataFrame(
+            {
+                "item": [getattr(self.items[self.item_indices[i]], "descr", None) for i in phrase_indices],
+                "piece": [_get_piece_name(self.phrases[i]) for i in phrase_indices],
+                "phrase": [self.phrases[i].phrase_number for i in phrase_indices],
+                "measure": [measure_numbers[i][j] for i, j in zip(phrase_indices, note_indices)],
+                "note_index": note_indices,
+            },
+            columns=["item", "piece", "phrase", "measure", "note_index"],
+        )
+
+    def count_per_modal_category(self, pattern, unit, *, group_by="final"):
+        """
+        Return the number of occurrences of the given pattern per modal category
+        (i.e. per final, or per final and ambitus) of the items in which they occur.
+
+        Returns
+        -------
+        pandas.Series
+            Number of occurrences indexed by the modal category keys (including
+            modal categories in which the pattern doesn't occur at all).
+        """
+        keys, phrase_category_codes = self._get_modal_category_codes(group_by)
+        seq_index, positions = self._find_positions(pattern, unit)
+        phrase_indices = np.searchsorted(seq_index.phrase_starts, positions, side="right") - 1
+        counts = np.bincount(phrase_category_codes[phrase_indices], minlength=len(keys))
+        return pd.Series(counts, index=pd.Index(keys, tupleize_cols=False), name="count")
+
+    def _get_measure_numbers(self):
+        if self._measure_numbers is None:
+            self._measure_numbers = [_get_measure_numbers(p) for p in self.phrases]
+        return self._measure_numbers
+
+    def _get_modal_category_codes(self, group_by):
+        group_by = ModalCategoryType(group_by)
+        if group_by not in self._modal_category_codes:
+            item_keys = [group_by.grouping_func(item) for item in self.items]
+            keys = sorted(set(item_keys))
+            code_by_key = {key: code for code, key in enumerate(keys)}
+            item_codes = np.array([code_by_key[key] for key in item_keys], dtype=np.intp)
+            self._modal_category_codes[group_by] = (keys, item_codes[self.item_indices])
+        return self._modal_category_codes[group_by]
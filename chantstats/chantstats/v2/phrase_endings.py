@@ -0,0 +1,159 @@
+import itertools
+import numpy as np
+from collections import Counter
+from .mode_degree import ModeDegree
+from .pitch_class import PC
+
+__all__ = ["PhraseEnding", "PhraseEndingInMD", "MAX_PHRASE_ENDING_LENGTH", "calculate_phrase_ending_counts"]
+
+# Longest phrase endings (number of notes up to and including the phrase final)
+# for which results can be calculated. Note that the number of possible endings
+# grows exponentially with the length (e.g. there are 18^3 = 5832 possible
+# endings of length 3 in mode degrees).
+MAX_PHRASE_ENDING_LENGTH = 3
+
+PC_CODES = {pc: code for code, pc in enumerate(PC.allowed_values)}
+
+
+class BasePhraseEnding:
+    """
+    Base class for the last few notes of a phrase, i.e. the notes leading
+    to (and including) the phrase final, in chronological order.
+    """
+
+    def __init__(self, values):
+        self.values = tuple(values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.values == other.values
+
+    def __lt__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.values < other.values
+
+    def __hash__(self):
+        return hash(self.values)
+
+
+class PhraseEnding(BasePhraseEnding):
+    def __init__(self, pcs):
+        super().__init__(PC(pc) for pc in pcs)
+
+    def __repr__(self):
+        return f"<PCs{'-'.join(self.values)}_PE>"
+
+    @property
+    def pcs(self):
+        return self.values
+
+    @property
+    def str_value(self):
+        return "-".join(pc.str_value for pc in self.values)
+
+    @property
+    def label_for_plots(self):
+        return "-".join(pc.label_for_plots for pc in self.values)
+
+
+class PhraseEndingInMD(BasePhraseEnding):
+    def __init__(self, mode_degrees):
+        super().__init__(ModeDegree.from_other(md) for md in mode_degrees)
+
+    def __repr__(self):
+        return f"<MDs{'-'.join(md.str_descr for md in self.values)}_PE>"
+
+    @property
+    def mode_degrees(self):
+        return self.values
+
+    @property
+    def str_value(self):
+        return "-".join(md.str_value for md in self.values)
+
+    @property
+    def label_for_plots(self):
+        return "-".join(md.label_for_plots for md in self.values)
+
+
+PhraseEnding.allowed_values = {
+    length: [PhraseEnding(pcs) for pcs in itertools.product(PC.allowed_values, repeat=length)]
+    for length in range(1, MAX_PHRASE_ENDING_LENGTH + 1)
+}
+
+PhraseEndingInMD.allowed_values = {
+    length: [PhraseEndingInMD(mds) for mds in itertools.product(ModeDegree.allowed_values, repeat=length)]
+    for length in range(1, MAX_PHRASE_ENDING_LENGTH + 1)
+}
+
+
+def calculate_phrase_ending_table(phrases, *, max_length=MAX_PHRASE_ENDING_LENGTH):
+    """
+    Return a 2D array containing the integer-coded pitch classes at the end of each phrase,
+    in reverse order (i.e. `table[i, j]` is the code of the `j`-th last note of the `i`-th
+    phrase, so column 0 contains the phrase finals). This is a table of the suffixes of all
+    phrases up to length `max_length`. Entries for phrases with fewer notes are set to -1.
+    """
+    table = np.full((len(phrases), max_length), -1, dtype=np.int64)
+    for idx, phrase in enumerate(phrases):
+        last_pcs = phrase.pitch_classes[-max_length:][::-1]
+        table[idx, : len(last_pcs)] = [PC_CODES[pc] for pc in last_pcs]
+    return table
+
+
+def calculate_phrase_ending_counts(item, *, lengths):
+    """
+    Count the phrase endings of the given lengths in the phrases of the given item
+    (or in the item itself if it is a single phrase).
+
+    The suffix table of all phrases is only calculated once for all lengths. Each
+    suffix is encoded as a single integer (with the pitch classes as digits in base
+    10, starting with the phrase final), so the codes for all lengths are obtained
+    as the cumulative sums along the rows of the table and can be counted in bulk.
+
+    Returns
+    -------
+    dict
+        Dictionary of the form {length: Counter}, where each Counter contains
+        the number of occurrences of each `PhraseEnding` of this length.
+    """
+    lengths = sorted(set(lengths))
+    if not all(1 <= length <= MAX_PHRASE_ENDING_LENGTH for length in lengths):
+        raise ValueError(f"Phrase ending lengths must be between 1 and {MAX_PHRASE_ENDING_LENGTH}. Got: {lengths}")
+
+    phrases = getattr(item, "phrases", [item])
+    table = calculate_phrase_ending_table(phrases, max_length=max(lengths))
+    base = len(PC_CODES)
+    has_suffix = np.logical_and.accumulate(table >= 0, axis=1)  # whether each phrase has at least j+1 notes
+    codes = np.cumsum(np.where(has_suffix, table, 0) * base ** np.arange(table.shape[1]), axis=1)
+
+    counts = {}
+    for length in lengths:
+        unique_codes, num_occurrences = np.unique(codes[has_suffix[:, length - 1], length - 1], return_counts=True)
+        counts[length] = Counter(
+            {
+                PhraseEnding(PC.allowed_values[(code // base**j) % base] for j in reversed(range(length))): int(n)
+                for code, n in zip(unique_codes, num_occurrences)
+            }
+        )
+    return counts
+
+
+def get_phrase_endings_in_mode_degrees(item, *, length):
+    """
+    Return a list containing the endings of the given length of all phrases in the item,
+    in mode degrees relative to the final of the item (not of the individual phrases).
+    """
+    phrases = getattr(item, "phrases", [item])
+    return [
+        PhraseEndingInMD(
+            ModeDegree.from_note_pair(note=n, base_note=item.note_of_final) for n in phrase.notes[-length:]
+        )
+        for phrase in phrases
+        if len(phrase.notes) >= length
+    ]
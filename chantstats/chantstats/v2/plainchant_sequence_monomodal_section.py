@@ -50,6 +50,14 @@ class MonomodalSection:
         )
         return s
 
+    @property
+    def cache_key(self):
+        """
+        Stable identifier of this section (used for caching analysis results).
+        """
+        filename = getattr(self.piece, "filename_full", None)
+        return None if filename is None else ("monomodal_section", filename, self.idx_start, self.idx_end)
+
     def __lt__(self, other):
         return (self.piece.number, self.idx_start) < (other.piece.number, other.idx_start)
 
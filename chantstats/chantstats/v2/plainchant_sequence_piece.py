@@ -6,7 +6,10 @@ from glob import glob
 from time import time
 from tqdm import tqdm
 
+from .instrumentation import increment, instrumented, timed
 from .logging import logger
+from .metadata_index import check_analysis_input_filters
+from .profiling import profiled, profiled_function
 from .modal_category import ModalCategoryType
 from .plainchant_sequence_phrase import PlainchantSequencePhrase
 from .plainchant_sequence_monomodal_section import extract_monomodal_sections_from_piece, extract_monomodal_sections
@@ -91,7 +94,15 @@ class PlainchantSequencePiece:
 
 
 @lru_cache(maxsize=10)
-def load_plainchant_sequence_pieces(input_dir, *, pattern="*.xml", exclude_heavy_polymodal_frame_pieces=False):
+def load_plainchant_sequence_pieces(
+    input_dir,
+    *,
+    pattern="*.xml",
+    exclude_heavy_polymodal_frame_pieces=False,
+    metadata_index=None,
+    min_num_phrases_per_monomodal_section=None,
+    min_num_notes_per_monomodal_section=None,
+):
     """
     Load plainchant sequence pieces from MusicXML files in a given input directory.
 
@@ -105,6 +116,13 @@ def load_plainchant_sequence_pieces(input_dir, *, pattern="*.xml", exclude_heavy
     exclude_heavy_polymodal_frame_pieces : bool
         If True, exclude pieces which have heavy polymodal frame
         (and as a result don't have a well-defined main final).
+    metadata_index : MetadataIndex, optional
+        If given, the metadata of the loaded pieces is added to this index,
+        and pieces which the index knows don't contain any monomodal section
+        satisfying the filters below are skipped.
+    min_num_phrases_per_monomodal_section, min_num_notes_per_monomodal_section : int, optional
+        Filters for skipping pieces via the metadata index (same meaning
+        as for `PlainchantSequencePieces.get_analysis_inputs()`).
 
     Returns
     -------
@@ -113,9 +131,20 @@ def load_plainchant_sequence_pieces(input_dir, *, pattern="*.xml", exclude_heavy
     pattern = pattern if pattern is not None else "*.xml"
     filenames = sorted(glob(os.path.join(input_dir, pattern)))
     logger.debug(f"Found {len(filenames)} pieces matching the pattern '{pattern}'.")
+    if metadata_index is not None:
+        filenames = metadata_index.get_qualifying_filenames(
+            filenames,
+            "plainchant_sequences",
+            min_num_phrases_per_monomodal_section=min_num_phrases_per_monomodal_section,
+            min_num_notes_per_monomodal_section=min_num_notes_per_monomodal_section,
+        )
     logger.debug(f"Loading pieces... ")
     tic = time()
-    pieces = [PlainchantSequencePiece(f) for f in tqdm(filenames)]
+    with timed("loading"), profiled("loading"):
+        pieces = [PlainchantSequencePiece(f) for f in tqdm(filenames)]
+    increment("pieces_loaded", len(pieces))
+    if metadata_index is not None:
+        metadata_index.add_pieces(pieces, "plainchant_sequences")
     if exclude_heavy_polymodal_frame_pieces:
         # pieces = [p for p in pieces if not p.has_heavy_polymodal_frame]
         raise NotImplementedError()
@@ -143,21 +172,58 @@ class PlainchantSequencePieces:
         yield from self.pieces
 
     @classmethod
-    def from_musicxml_files(cls, cfg, filename_pattern=None):
+    def from_musicxml_files(
+        cls,
+        cfg,
+        filename_pattern=None,
+        *,
+        metadata_index=None,
+        min_num_phrases_per_monomodal_section=None,
+        min_num_notes_per_monomodal_section=None,
+        min_num_notes_per_organum_phrase=None,
+    ):
+        check_analysis_input_filters(
+            "plainchant_sequences",
+            min_num_phrases_per_monomodal_section=min_num_phrases_per_monomodal_section,
+            min_num_notes_per_monomodal_section=min_num_notes_per_monomodal_section,
+            min_num_notes_per_organum_phrase=min_num_notes_per_organum_phrase,
+        )
         musicxml_path = cfg.get_musicxml_path("plainchant_sequences")
-        pieces = load_plainchant_sequence_pieces(musicxml_path, pattern=filename_pattern)
+        pieces = load_plainchant_sequence_pieces(
+            musicxml_path,
+            pattern=filename_pattern,
+            metadata_index=metadata_index,
+            min_num_phrases_per_monomodal_section=min_num_phrases_per_monomodal_section,
+            min_num_notes_per_monomodal_section=min_num_notes_per_monomodal_section,
+        )
         return cls(pieces)
 
+    @instrumented("input_extraction")
+    @profiled_function("input_extraction")
     def get_analysis_inputs(
         self,
         mode,
         min_num_phrases_per_monomodal_section=3,
         min_num_notes_per_monomodal_section=80,
         min_num_notes_per_organum_phrase=None,
+        metadata_index=None,
     ):
         mode = ModalCategoryType(mode)
+        pieces = self.pieces
+        if metadata_index is not None:
+            # Skip the pieces which the index knows don't contain any qualifying monomodal sections.
+            qualifying_filenames = set(
+                metadata_index.get_qualifying_filenames(
+                    [piece.filename_full for piece in pieces],
+                    self.repertoire_and_genre,
+                    mode=mode,
+                    min_num_phrases_per_monomodal_section=min_num_phrases_per_monomodal_section,
+                    min_num_notes_per_monomodal_section=min_num_notes_per_monomodal_section,
+                )
+            )
+            pieces = [piece for piece in pieces if piece.filename_full in qualifying_filenames]
         return extract_monomodal_sections(
-            self.pieces,
+            pieces,
             enforce_same_phrase_ambitus=mode.enforce_same_ambitus,
             min_num_phrases=min_num_phrases_per_monomodal_section,
             min_num_notes=min_num_notes_per_monomodal_section,
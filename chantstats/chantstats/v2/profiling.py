@@ -0,0 +1,255 @@
+import contextlib
+import cProfile
+import functools
+import os
+import pstats
+import re
+import sys
+import threading
+from collections import Counter
+from .instrumentation import format_tag
+from .logging import logger
+
+__all__ = ["Profiler", "profiler", "profiled", "profiled_function", "is_profiling_requested_by_env"]
+
+PROFILE_ENV_VAR = "CHANTSTATS_PROFILE"
+
+_null_context = contextlib.nullcontext()
+
+
+def is_profiling_requested_by_env():
+    """
+    Return True if the environment variable CHANTSTATS_PROFILE is set to a non-empty value other than '0'.
+    """
+    return os.environ.get(PROFILE_ENV_VAR, "0") not in ["", "0"]
+
+
+def _sanitize(name):
+    return re.sub(r"[^\w.\-()]+", "__", name).strip("_") or "all"
+
+
+def _describe_frame(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+# Up to Python 3.11, each thread can have its own active cProfile profiler. From Python 3.12
+# onwards cProfile is based on `sys.monitoring`, which only allows a single active profiler
+# in the whole process, so there only the main thread records cProfile profiles (sections in
+# other threads, e.g. the background thread of `export_results()`, still appear in the
+# sampled call stacks).
+_PROFILE_ALL_THREADS = sys.version_info < (3, 12)
+
+
+def _can_profile_current_thread():
+    return _PROFILE_ALL_THREADS or threading.current_thread() is threading.main_thread()
+
+
+class _ProfiledSection:
+    def __init__(self, profiler, stage, tag):
+        self.profiler = profiler
+        self.key = (stage, tag)
+
+    def __enter__(self):
+        # cProfile only supports one active profiler per thread, so the profiler of any
+        # enclosing section is paused while this one is running (i.e., time spent in a
+        # nested section is only recorded in the profile of the innermost section).
+        self.entry_frame = sys._getframe(1)
+        self.profile = cProfile.Profile() if _can_profile_current_thread() else None
+        stack = self.profiler._get_thread_stack()
+        if stack and stack[-1].profile is not None:
+            stack[-1].profile.disable()
+        stack.append(self)
+        if self.profile is not None:
+            try:
+                self.profile.enable()
+            except ValueError as exc:  # another profiling tool is already active (Python 3.12+)
+                logger.warning(f"Cannot profile {self.key[0]} ({exc}); only its call stacks are sampled.")
+                self.profile = None
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profile is not None:
+            self.profile.disable()
+            self.profiler._add_profile(self.key, self.profile)
+        stack = self.profiler._get_thread_stack()
+        stack.pop()
+        if stack and stack[-1].profile is not None:
+            stack[-1].profile.enable()
+        return False
+
+
+class Profiler:
+    """
+    Records a separate cProfile profile for each pipeline stage (loading, input extraction,
+    feature extraction, the calculation and export of each result, the stages of a run plan)
+    and, while enabled, samples the call stacks of all threads which are inside a profiled
+    section to produce collapsed stacks for flame graphs.
+
+    Profiling is disabled by default (in which case `profiled()` returns immediately).
+    `RunPlan.run()`, `export_results()`, `calculate_results()` and `iter_results()` enable
+    it if they are called with `profile=True` or if the environment variable CHANTSTATS_PROFILE
+    is set, and then write the profiles into the folder `profiles` underneath the output root
+    directory (or underneath the current directory for the latter two; see `write()`).
+    Note that only sections running in the current process are profiled, and that from
+    Python 3.12 onwards only sections running in the main thread have cProfile profiles.
+    """
+
+    def __init__(self, sampling_interval=0.005):
+        self.sampling_interval = sampling_interval
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._active_stacks = {}  # {thread id: stack of active sections}
+        self._sampler_thread = None
+        self._stop_sampling = threading.Event()
+        self.reset()
+
+    def __repr__(self):
+        status = "enabled" if self.enabled else "disabled"
+        return f"<Profiler ({status}): {len(self._profiles)} profiles, {sum(self.stack_counts.values())} stack samples>"
+
+    def reset(self):
+        with self._lock:
+            self._profiles = {}  # {(stage, tag): list of cProfile.Profile}
+            self.stack_counts = Counter()  # {collapsed stack: number of samples}
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self._stop_sampling.clear()
+        self._sampler_thread = threading.Thread(target=self._sample_stacks, name="chantstats-profiler", daemon=True)
+        self._sampler_thread.start()
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._stop_sampling.set()
+        self._sampler_thread.join()
+        self._sampler_thread = None
+
+    def profiled(self, stage, tag=None):
+        """
+        Context manager which records a profile of its body under the given stage and tag
+        (e.g. a ResultDescriptor). Profiles for the same stage and tag are accumulated.
+        """
+        if not self.enabled:
+            return _null_context
+        return _ProfiledSection(self, stage, format_tag(tag))
+
+    def profiled_function(self, stage):
+        """
+        Decorator which profiles each call of the decorated function under the given stage.
+        """
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _ProfiledSection(self, stage, None):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def _get_thread_stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            with self._lock:
+                self._active_stacks[threading.get_ident()] = self._local.stack
+            return self._local.stack
+
+    def _add_profile(self, key, profile):
+        # The profiles are only converted to statistics when they are written, so that
+        # this doesn't add to the time spent in any enclosing section.
+        with self._lock:
+            self._profiles.setdefault(key, []).append(profile)
+
+    def _sample_stacks(self):
+        while not self._stop_sampling.wait(self.sampling_interval):
+            frames = sys._current_frames()
+            with self._lock:
+                active = [(tid, list(stack)) for tid, stack in self._active_stacks.items() if stack]
+            for tid, sections in active:
+                frame = frames.get(tid)
+                if frame is None:
+                    continue
+                # Only record the frames below the innermost profiled section; the sections
+                # themselves (stage and tag) form the root of the collapsed stack.
+                entry_frame = sections[-1].entry_frame
+                names = []
+                while frame is not None and frame is not entry_frame:
+                    names.append(_describe_frame(frame))
+                    frame = frame.f_back
+                if frame is None:
+                    continue  # the section was exited while we were sampling
+                prefix = [f"{stage}:{tag}" if tag is not None else stage for stage, tag in (s.key for s in sections)]
+                collapsed = ";".join(x.replace(";", ",") for x in prefix + names[::-1])
+                with self._lock:
+                    self.stack_counts[collapsed] += 1
+
+    def get_stats(self, stage, tag=None):
+        """
+        Return the accumulated profile (as a `pstats.Stats` object) for the given stage and tag.
+        """
+        with self._lock:
+            profiles = list(self._profiles[(stage, format_tag(tag))])
+        return pstats.Stats(*profiles)
+
+    def write(self, output_dir):
+        """
+        Write one `.pstats` file per stage and tag, i.e. `<output_dir>/<stage>/<tag>.pstats`
+        (which can be inspected with `pstats` or tools such as snakeviz), and the sampled
+        call stacks in collapsed format to `<output_dir>/stacks.collapsed` (which can be
+        turned into a flame graph with `flamegraph.pl` or speedscope).
+
+        Returns
+        -------
+        list of str
+            The names of the files written.
+        """
+        filenames = []
+        with self._lock:
+            for (stage, tag), profiles in sorted(self._profiles.items(), key=lambda x: (x[0][0], x[0][1] or "")):
+                stage_dir = os.path.join(output_dir, _sanitize(stage))
+                os.makedirs(stage_dir, exist_ok=True)
+                filename = os.path.join(stage_dir, f"{_sanitize(tag or 'all')}.pstats")
+                pstats.Stats(*profiles).dump_stats(filename)
+                filenames.append(filename)
+
+            os.makedirs(output_dir, exist_ok=True)
+            filename = os.path.join(output_dir, "stacks.collapsed")
+            with open(filename, "w") as f:
+                for stack, count in sorted(self.stack_counts.items()):
+                    f.write(f"{stack} {count}\n")
+            filenames.append(filename)
+        logger.info(f"Wrote {len(filenames) - 1} profiles and collapsed stacks to {output_dir}")
+        return filenames
+
+    @contextlib.contextmanager
+    def session(self, output_dir):
+        """
+        Context manager which enables profiling in its body and writes the profiles
+        to `output_dir` afterwards (see `write()`).
+        """
+        was_enabled = self.enabled
+        self.reset()
+        self.enable()
+        try:
+            yield self
+        finally:
+            if not was_enabled:
+                self.disable()
+            self.write(output_dir)
+
+
+profiler = Profiler()
+
+profiled = profiler.profiled
+profiled_function = profiler.profiled_function
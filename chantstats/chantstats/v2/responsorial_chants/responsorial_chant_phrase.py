@@ -1,4 +1,5 @@
 from ..base_phrase import BasePhrase
+from ..utils import get_barline_type
 
 __all__ = ["ResponsorialChantPhrase"]
 
@@ -8,9 +9,11 @@ class ResponsorialChantPhrase(BasePhrase):
     Represents a phrase in a plainchant sequence piece.
     """
 
-    def __init__(self, measure_stream, *, piece):
+    def __init__(self, measure_stream, *, piece, is_last_phrase_in_stanza=None):
         super().__init__(measure_stream, piece=piece)
-        self.is_last_phrase_in_stanza = self._has_double_or_final_barline()
+        if is_last_phrase_in_stanza is None:
+            is_last_phrase_in_stanza = self._has_double_or_final_barline()
+        self.is_last_phrase_in_stanza = is_last_phrase_in_stanza
 
     def _has_double_or_final_barline(self):
         """
@@ -19,7 +22,7 @@ class ResponsorialChantPhrase(BasePhrase):
         """
         barlines = list(self.measure_stream.getElementsByClass("Barline"))
         assert len(barlines) <= 1
-        assert all([b.style in ("double", "final") for b in barlines])
+        assert all([get_barline_type(b) in ("double", "final") for b in barlines])
         return len(barlines) == 1
 
     def __repr__(self):
@@ -1,14 +1,23 @@
 import music21
 import os
 import re
+from collections import Counter
 from functools import lru_cache
 from glob import glob
 from time import time
 from tqdm import tqdm
+from ..instrumentation import increment, instrumented, timed
 from ..logging import logger
+from ..metadata_index import check_analysis_input_filters
+from ..profiling import profiled, profiled_function
 from ..repertoire_and_genre import RepertoireAndGenreType
 from .responsorial_chant_phrase import ResponsorialChantPhrase
-from .responsorial_chant_stanza import ResponsorialChantStanza
+from .responsorial_chant_stanza import (
+    ResponsorialChantStanza,
+    NonmodulatoryResponsorialChantStanza,
+    get_nonmodulatory_phrase_numbers,
+)
+from ..utils import get_barline_type
 from ..analysis_functions import (
     calculate_L5_occurrences,
     calculate_L4_occurrences,
@@ -43,24 +52,61 @@ class ResponsorialChantPiece:
 
         # TODO: should we actually extract phrases here if we might drop them later?!
         self.measures = list(self.tenor.getElementsByClass("Measure"))
-        self.phrases = [ResponsorialChantPhrase(m, piece=self) for m in self.measures]
+        stanza_end_measures = self._get_measures_with_stanza_end_barlines()
+        self.phrases = [
+            ResponsorialChantPhrase(m, piece=self, is_last_phrase_in_stanza=(m.number in stanza_end_measures))
+            for m in self.measures
+        ]
         self.num_phrases = len(self.phrases)
+        self._calculate_stanza_index()
 
     def __repr__(self):
         return f"<Piece '{self.filename_short}'>"
 
-    def get_stanzas(self):
+    def _get_measures_with_stanza_end_barlines(self):
+        """
+        Return the set of measure numbers which end in a double or final barline
+        (these indicate stanza boundaries in responsorial chant pieces).
+        """
+        barlines = list(self.tenor.recurse().getElementsByClass("Barline"))
+        assert all(count <= 1 for count in Counter(b.measureNumber for b in barlines).values())
+        assert all([get_barline_type(b) in ("double", "final") for b in barlines])
+        return set(b.measureNumber for b in barlines)
+
+    def _calculate_stanza_index(self):
+        """
+        Determine the phrase ranges of all stanzas, and the phrases within each stanza which
+        end on the stanza final (i.e. the non-modulatory phrases), once when the piece is loaded.
+        The stanza objects themselves are created on first access and then reused.
+        """
         stanza_ends = [p.phrase_number for p in self.phrases if p.is_last_phrase_in_stanza]
         stanza_starts = [1] + [n + 1 for n in stanza_ends[:-1]]
         idx_of_last_phrase_in_piece = self.phrases[-1].phrase_number
         assert idx_of_last_phrase_in_piece in stanza_ends
-        return [
-            ResponsorialChantStanza(self, idx_start, idx_end)
-            for (idx_start, idx_end) in zip(stanza_starts, stanza_ends)
+        self.stanza_boundaries = list(zip(stanza_starts, stanza_ends))
+
+        self.nonmodulatory_phrase_numbers = [
+            get_nonmodulatory_phrase_numbers(self.phrases[idx_start - 1 : idx_end])
+            for idx_start, idx_end in self.stanza_boundaries
         ]
 
+        self._stanzas = None
+        self._stanzas_without_modulatory_phrases = None
+
+    def get_stanzas(self):
+        if self._stanzas is None:
+            self._stanzas = [
+                ResponsorialChantStanza(self, idx_start, idx_end) for (idx_start, idx_end) in self.stanza_boundaries
+            ]
+        return list(self._stanzas)
+
     def get_stanzas_without_modulatory_phrases(self):
-        return [s.without_modulatory_phrases() for s in self.get_stanzas()]
+        if self._stanzas_without_modulatory_phrases is None:
+            self._stanzas_without_modulatory_phrases = [
+                NonmodulatoryResponsorialChantStanza(self, phrase_numbers)
+                for phrase_numbers in self.nonmodulatory_phrase_numbers
+            ]
+        return list(self._stanzas_without_modulatory_phrases)
 
     def get_occurring_mode_degrees(self):
         mds = set()
@@ -70,7 +116,7 @@ class ResponsorialChantPiece:
 
 
 @lru_cache(maxsize=10)
-def load_responsorial_chant_pieces(input_dir, *, pattern="*.xml"):
+def load_responsorial_chant_pieces(input_dir, *, pattern="*.xml", metadata_index=None):
     """
     Load responsorial chant pieces from MusicXML files in a given input directory.
 
@@ -81,6 +127,8 @@ def load_responsorial_chant_pieces(input_dir, *, pattern="*.xml"):
     pattern : str, optional
         Filename pattern; this can be used to filter the files
         to be loaded to a subset (for example during testing).
+    metadata_index : MetadataIndex, optional
+        If given, the metadata of the loaded pieces is added to this index.
 
     Returns
     -------
@@ -91,7 +139,11 @@ def load_responsorial_chant_pieces(input_dir, *, pattern="*.xml"):
     logger.debug(f"Found {len(filenames)} pieces matching the pattern '{pattern}'.")
     logger.debug(f"Loading pieces... ")
     tic = time()
-    pieces = [ResponsorialChantPiece(f) for f in tqdm(filenames)]
+    with timed("loading"), profiled("loading"):
+        pieces = [ResponsorialChantPiece(f) for f in tqdm(filenames)]
+    increment("pieces_loaded", len(pieces))
+    if metadata_index is not None:
+        metadata_index.add_pieces(pieces, "responsorial_chants")
     toc = time()
     logger.debug(f"Done. Loaded {len(pieces)} pieces.")
     logger.debug(f"Loading pieces took {toc-tic:.2f} seconds.")
@@ -114,17 +166,35 @@ class ResponsorialChantPieces:
         yield from self.pieces
 
     @classmethod
-    def from_musicxml_files(cls, cfg, filename_pattern=None):
+    def from_musicxml_files(
+        cls,
+        cfg,
+        filename_pattern=None,
+        *,
+        metadata_index=None,
+        min_num_phrases_per_monomodal_section=None,
+        min_num_notes_per_monomodal_section=None,
+        min_num_notes_per_organum_phrase=None,
+    ):
+        check_analysis_input_filters(
+            "responsorial_chants",
+            min_num_phrases_per_monomodal_section=min_num_phrases_per_monomodal_section,
+            min_num_notes_per_monomodal_section=min_num_notes_per_monomodal_section,
+            min_num_notes_per_organum_phrase=min_num_notes_per_organum_phrase,
+        )
         musicxml_path = cfg.get_musicxml_path("responsorial_chants")
-        pieces = load_responsorial_chant_pieces(musicxml_path, pattern=filename_pattern)
+        pieces = load_responsorial_chant_pieces(musicxml_path, pattern=filename_pattern, metadata_index=metadata_index)
         return cls(pieces)
 
+    @instrumented("input_extraction")
+    @profiled_function("input_extraction")
     def get_analysis_inputs(
         self,
         mode=None,
         min_num_phrases_per_monomodal_section=None,
         min_num_notes_per_monomodal_section=None,
         min_num_notes_per_organum_phrase=None,
+        metadata_index=None,  # not needed because the inputs are cheap to extract from the loaded pieces
     ):
         return sum([piece.get_stanzas_without_modulatory_phrases() for piece in self.pieces], [])
 
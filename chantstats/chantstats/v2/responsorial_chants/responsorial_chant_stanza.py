@@ -1,6 +1,15 @@
 from ..ambitus import calculate_ambitus
 
-__all__ = ["ResponsorialChantStanza", "NonmodulatoryResponsorialChantStanza"]
+__all__ = ["ResponsorialChantStanza", "NonmodulatoryResponsorialChantStanza", "get_nonmodulatory_phrase_numbers"]
+
+
+def get_nonmodulatory_phrase_numbers(phrases):
+    """
+    Return the numbers of the phrases of a stanza which end on the stanza final
+    (i.e. on the final of its last phrase). The remaining phrases are modulatory.
+    """
+    stanza_final = phrases[-1].final
+    return [p.phrase_number for p in phrases if p.final == stanza_final]
 
 
 class NonmodulatoryResponsorialChantStanza:
@@ -36,6 +45,14 @@ class NonmodulatoryResponsorialChantStanza:
         )
         return s
 
+    @property
+    def cache_key(self):
+        """
+        Stable identifier of this stanza (used for caching analysis results).
+        """
+        filename = getattr(self.piece, "filename_full", None)
+        return None if filename is None else ("nonmodulatory_stanza", filename, tuple(self.phrase_numbers))
+
     def __lt__(self, other):
         return (self.piece.descr_stub, tuple(self.phrase_numbers)) < (
             other.piece.descr_stub,
@@ -74,5 +91,4 @@ class ResponsorialChantStanza:
         return s
 
     def without_modulatory_phrases(self):
-        phrase_numbers = [p.phrase_number for p in self.phrases if p.final == self.stanza_final]
-        return NonmodulatoryResponsorialChantStanza(self.piece, phrase_numbers)
+        return NonmodulatoryResponsorialChantStanza(self.piece, get_nonmodulatory_phrase_numbers(self.phrases))
@@ -1,24 +1,42 @@
 import os
 from .repertoire_and_genre import RepertoireAndGenreType
 from .analysis_type import AnalysisType
+from .dendrogram.distance_metrics import DEFAULT_METRIC, DEFAULT_LINKAGE_METHOD
 from .unit import UnitType
 
 
 class ResultDescriptor:
-    def __init__(self, rep_and_genre, analysis, unit, modal_category):
+    def __init__(
+        self, rep_and_genre, analysis, unit, modal_category, *, metric=DEFAULT_METRIC, method=DEFAULT_LINKAGE_METHOD
+    ):
         self.rep_and_genre = RepertoireAndGenreType(rep_and_genre)
         self.analysis = AnalysisType(analysis)
         self.unit = UnitType(unit)
         self.modal_category = modal_category
+        self.metric = metric
+        self.method = method
 
         self.sep = "__"
-        self.output_dirname = os.path.join(
+        output_dirname_parts = [
             self.rep_and_genre.output_path_stub_1,
             self.analysis.output_path_stub_1,
             self.analysis.output_path_stub_2,
             self.rep_and_genre.output_path_stub_2,
             self.unit.output_path_stub,
-        )
+        ]
+        if self.clustering_output_path_stub != "":
+            output_dirname_parts.append(self.clustering_output_path_stub)
+        self.output_dirname = os.path.join(*output_dirname_parts)
+
+    @property
+    def clustering_output_path_stub(self):
+        """
+        Output path stub recording the distance metric and linkage method used for the dendrogram.
+        This is empty for the default metric and method, so that the output paths stay the same.
+        """
+        if self.metric == DEFAULT_METRIC and self.method == DEFAULT_LINKAGE_METHOD:
+            return ""
+        return f"{self.metric}{self.sep}{self.method}_linkage"
 
     def get_output_dir(self, output_root_dir):
         return os.path.join(output_root_dir, self.output_dirname)
@@ -60,4 +78,6 @@ class ResultDescriptor:
             self.modal_category.output_path_stub_1,
             self.modal_category.output_path_stub_2,
         )
+        if self.clustering_output_path_stub != "":
+            result_descriptor_stubs += (self.clustering_output_path_stub,)
         return f"<{result_descriptor_stubs}>"
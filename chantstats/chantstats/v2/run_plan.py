@@ -0,0 +1,851 @@
+import argparse
+import contextlib
+import functools
+import os
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from glob import glob
+from time import time
+from .analysis_functions import PAIR_COUNT_ANALYSES, check_analysis_for_repertoire, get_units_for_analysis
+from .analysis_type import AnalysisType
+from .calculate_results import get_modal_categories, iter_results_for_modal_categories
+from .checkpoints import CheckpointStore, calculate_fingerprint
+from .config import ChantStatsConfig
+from .dendrogram.distance_metrics import DEFAULT_METRIC, DEFAULT_LINKAGE_METHOD, check_metric_and_method
+from .export_results import export_result
+from .instrumentation import increment, instrumentation, instrumented, timed
+from .item_cache import default_item_cache, get_counts_for_items
+from .logging import logger
+from .metadata_index import ANALYSIS_INPUT_FILTERS, MetadataIndex
+from .modal_category import ModalCategoryType
+from .old_code.organum_piece import OrganumPiece, OrganumPieces, OrganumPhrases
+from .plainchant_sequence_piece import PlainchantSequencePiece, PlainchantSequencePieces
+from .profiling import is_profiling_requested_by_env, profiled, profiler
+from .repertoire_and_genre import RepertoireAndGenreType
+from .responsorial_chants import ResponsorialChantPiece, ResponsorialChantPieces
+from .result_descriptor import ResultDescriptor
+from .subsampling import Subsampler
+from .unit import UnitType
+
+__all__ = ["RunPlan", "Stage", "StageGraph"]
+
+#
+# Classes into which the MusicXML files for each repertoire and genre are parsed. Organum pieces
+# and organum phrases are extracted from the same files, so they share the same loading stages.
+#
+PIECE_CLASSES = {
+    "plainchant_sequences": PlainchantSequencePiece,
+    "responsorial_chants": ResponsorialChantPiece,
+    "organum": OrganumPiece,
+}
+LOADER_NAMES = {
+    RepertoireAndGenreType.PLAINCHANT_SEQUENCES: "plainchant_sequences",
+    RepertoireAndGenreType.RESPONSORIAL_CHANTS: "responsorial_chants",
+    RepertoireAndGenreType.ORGANUM_PIECES: "organum",
+    RepertoireAndGenreType.ORGANUM_PHRASES: "organum",
+}
+
+
+class Stage:
+    """
+    A single step of a run plan (e.g. loading the pieces of a repertoire, or
+    calculating the dendrograms for one analysis and unit).
+
+    Parameters
+    ----------
+    key : tuple
+        Unique identifier of the stage; the first element is the kind of stage
+        (e.g. "load_pieces"), the remaining ones are its parameters. Stages with
+        the same key are only run once, however many other stages depend on them.
+    func : callable
+        Function which performs the stage. It is called with the outputs of the
+        stages in `deps` (in the same order) as positional arguments.
+    deps : tuple
+        Keys of the stages whose outputs this stage needs.
+    in_main_thread : bool
+        If True, the stage always runs in the main thread (this is needed
+        for stages which produce plots, because matplotlib isn't thread-safe).
+    estimated_work : int, optional
+        Estimate of the amount of work done by this stage (e.g. the number of files
+        to be parsed), which is shown in the description of the run plan.
+    params : dict, optional
+        Parameters which affect the output of the stage but are not part of its key
+        (e.g. the sampling seed). These are included in its checkpoint fingerprint.
+    input_files : list of str, optional
+        Files read by the stage. Its checkpoint is invalidated if any of them change.
+    checkpoint : bool
+        If True (the default), the output of the stage is saved when running the
+        graph with checkpoints. Set this to False for stages which are cheap to
+        re-run but whose outputs would be large.
+    """
+
+    def __init__(
+        self,
+        key,
+        func,
+        deps=(),
+        *,
+        in_main_thread=False,
+        estimated_work=None,
+        params=None,
+        input_files=(),
+        checkpoint=True,
+    ):
+        self.key = tuple(key)
+        self.func = func
+        self.deps = tuple(deps)
+        self.in_main_thread = in_main_thread
+        self.estimated_work = estimated_work
+        self.params = params or {}
+        self.input_files = list(input_files)
+        self.checkpoint = checkpoint
+
+    def __repr__(self):
+        return f"<Stage: {self.descr}>"
+
+    @property
+    def kind(self):
+        return self.key[0]
+
+    @property
+    def descr(self):
+        return f"{self.kind}({', '.join(str(getattr(x, 'value', x)) for x in self.key[1:])})"
+
+    def run(self, dep_outputs):
+        with timed(f"run_plan.{self.kind}", tag=self.descr), profiled(f"run_plan.{self.kind}", self.descr):
+            return self.func(*dep_outputs)
+
+
+class StageGraph:
+    """
+    Directed acyclic graph of stages, which is run by a local scheduler.
+
+    Stages are stored in the order in which they were added. Since a stage
+    can only be added after all of its dependencies, this is a topological
+    order of the graph.
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+
+    def __repr__(self):
+        return f"<StageGraph with {len(self)} stages>"
+
+    def __len__(self):
+        return len(self.stages)
+
+    def __iter__(self):
+        yield from self.stages.values()
+
+    def __getitem__(self, key):
+        return self.stages[tuple(key)]
+
+    def __contains__(self, key):
+        return tuple(key) in self.stages
+
+    def add(self, stage):
+        """
+        Add the given stage to the graph, unless a stage with the same key
+        already exists. Returns the key of the stage.
+        """
+        if stage.key in self.stages:
+            return stage.key
+        missing_deps = [key for key in stage.deps if key not in self.stages]
+        if missing_deps != []:
+            raise ValueError(f"Cannot add stage {stage.descr} before its dependencies: {missing_deps}")
+        self.stages[stage.key] = stage
+        return stage.key
+
+    def get_dependents(self):
+        """
+        Return a dictionary of the form {key: [keys of all stages which depend on this stage]}.
+        """
+        dependents = {key: [] for key in self.stages}
+        for stage in self:
+            for dep in stage.deps:
+                dependents[dep].append(stage.key)
+        return dependents
+
+    def get_sinks(self):
+        """
+        Return the keys of all stages on which no other stage depends.
+        """
+        return [key for key, dependents in self.get_dependents().items() if dependents == []]
+
+    def count_stages_without_deduplication(self):
+        """
+        Return the number of stages which would be run if every stage re-computed all
+        of its dependencies itself (i.e., as in a nested loop over all parameters).
+        """
+        num_stages = {}
+        for stage in self:
+            num_stages[stage.key] = 1 + sum(num_stages[dep] for dep in stage.deps)
+        return sum(num_stages[key] for key in self.get_sinks())
+
+    def describe(self, checkpoints=None):
+        """
+        Return a human-readable description of the stage graph and the estimated work. If
+        `checkpoints` is given, also show which stages would be skipped when resuming a run.
+        """
+        if isinstance(checkpoints, str):
+            checkpoints = CheckpointStore(checkpoints)
+        keys_to_run, _ = self.get_stages_to_run(checkpoints)
+        idx = {key: i for i, key in enumerate(self.stages, start=1)}
+        width = len(str(len(self)))
+        lines = []
+        for stage in self:
+            line = f"[{idx[stage.key]:{width}d}] {stage.descr}"
+            if stage.deps:
+                line += f"  <- {', '.join(str(idx[dep]) for dep in stage.deps)}"
+            if stage.estimated_work is not None:
+                line += f"  (estimated work: {stage.estimated_work})"
+            if stage.key not in keys_to_run:
+                line += "  [completed]"
+            lines.append(line)
+
+        lines.append("")
+        lines.append(f"{len(self)} unique stages ({self.count_stages_without_deduplication()} without deduplication):")
+        num_stages_per_kind = Counter(stage.kind for stage in self)
+        num_stages_to_run_per_kind = Counter(self.stages[key].kind for key in keys_to_run)
+        work_per_kind = Counter()
+        for stage in self:
+            work_per_kind[stage.kind] += stage.estimated_work or 0
+        for kind, num_stages in num_stages_per_kind.items():
+            work = f" (estimated work: {work_per_kind[kind]})" if work_per_kind[kind] > 0 else ""
+            to_run = f", {num_stages_to_run_per_kind[kind]} to run" if checkpoints is not None else ""
+            lines.append(f"   {kind}: {num_stages}{work}{to_run}")
+        return "\n".join(lines)
+
+    def get_fingerprints(self):
+        """
+        Return a dictionary of the form {key: fingerprint}, where the fingerprint of each stage
+        identifies its output by all of its inputs (see `calculate_fingerprint()`).
+        """
+        fingerprints = {}
+        for stage in self:
+            fingerprints[stage.key] = calculate_fingerprint(
+                stage.key,
+                params=stage.params,
+                input_files=stage.input_files,
+                dep_fingerprints=[fingerprints[dep] for dep in stage.deps],
+            )
+        return fingerprints
+
+    def get_stages_to_run(self, checkpoints=None):
+        """
+        Return a pair `(keys_to_run, keys_to_load)` containing the keys of the stages which need
+        to run and of those whose outputs are loaded from the given checkpoints instead (because
+        they completed in an earlier run and their outputs are needed by a stage which runs now,
+        or because they are final stages). Completed stages whose outputs aren't needed are skipped.
+        """
+        fingerprints = self.get_fingerprints() if checkpoints is not None else {}
+        is_completed = lambda key: checkpoints is not None and fingerprints[key] in checkpoints
+        sinks = set(self.get_sinks())
+        needed = set(sinks)
+        keys_to_run = set()
+        keys_to_load = set()
+        for stage in reversed(self.stages.values()):
+            if stage.key not in needed:
+                continue
+            if is_completed(stage.key):
+                keys_to_load.add(stage.key)
+            else:
+                keys_to_run.add(stage.key)
+                needed.update(stage.deps)
+        return keys_to_run, keys_to_load
+
+    def run(self, *, workers=None, checkpoints=None):
+        """
+        Run all stages, each of them exactly once and only after all of its dependencies.
+
+        Parameters
+        ----------
+        workers : int, optional
+            Number of worker threads in which the stages run. If this is None or 1, all
+            stages run serially in the main thread (in topological order). Stages with
+            `in_main_thread=True` always run in the main thread.
+        checkpoints : CheckpointStore or str, optional
+            If given, the output of each stage is saved in this checkpoint store (or
+            directory) as soon as the stage completes, and stages which completed in an
+            earlier run with the same inputs are skipped. This allows resuming a run
+            which was interrupted.
+
+        Returns
+        -------
+        dict
+            Dictionary of the form {key: output} for all stages on which no other stage
+            depends. The outputs of all other stages are released as soon as all stages
+            which depend on them have finished.
+        """
+        if isinstance(checkpoints, str):
+            checkpoints = CheckpointStore(checkpoints)
+        fingerprints = self.get_fingerprints() if checkpoints is not None else {}
+        keys_to_run, keys_to_load = self.get_stages_to_run(checkpoints)
+        if keys_to_load:
+            logger.info(
+                f"Resuming from checkpoints: loading the outputs of {len(keys_to_load)} stages, "
+                f"running {len(keys_to_run)} of {len(self)} stages."
+            )
+
+        # Stages whose outputs are loaded from checkpoints don't depend on anything.
+        deps = {key: (self.stages[key].deps if key in keys_to_run else ()) for key in self.stages}
+        keys = [key for key in self.stages if key in keys_to_run or key in keys_to_load]
+        dependents = {key: [] for key in keys}
+        for key in keys:
+            for dep in deps[key]:
+                dependents[dep].append(key)
+        sinks = set(self.get_sinks())
+        num_unfinished_deps = {key: len(set(deps[key])) for key in keys}
+        num_unfinished_dependents = {key: len(set(dependents[key])) for key in keys}
+        ready = deque(key for key in keys if num_unfinished_deps[key] == 0)
+        outputs = {}
+        running = {}  # {future: key}
+        start_times = {}
+
+        def start(key):
+            start_times[key] = time()
+            if key in keys_to_run:
+                logger.info(f"Running stage {self.stages[key].descr}")
+                increment("stages_run")
+            return [outputs[dep] for dep in deps[key]]
+
+        def finish(key, output):
+            stage = self.stages[key]
+            logger.debug(f"Finished stage {stage.descr} in {time() - start_times.pop(key):.2f} seconds.")
+            if checkpoints is not None and key in keys_to_run and stage.checkpoint:
+                checkpoints.save(fingerprints[key], output, descr=stage.descr)
+            outputs[key] = output
+            for dependent in set(dependents[key]):
+                num_unfinished_deps[dependent] -= 1
+                if num_unfinished_deps[dependent] == 0:
+                    ready.append(dependent)
+            for dep in set(deps[key]):
+                num_unfinished_dependents[dep] -= 1
+                if num_unfinished_dependents[dep] == 0 and dep not in sinks:
+                    del outputs[dep]
+
+        use_threads = workers is not None and workers > 1
+        with ThreadPoolExecutor(max_workers=workers if use_threads else 1) as executor:
+            while ready or running:
+                if ready:
+                    key = ready.popleft()
+                    stage = self.stages[key]
+                    dep_outputs = start(key)
+                    if key in keys_to_load:
+                        increment("stages_loaded_from_checkpoints")
+                        finish(key, checkpoints.load(fingerprints[key]))
+                    elif use_threads and not stage.in_main_thread:
+                        running[executor.submit(stage.run, dep_outputs)] = key
+                    else:
+                        finish(key, stage.run(dep_outputs))
+                else:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(running.pop(future), future.result())
+
+        assert len(outputs) == len(sinks)
+        return {key: outputs[key] for key in self.stages if key in sinks}
+
+
+@instrumented("loading")
+def _parse_musicxml_file(loader_name, filename, *, repertoire_and_genre, metadata_index):
+    increment("pieces_loaded")
+    piece = PIECE_CLASSES[loader_name](filename)
+    if metadata_index is not None:
+        metadata_index.add_pieces([piece], repertoire_and_genre)
+    return piece
+
+
+def _collect_pieces(*pieces):
+    return list(pieces)
+
+
+def _extract_analysis_inputs(
+    pieces,
+    *,
+    repertoire_and_genre,
+    mode,
+    min_num_phrases_per_monomodal_section,
+    min_num_notes_per_monomodal_section,
+    min_num_notes_per_organum_phrase,
+    metadata_index,
+):
+    if repertoire_and_genre == "plainchant_sequences":
+        collection = PlainchantSequencePieces(pieces)
+    elif repertoire_and_genre == "responsorial_chants":
+        collection = ResponsorialChantPieces(pieces)
+    elif repertoire_and_genre == "organum_pieces":
+        collection = OrganumPieces(pieces)
+    elif repertoire_and_genre == "organum_phrases":
+        collection = OrganumPhrases(sum([piece.phrases for piece in pieces], []))
+    else:
+        raise NotImplementedError()
+
+    return collection.get_analysis_inputs(
+        mode,
+        min_num_phrases_per_monomodal_section=min_num_phrases_per_monomodal_section,
+        min_num_notes_per_monomodal_section=min_num_notes_per_monomodal_section,
+        min_num_notes_per_organum_phrase=min_num_notes_per_organum_phrase,
+        metadata_index=metadata_index,
+    )
+
+
+def _group_by_modal_category(analysis_inputs, *, mode, sampling_fraction, sampling_seed):
+    return get_modal_categories(
+        [(mode, Subsampler(analysis_inputs))],
+        sampling_fraction=sampling_fraction,
+        sampling_seed=sampling_seed,
+    )
+
+
+def _calculate_counts(modal_categories, *, analysis, units, cache, workers):
+    all_items = [item for modal_category in modal_categories for item in modal_category.items]
+    all_counts = iter(get_counts_for_items(all_items, analysis=analysis, units=units, cache=cache, workers=workers))
+    return [[next(all_counts) for _ in modal_category.items] for modal_category in modal_categories]
+
+
+def _calculate_results(modal_categories, counts, *, unit, **kwargs):
+    # The counts have already been calculated for all units (and added to the cache) by the
+    # "counts" stage, so the cache isn't needed here. Only the key of each modal category is
+    # kept with its result (rather than the result descriptor, which refers to the modal
+    # category and thus to all its items and pieces), so that checkpoints of this stage
+    # stay small. The "result_descriptors" stage re-attaches the modal categories.
+    results = iter_results_for_modal_categories(
+        modal_categories, units=[unit], counts_per_modal_category=counts, cache=None, **kwargs
+    )
+    return [(result_descriptor.modal_category.key, result) for result_descriptor, result in results]
+
+
+def _attach_result_descriptors(modal_categories, results, *, repertoire_and_genre, analysis, unit, metric, method):
+    assert [modal_category.key for modal_category in modal_categories] == [key for key, _ in results]
+    return [
+        (
+            ResultDescriptor(repertoire_and_genre, analysis, unit, modal_category, metric=metric, method=method),
+            result,
+        )
+        for modal_category, (_, result) in zip(modal_categories, results)
+    ]
+
+
+def _export_results(results, *, output_root_dir, p_cutoff, include_leaf_nodes_in_clusters):
+    output_root_dir = os.path.join(output_root_dir, f"p_cutoff_{p_cutoff:.2f}")
+    for result_descriptor, result in results:
+        export_result(
+            result_descriptor,
+            result,
+            output_root_dir,
+            p_cutoff=p_cutoff,
+            include_leaf_nodes_in_clusters=include_leaf_nodes_in_clusters,
+        )
+    return len(results)
+
+
+class RunPlan:
+    """
+    Declarative description of a set of analyses, i.e. the cartesian product
+
+        repertoires x analyses x modes x units x p_cutoffs
+
+    (with the same sampling parameters and filters for all of them).
+
+    A run plan is compiled into a graph of stages (see `compile()`) in which each
+    intermediate step (loading the pieces, extracting the analysis inputs, grouping
+    them by modal category, counting their features, calculating the results for
+    each unit, exporting) is a separate stage. Stages which are shared between
+    different analyses, units, cutoffs or repertoires only run once.
+
+    If a `metadata_index` is given, the pieces are added to it when they are parsed, and
+    any files (or pieces) which the index knows don't contain any analysis inputs satisfying
+    the filters are skipped when loading the pieces and extracting the analysis inputs (see
+    `MetadataIndex.get_qualifying_filenames()`). This doesn't change the results.
+
+    The default values are the ones used for the exported results.
+    """
+
+    def __init__(
+        self,
+        repertoires,
+        analyses,
+        *,
+        modes=None,
+        units=None,
+        p_cutoffs=(0.4,),
+        sampling_fraction=0.7,
+        sampling_seed=99999,
+        min_num_phrases_per_monomodal_section=3,
+        min_num_notes_per_monomodal_section=80,
+        min_num_notes_per_organum_phrase=12,
+        metric=DEFAULT_METRIC,
+        method=DEFAULT_LINKAGE_METHOD,
+        leaf_ordering="auto",
+        num_bootstrap_replicates=0,
+        bootstrap_scales=(1.0,),
+        bootstrap_seed=None,
+        include_leaf_nodes_in_clusters=True,
+        cache=default_item_cache,
+        metadata_index=None,
+    ):
+        check_metric_and_method(metric, method)
+        self.repertoires = [RepertoireAndGenreType(x) for x in repertoires]
+        self.analyses = [AnalysisType(x) for x in analyses]
+        self.modes = [ModalCategoryType(x) for x in (modes or list(ModalCategoryType))]
+        self.units = [UnitType(x) for x in (units or list(UnitType))]
+        self.p_cutoffs = list(p_cutoffs)
+        self.sampling_fraction = sampling_fraction
+        self.sampling_seed = sampling_seed
+        self.min_num_phrases_per_monomodal_section = min_num_phrases_per_monomodal_section
+        self.min_num_notes_per_monomodal_section = min_num_notes_per_monomodal_section
+        self.min_num_notes_per_organum_phrase = min_num_notes_per_organum_phrase
+        self.metric = metric
+        self.method = method
+        self.leaf_ordering = leaf_ordering
+        self.num_bootstrap_replicates = num_bootstrap_replicates
+        self.bootstrap_scales = tuple(bootstrap_scales)
+        self.bootstrap_seed = bootstrap_seed
+        self.include_leaf_nodes_in_clusters = include_leaf_nodes_in_clusters
+        self.cache = cache
+        self.metadata_index = metadata_index
+
+    def __repr__(self):
+        return (
+            f"<RunPlan: {len(self.repertoires)} repertoires x {len(self.analyses)} analyses x "
+            f"{len(self.modes)} modes x {len(self.units)} units x {len(self.p_cutoffs)} cutoffs>"
+        )
+
+    def get_modes(self, repertoire_and_genre, analysis):
+        """
+        Return the modes for which results are calculated for the given repertoire and analysis.
+        """
+        modes = self.modes
+        if repertoire_and_genre in ["organum_pieces", "organum_phrases"]:
+            # The ambitus is not defined for organum, so it can only be grouped by final.
+            modes = [mode for mode in modes if mode == "final"]
+        if analysis == "tendency":
+            # Tendency results are only needed for mode="final"
+            modes = [mode for mode in modes if mode == "final"]
+        return modes
+
+    def compile(self, cfg, output_root_dir=None, *, workers=None):
+        """
+        Compile the run plan into a graph of stages.
+
+        Parameters
+        ----------
+        cfg : ChantStatsConfig
+            Config containing the paths to the MusicXML files.
+        output_root_dir : str, optional
+            Root directory into which the results are exported. If this is None,
+            the graph doesn't contain any export stages, and running it returns
+            the results instead (as the outputs of the "result_descriptors" stages).
+        workers : int, optional
+            Number of worker processes used by the "counts" and "results" stages
+            (see `RunPlan.run()`). This doesn't affect the outputs of any stages.
+
+        Returns
+        -------
+        StageGraph
+        """
+        # Check all combinations up front (i.e. before anything is loaded).
+        units_per_analysis = {analysis: get_units_for_analysis(analysis, self.units) for analysis in self.analyses}
+        for rep in self.repertoires:
+            for analysis in self.analyses:
+                check_analysis_for_repertoire(analysis, rep)
+
+        graph = StageGraph()
+        filters = dict(
+            min_num_phrases_per_monomodal_section=self.min_num_phrases_per_monomodal_section,
+            min_num_notes_per_monomodal_section=self.min_num_notes_per_monomodal_section,
+            min_num_notes_per_organum_phrase=self.min_num_notes_per_organum_phrase,
+        )
+        dendrogram_options = dict(
+            leaf_ordering=self.leaf_ordering,
+            num_bootstrap_replicates=self.num_bootstrap_replicates,
+            bootstrap_scales=self.bootstrap_scales,
+            bootstrap_seed=self.bootstrap_seed,
+        )
+
+        # Organum pieces and organum phrases share the same loading stages, so these
+        # need to load all files which qualify for either of them.
+        filenames_per_loader = {}
+        for rep in self.repertoires:
+            musicxml_path = cfg.get_musicxml_path(rep)
+            filenames = sorted(glob(os.path.join(musicxml_path, "*.xml")))
+            if self.metadata_index is not None:
+                filenames = self.metadata_index.get_qualifying_filenames(
+                    filenames, rep, **{name: filters[name] for name in ANALYSIS_INPUT_FILTERS[rep]}
+                )
+            filenames_per_loader.setdefault((LOADER_NAMES[rep], musicxml_path), set()).update(filenames)
+
+        for rep in self.repertoires:
+            loader_name = LOADER_NAMES[rep]
+            musicxml_path = cfg.get_musicxml_path(rep)
+            filenames = sorted(filenames_per_loader[(loader_name, musicxml_path)])
+            # Each file is parsed in a separate stage, so that a run which fails on
+            # one of the files can be resumed without parsing the others again.
+            parse_stages = [
+                graph.add(
+                    Stage(
+                        ("parse_musicxml_file", loader_name, filename),
+                        functools.partial(
+                            _parse_musicxml_file,
+                            loader_name,
+                            filename,
+                            repertoire_and_genre=rep,
+                            metadata_index=self.metadata_index,
+                        ),
+                        input_files=[filename],
+                        in_main_thread=True,  # music21 and the metadata index are not thread-safe
+                    )
+                )
+                for filename in filenames
+            ]
+            load = graph.add(
+                Stage(
+                    ("load_pieces", loader_name, musicxml_path),
+                    _collect_pieces,
+                    deps=parse_stages,
+                    estimated_work=len(filenames),
+                    checkpoint=False,  # the parsed pieces are already saved for each file
+                )
+            )
+            for analysis in self.analyses:
+                is_pair_count_analysis = analysis in PAIR_COUNT_ANALYSES
+                units = units_per_analysis[analysis]
+                for mode in self.get_modes(rep, analysis):
+                    inputs = graph.add(
+                        Stage(
+                            ("analysis_inputs", rep, mode),
+                            functools.partial(
+                                _extract_analysis_inputs,
+                                repertoire_and_genre=rep,
+                                mode=mode,
+                                metadata_index=self.metadata_index,
+                                **filters,
+                            ),
+                            deps=[load],
+                            params=filters,
+                            checkpoint=False,  # cheap to re-run (but contains references to the pieces)
+                            # The SQLite connection of the metadata index can only be used in its own thread.
+                            in_main_thread=self.metadata_index is not None,
+                        )
+                    )
+                    grouping = graph.add(
+                        Stage(
+                            ("modal_categories", rep, mode),
+                            functools.partial(
+                                _group_by_modal_category,
+                                mode=mode,
+                                sampling_fraction=self.sampling_fraction,
+                                sampling_seed=self.sampling_seed,
+                            ),
+                            deps=[inputs],
+                            params=dict(sampling_fraction=self.sampling_fraction, sampling_seed=self.sampling_seed),
+                            checkpoint=False,  # cheap to re-run (but contains references to the pieces)
+                        )
+                    )
+                    counts = graph.add(
+                        Stage(
+                            ("counts", rep, mode, analysis),
+                            functools.partial(
+                                _calculate_counts,
+                                analysis=analysis,
+                                units=units,
+                                cache=self.cache,
+                                workers=workers,
+                            ),
+                            deps=[grouping],
+                            params=dict(units=[unit.value for unit in units]),
+                            in_main_thread=True,  # the item cache is not thread-safe
+                        )
+                    )
+                    for unit in units:
+                        if is_pair_count_analysis:
+                            # These results don't involve any clustering.
+                            metric, method, options = DEFAULT_METRIC, DEFAULT_LINKAGE_METHOD, {}
+                            key = ("results", rep, mode, analysis, unit)
+                        else:
+                            metric, method, options = self.metric, self.method, dendrogram_options
+                            key = ("results", rep, mode, analysis, unit, metric, method)
+                        results = graph.add(
+                            Stage(
+                                key,
+                                functools.partial(
+                                    _calculate_results,
+                                    repertoire_and_genre=rep,
+                                    analysis=analysis,
+                                    unit=unit,
+                                    metric=metric,
+                                    method=method,
+                                    workers=workers,
+                                    **options,
+                                ),
+                                deps=[grouping, counts],
+                                params=options,
+                            )
+                        )
+                        results = graph.add(
+                            Stage(
+                                ("result_descriptors",) + key[1:],
+                                functools.partial(
+                                    _attach_result_descriptors,
+                                    repertoire_and_genre=rep,
+                                    analysis=analysis,
+                                    unit=unit,
+                                    metric=metric,
+                                    method=method,
+                                ),
+                                deps=[grouping, results],
+                                checkpoint=False,  # cheap to re-run (but contains references to the pieces)
+                            )
+                        )
+                        if output_root_dir is None:
+                            continue
+                        for p_cutoff in self.p_cutoffs:
+                            graph.add(
+                                Stage(
+                                    ("export", rep, mode, analysis, unit, metric, method, p_cutoff),
+                                    functools.partial(
+                                        _export_results,
+                                        output_root_dir=output_root_dir,
+                                        p_cutoff=p_cutoff,
+                                        include_leaf_nodes_in_clusters=self.include_leaf_nodes_in_clusters,
+                                    ),
+                                    deps=[results],
+                                    params=dict(
+                                        output_root_dir=os.path.abspath(output_root_dir),
+                                        include_leaf_nodes_in_clusters=self.include_leaf_nodes_in_clusters,
+                                    ),
+                                    in_main_thread=True,  # matplotlib is not thread-safe
+                                )
+                            )
+        return graph
+
+    def run(
+        self,
+        cfg,
+        output_root_dir=None,
+        *,
+        workers=None,
+        checkpoint_dir=None,
+        dry_run=False,
+        instrumentation_report=None,
+        track_memory=False,
+        top_allocation_sites=10,
+        profile=None,
+    ):
+        """
+        Compile the run plan and run all its stages (see `StageGraph.run()`). If `checkpoint_dir`
+        is given, completed stages are saved there and skipped when the run is repeated.
+
+        The stages run one after another in the main thread. If `workers` is greater than 1,
+        each stage which counts the features of the items ("counts") or calculates the results
+        for the modal categories of one analysis and unit ("results") distributes this work over
+        `workers` worker processes (in the same way as `calculate_results()`). If a "results"
+        stage contains a single modal category, its bootstrap replicates use the workers instead.
+
+        If `dry_run` is True, only log the stage graph and the estimated work (without running
+        anything) and return the graph. Otherwise return the outputs of the final stages.
+
+        If `instrumentation_report` is given, timings and counters are collected during the
+        run (see `Instrumentation`) and written to this file as a JSON report at the end. If
+        `track_memory` is True, the report also contains the memory usage of each stage and
+        the `top_allocation_sites` allocation sites which retained the most memory during the
+        run (see `Instrumentation.enable()`; set this to 0 to skip the tracemalloc snapshots).
+
+        If `profile` is True (or if it is None and the environment variable CHANTSTATS_PROFILE
+        is set), a separate profile is recorded for each stage and each result, and written to
+        the folder `profiles` underneath `output_root_dir` (see `Profiler`). If profiling is
+        requested by the environment variable and `output_root_dir` is None, the profiles are
+        written to the folder `profiles` underneath the current directory instead.
+        """
+        graph = self.compile(cfg, output_root_dir=output_root_dir, workers=workers)
+        if dry_run:
+            logger.info(f"Stage graph for {self}:\n{graph.describe()}")
+            return graph
+        if profile is None:
+            profile = is_profiling_requested_by_env() and not profiler.enabled
+            # Without an output root directory the profiles are written to the current
+            # directory (the same as for `calculate_results()`).
+            profiles_root_dir = output_root_dir if output_root_dir is not None else os.curdir
+        elif profile and output_root_dir is None:
+            raise ValueError("Profiling requires an output root directory (into which the profiles are written).")
+        else:
+            profiles_root_dir = output_root_dir
+
+        with contextlib.ExitStack() as stack:
+            if instrumentation_report is not None:
+                # The callbacks run in reverse order, so the memory tracking (if any) is
+                # stopped before the report is written (which avoids a second snapshot).
+                stack.callback(instrumentation.write_report, instrumentation_report)
+                if not instrumentation.enabled:
+                    stack.callback(instrumentation.disable)
+                elif instrumentation.memory is None:
+                    stack.callback(instrumentation.disable_memory_tracking)
+                instrumentation.reset()
+                instrumentation.enable(memory=track_memory, top_allocation_sites=top_allocation_sites)
+            elif track_memory:
+                raise ValueError("Memory tracking requires an instrumentation report (into which it is written).")
+            if profile:
+                stack.enter_context(profiler.session(os.path.abspath(os.path.join(profiles_root_dir, "profiles"))))
+            return graph.run(checkpoints=checkpoint_dir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calculate and export the results for a run plan.")
+    parser.add_argument("--repertoires", default=",".join(RepertoireAndGenreType), help="comma-separated")
+    parser.add_argument("--analyses", default="pc_freqs,tendency,L_and_M__L5_u_M5,L_and_M__L4_u_M4")
+    parser.add_argument("--modes", default=None, help="comma-separated (default: all)")
+    parser.add_argument("--units", default=None, help="comma-separated (default: all)")
+    parser.add_argument("--p-cutoffs", default="0.4", help="comma-separated")
+    parser.add_argument("--output-root-dir", default=os.environ.get("CHANTSTATS_OUTPUT_ROOT_DIR"))
+    parser.add_argument(
+        "--workers", type=int, default=None, help="number of worker processes for counting and calculating results"
+    )
+    parser.add_argument("--checkpoint-dir", default=None, help="save completed stages here and resume from them")
+    parser.add_argument("--dry-run", action="store_true", help="print the stage graph without running it")
+    parser.add_argument("--instrumentation-report", default=None, help="write stage timings and counters here (JSON)")
+    parser.add_argument(
+        "--track-memory", action="store_true", help="include memory usage in the instrumentation report"
+    )
+    parser.add_argument(
+        "--top-allocation-sites",
+        type=int,
+        default=10,
+        help="number of allocation sites of retained memory to report (0 skips the tracemalloc snapshots)",
+    )
+    parser.add_argument("--profile", action="store_true", help="write per-stage profiles to <output-root-dir>/profiles")
+    parser.add_argument(
+        "--metadata-index", default=None, help="SQLite file used to skip pieces without qualifying inputs"
+    )
+    args = parser.parse_args(argv)
+
+    split = lambda value: None if value is None else value.split(",")
+    plan = RunPlan(
+        split(args.repertoires),
+        split(args.analyses),
+        modes=split(args.modes),
+        units=split(args.units),
+        p_cutoffs=[float(x) for x in split(args.p_cutoffs)],
+        metadata_index=MetadataIndex(args.metadata_index) if args.metadata_index is not None else None,
+    )
+    cfg = ChantStatsConfig.from_env()
+    if args.dry_run:
+        print(plan)
+        print(plan.compile(cfg, output_root_dir=args.output_root_dir).describe(checkpoints=args.checkpoint_dir))
+    else:
+        if args.output_root_dir is None:
+            parser.error("--output-root-dir (or CHANTSTATS_OUTPUT_ROOT_DIR) must be given to export results")
+        plan.run(
+            cfg,
+            args.output_root_dir,
+            workers=args.workers,
+            checkpoint_dir=args.checkpoint_dir,
+            instrumentation_report=args.instrumentation_report,
+            track_memory=args.track_memory,
+            top_allocation_sites=args.top_allocation_sites,
+            profile=args.profile or None,
+        )
+
+
+if __name__ == "__main__":
+    main()
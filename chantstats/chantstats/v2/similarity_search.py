@@ -0,0 +1,162 @@
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+from .analysis_type import AnalysisType
+from .dendrogram.distance_metrics import (
+    DEFAULT_METRIC,
+    DISTANCE_METRICS,
+    calculate_distances_to_prepared_rows,
+    prepare_frequencies,
+)
+from .item_cache import default_item_cache, get_counts_for_items
+from .logging import logger
+from .modal_category import make_counts_dataframe
+from .unit import UnitType
+
+__all__ = ["SimilarityIndex"]
+
+
+class SimilarityIndex:
+    """
+    Index which allows to find the analysis items (e.g. monomodal sections or stanzas)
+    whose results are most similar to those of a given item, for example "which sections
+    in the corpus have the most similar mode profile to this one?".
+
+    The similarity of two items is measured with the same distance metric as used for
+    the dendrograms (by default 1-p, where p is the p-value of the chi-square test).
+    For each analysis and unit, the frequency distributions of all items are calculated
+    and prepared only once (when the first query for this analysis and unit is made),
+    so that each subsequent query only needs a single vectorized pass over all items.
+    """
+
+    def __init__(self, items, *, metric=DEFAULT_METRIC, cache=default_item_cache, workers=None):
+        if metric not in DISTANCE_METRICS:
+            raise ValueError(f"Invalid distance metric: '{metric}'. Allowed metrics: {list(DISTANCE_METRICS)}")
+        self.items = list(items)
+        self.metric = metric
+        self.cache = cache
+        self.workers = workers
+        self._features = {}
+
+        self._positions = defaultdict(list)
+        for idx, item in enumerate(self.items):
+            self._positions[item.descr].append(idx)
+        duplicate_descrs = [descr for descr, positions in self._positions.items() if len(positions) > 1]
+        if duplicate_descrs:
+            logger.warning(f"Similarity index contains {len(duplicate_descrs)} duplicate item descriptions.")
+
+    @classmethod
+    def from_pieces(
+        cls,
+        *pieces,
+        mode="final",
+        min_num_phrases_per_monomodal_section=3,
+        min_num_notes_per_monomodal_section=80,
+        min_num_notes_per_organum_phrase=12,
+        **kwargs,
+    ):
+        """
+        Create a similarity index over the analysis inputs of one or more collections
+        of pieces (e.g. from several repertoires). The remaining keyword arguments are
+        passed on to the constructor.
+        """
+        items = []
+        for p in pieces:
+            items.extend(
+                p.get_analysis_inputs(
+                    mode,
+                    min_num_phrases_per_monomodal_section=min_num_phrases_per_monomodal_section,
+                    min_num_notes_per_monomodal_section=min_num_notes_per_monomodal_section,
+                    min_num_notes_per_organum_phrase=min_num_notes_per_organum_phrase,
+                )
+            )
+        return cls(items, **kwargs)
+
+    def __repr__(self):
+        return f"<SimilarityIndex with {len(self.items)} items (metric: '{self.metric}')>"
+
+    def __len__(self):
+        return len(self.items)
+
+    def get_frequencies_dataframe(self, *, analysis, unit):
+        """
+        Return the dataframe with the relative frequencies (in percent) of all items for the
+        given analysis and unit (one row per item). This is the same data from which the
+        dendrograms are calculated.
+        """
+        return self._get_features(analysis, unit)[0]
+
+    def _get_features(self, analysis, unit):
+        analysis = AnalysisType(analysis)
+        unit = UnitType(unit)
+        if (analysis, unit) not in self._features:
+            counts_per_item = get_counts_for_items(
+                self.items, analysis=analysis, units=[unit], cache=self.cache, workers=self.workers
+            )
+            df_counts = make_counts_dataframe(self.items, counts_per_item, analysis=analysis, unit=unit)
+            row_sums = df_counts.sum(axis=1)
+            if (row_sums == 0).any():
+                logger.warning(
+                    f"Similarity index: {(row_sums == 0).sum()} items without any {analysis} results "
+                    f"for unit '{unit}' are never returned as similar items."
+                )
+            df_freqs = df_counts.div(row_sums.where(row_sums > 0), axis=0) * 100
+            valid_positions = np.flatnonzero(row_sums.values > 0)
+            prepared_rows = prepare_frequencies(df_freqs.values[valid_positions], metric=self.metric)
+            self._features[(analysis, unit)] = (df_freqs, valid_positions, prepared_rows)
+        return self._features[(analysis, unit)]
+
+    def _get_position(self, item_descr):
+        positions = self._positions.get(item_descr, [])
+        if len(positions) == 0:
+            raise ValueError(f"Item not found in similarity index: '{item_descr}'")
+        elif len(positions) > 1:
+            raise ValueError(f"Item description is not unique in similarity index: '{item_descr}'")
+        return positions[0]
+
+    def _get_nearest_neighbours(self, prepared_row, *, analysis, unit, k, exclude_positions=()):
+        df_freqs, valid_positions, prepared_rows = self._get_features(analysis, unit)
+        distances = np.full(len(df_freqs), np.inf)
+        distances[valid_positions] = calculate_distances_to_prepared_rows(
+            prepared_row, prepared_rows, metric=self.metric
+        )
+        distances[list(exclude_positions)] = np.inf
+
+        k = min(k, int(np.isfinite(distances).sum()))
+        candidates = np.argpartition(distances, k - 1)[:k] if k > 0 else np.array([], dtype=np.intp)
+        # Sort by distance (and by position in the index for equal distances)
+        candidates = candidates[np.lexsort((candidates, distances[candidates]))]
+        return pd.Series(distances[candidates], index=df_freqs.index[candidates], name="distance")
+
+    def find_similar(self, item_descr, analysis, unit, k=10):
+        """
+        Return the `k` items which are most similar to the item with the given description
+        (excluding the item itself) for the given analysis and unit.
+
+        Returns
+        -------
+        pandas.Series
+            Distances of the most similar items (indexed by their descriptions),
+            sorted from the most to the least similar item.
+        """
+        _, valid_positions, prepared_rows = self._get_features(analysis, unit)
+        position = self._get_position(item_descr)
+        idx = np.searchsorted(valid_positions, position)
+        if idx == len(valid_positions) or valid_positions[idx] != position:
+            raise ValueError(f"Item '{item_descr}' does not have any {analysis} results for unit '{unit}'.")
+        return self._get_nearest_neighbours(
+            prepared_rows[idx], analysis=analysis, unit=unit, k=k, exclude_positions=[position]
+        )
+
+    def find_similar_to_frequencies(self, freqs, analysis, unit, k=10):
+        """
+        Same as `find_similar()`, but for a frequency distribution which is not part of the
+        index (e.g. an average mode profile). The argument `freqs` must be a pandas Series
+        whose index contains the same values as the columns of `get_frequencies_dataframe()`.
+        """
+        df_freqs = self.get_frequencies_dataframe(analysis=analysis, unit=unit)
+        freqs = freqs.reindex(df_freqs.columns).fillna(0).values.astype(float)
+        if freqs.sum() == 0:
+            raise ValueError("Cannot find similar items for frequency distribution with only zero values.")
+        prepared_row = prepare_frequencies(100 * freqs[np.newaxis, :] / freqs.sum(), metric=self.metric)[0]
+        return self._get_nearest_neighbours(prepared_row, analysis=analysis, unit=unit, k=k)
@@ -0,0 +1,85 @@
+import numpy as np
+from .logging import logger
+
+__all__ = ["Subsampler"]
+
+
+class Subsampler:
+    """
+    Draws reproducible sub-samples of a fixed list of values.
+
+    Sub-samples are represented by arrays of indices into the original list,
+    and each seed uses its own random number stream (the global numpy random
+    state is never touched). This makes it cheap to draw sub-samples for many
+    different seeds: the values are only sorted once, and each sub-sample is
+    put into sorted order by sorting its indices by the precomputed ranks.
+
+    For a given seed, the sub-samples are the same as the ones produced by
+    earlier versions of `get_subsample()` (which used `np.random.seed(seed)`).
+    """
+
+    def __init__(self, values, *, sort_key=None):
+        self.values = list(values)
+        self.num_values = len(self.values)
+        self.sort_key = sort_key
+        self._ranks = None
+
+    @property
+    def ranks(self):
+        """
+        Position of each value in the sorted list of all values (this is
+        only calculated once, when the first sub-sample is drawn).
+        """
+        if self._ranks is None:
+            # We sort the indices (rather than the values) so that equal values keep their original order.
+            if self.sort_key is None:
+                key = lambda idx: self.values[idx]
+            else:
+                key = lambda idx: self.sort_key(self.values[idx])
+            sorted_indices = sorted(range(self.num_values), key=key)
+            self._ranks = np.empty(self.num_values, dtype=np.intp)
+            self._ranks[sorted_indices] = np.arange(self.num_values)
+        return self._ranks
+
+    def __repr__(self):
+        return f"<Subsampler for {self.num_values} values>"
+
+    def get_sample_size(self, fraction):
+        assert 0.0 <= fraction <= 1.0
+        return int(self.num_values * fraction)
+
+    def get_indices(self, fraction, seed):
+        """
+        Return the indices of the values in the sub-sample for the given
+        fraction and seed (in sorted order of the corresponding values).
+        If `fraction` is 1.0, all indices are returned in their original order.
+        """
+        assert 0.0 <= fraction <= 1.0
+        if fraction == 1.0:
+            return np.arange(self.num_values)
+        if seed is None:
+            raise ValueError("Must provide a sampling seed.")
+
+        perm = np.random.RandomState(seed).permutation(self.num_values)
+        sample_indices = perm[: self.get_sample_size(fraction)]
+        return sample_indices[np.argsort(self.ranks[sample_indices], kind="stable")]
+
+    def select(self, indices):
+        """
+        Return the values for the given indices. The returned list contains
+        references to the original values (which are not copied).
+        """
+        return [self.values[idx] for idx in indices]
+
+    def get_subsample(self, fraction, seed):
+        """
+        Return the sub-sample of values for the given fraction and seed.
+        """
+        if fraction == 1.0:
+            logger.info("Not doing any sub-sampling.")
+        else:
+            logger.info(
+                f"Extracting sub-sample using {self.get_sample_size(fraction)} out of {self.num_values} values "
+                f"(seed={seed})."
+            )
+        return self.select(self.get_indices(fraction, seed))
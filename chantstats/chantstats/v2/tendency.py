@@ -1,17 +1,26 @@
+import numpy as np
 import pandas as pd
+from collections import Counter
+from .interval_type import IntervalType, classify_intervals
 from .mode_degree import ModeDegree
 from .pitch_class import PC
 
-__all__ = ["BaseTendency", "PCTendency"]
+__all__ = ["BaseTendency", "PCTendency", "PCApproaches", "ModeDegreeApproaches", "calculate_approach_counts"]
+
+PC_CODES = {pc: code for code, pc in enumerate(PC.allowed_values)}
 
 
 class BaseTendency:
     def __init__(self, pairs, *, label_first, label_second, cls_first, cls_second, replace_nan_values_with_zeros):
-        if pairs == []:
+        # Note: `pairs` can also be a mapping {pair: count} (e.g. a `collections.Counter`).
+        pair_counts = Counter(pairs)
+        if not pair_counts:
             self.df_pair_counts = pd.DataFrame(0, columns=cls_first.allowed_values, index=cls_second.allowed_values)
         else:
-            first_items, second_items = zip(*pairs)
-            df = pd.DataFrame({label_first: first_items, label_second: second_items, "count": 1}).dropna()
+            first_items, second_items = zip(*pair_counts.keys())
+            df = pd.DataFrame(
+                {label_first: first_items, label_second: second_items, "count": list(pair_counts.values())}
+            ).dropna()
             df_pivot_table = df.pivot_table(
                 index=label_second, columns=label_first, values="count", aggfunc=sum, fill_value=0
             )
@@ -43,11 +52,24 @@ class BaseTendency:
 
         return res.unstack()  # same as the dataframe, but as a series with a hierarchical index
 
+    @classmethod
+    def from_pair_counts(cls, pair_counts, replace_nan_values_with_zeros=True):
+        """
+        Instantiate from a mapping {(first, second): count} of pair counts (e.g. a
+        `collections.Counter`) instead of from an analysis item.
+        """
+        obj = cls.__new__(cls)
+        obj._init_from_pairs(pair_counts, replace_nan_values_with_zeros=replace_nan_values_with_zeros)
+        return obj
+
 
 class PCTendency(BaseTendency):
     def __init__(cls, item, replace_nan_values_with_zeros=True):
+        cls._init_from_pairs(item.pc_pairs, replace_nan_values_with_zeros=replace_nan_values_with_zeros)
+
+    def _init_from_pairs(self, pairs, *, replace_nan_values_with_zeros):
         super().__init__(
-            item.pc_pairs,
+            pairs,
             label_first="pc1",
             label_second="pc2",
             cls_first=PC,
@@ -58,8 +80,11 @@ class PCTendency(BaseTendency):
 
 class ModeDegreeTendency(BaseTendency):
     def __init__(cls, item, replace_nan_values_with_zeros=True):
+        cls._init_from_pairs(item.mode_degree_pairs, replace_nan_values_with_zeros=replace_nan_values_with_zeros)
+
+    def _init_from_pairs(self, pairs, *, replace_nan_values_with_zeros):
         super().__init__(
-            item.mode_degree_pairs,
+            pairs,
             label_first="md1",
             label_second="md2",
             cls_first=ModeDegree,
@@ -68,9 +93,90 @@ class ModeDegreeTendency(BaseTendency):
         )
 
 
-# class PCApproaches(BaseTendency):
-#     def __init__(cls, item):
-#         second_pcs = [pc2 for (_, pc2) in item.pc_pairs]
-#         approach_interval_types = [note_pair.interval_type_v1 for note_pair in item.note_pairs]
-#         pairs = zip(second_pcs, approach_interval_types)
-#         super().__init__(pairs, label_first="pc2", label_second="approach")
+def calculate_interval_types_of_note_pairs(item, *, version="v1"):
+    """
+    Classify the intervals between all pairs of consecutive notes within the phrases of the
+    item (i.e. the same pairs as in `item.pc_pairs`) in a single vectorized pass over the
+    semitone array of the item (see `classify_intervals()`), without creating any `NotePair`
+    objects. With version="v1" minor thirds count as leaps (the same as `NotePair.interval_type_v1`),
+    with version="v2" they count as steps (the same as `NotePair.interval_type_v2`).
+
+    Returns
+    -------
+    numpy.ndarray
+        Position of the interval type of each pair in `IntervalType.allowed_values`.
+    """
+    phrases = getattr(item, "phrases", [item])
+    semitones = np.concatenate([np.diff([n.pitch.ps for n in phrase.notes]) for phrase in phrases] + [np.empty(0)])
+    return classify_intervals(semitones, version=version)
+
+
+def calculate_approach_counts(item, *, version="v1"):
+    """
+    Count how each pitch class is approached from the preceding note (by a common tone,
+    a step or a leap), for all pairs of consecutive notes within the phrases of the item
+    (i.e. the same pairs as in `item.pc_pairs`). The interval types are classified
+    according to the given version (see `classify_intervals()`).
+
+    Returns
+    -------
+    collections.Counter
+        Counter of the form {(pc2, interval_type): count}.
+    """
+    phrases = getattr(item, "phrases", [item])
+    interval_type_codes = calculate_interval_types_of_note_pairs(item, version=version)
+    pc2_codes = np.array([PC_CODES[pc] for phrase in phrases for pc in phrase.pitch_classes[1:]], dtype=np.intp)
+    assert len(pc2_codes) == len(interval_type_codes)
+
+    num_interval_types = len(IntervalType.allowed_values)
+    pair_counts = np.bincount(
+        pc2_codes * num_interval_types + interval_type_codes, minlength=len(PC_CODES) * num_interval_types
+    )
+    return Counter(
+        {
+            (
+                PC.allowed_values[code // num_interval_types],
+                IntervalType.allowed_values[code % num_interval_types],
+            ): int(count)
+            for code, count in enumerate(pair_counts)
+            if count > 0
+        }
+    )
+
+
+class PCApproaches(BaseTendency):
+    def __init__(cls, item, replace_nan_values_with_zeros=True, *, version="v1"):
+        cls._init_from_pairs(
+            calculate_approach_counts(item, version=version),
+            replace_nan_values_with_zeros=replace_nan_values_with_zeros,
+        )
+
+    def _init_from_pairs(self, pairs, *, replace_nan_values_with_zeros):
+        super().__init__(
+            pairs,
+            label_first="pc2",
+            label_second="approach",
+            cls_first=PC,
+            cls_second=IntervalType,
+            replace_nan_values_with_zeros=replace_nan_values_with_zeros,
+        )
+
+
+class ModeDegreeApproaches(BaseTendency):
+    def __init__(cls, item, replace_nan_values_with_zeros=True, *, version="v1"):
+        second_mds = [md2 for (_, md2) in item.mode_degree_pairs]
+        interval_type_codes = calculate_interval_types_of_note_pairs(item, version=version)
+        interval_types = [IntervalType.allowed_values[code] for code in interval_type_codes]
+        cls._init_from_pairs(
+            zip(second_mds, interval_types), replace_nan_values_with_zeros=replace_nan_values_with_zeros
+        )
+
+    def _init_from_pairs(self, pairs, *, replace_nan_values_with_zeros):
+        super().__init__(
+            pairs,
+            label_first="md2",
+            label_second="approach",
+            cls_first=ModeDegree,
+            cls_second=IntervalType,
+            replace_nan_values_with_zeros=replace_nan_values_with_zeros,
+        )
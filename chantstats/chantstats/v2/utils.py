@@ -5,14 +5,25 @@ import sh
 import shutil
 from enum import Enum
 from .logging import logger
+from .subsampling import Subsampler
 
-__all__ = ["EnumWithDescription", "remove_file_or_folder_if_exists", "plot_empty_figure"]
+__all__ = ["EnumWithDescription", "remove_file_or_folder_if_exists", "plot_empty_figure", "get_barline_type"]
 
 
 def is_close_to_zero_or_100(x):
     return np.isclose(x, 0.0) or np.isclose(x, 100.0)
 
 
+def get_barline_type(barline):
+    """
+    Return the type of the given music21 barline (e.g. "double" or "final").
+    """
+    # The barline type is stored in `Barline.style` in music21 v5 but in `Barline.type` in later
+    # versions (where `style` refers to the generic music21 `Style` object of the barline).
+    barline_type = getattr(barline, "type", None)
+    return barline_type if isinstance(barline_type, str) else barline.style
+
+
 def list_directory_tree(root_dir):
     """
     List contents of `root_dir` in a tree-like format.
@@ -73,6 +84,8 @@ class EnumWithDescription(str, Enum):
 def get_subsample(values, fraction, seed, sort_key=None):
     """
     Return a sub-sample of the given input values.
+
+    See `Subsampler` for drawing sub-samples of the same values for multiple seeds.
     """
     assert 0.0 <= fraction <= 1.0
     if fraction == 1.0:
@@ -82,13 +95,7 @@ def get_subsample(values, fraction, seed, sort_key=None):
         if seed is None:
             raise ValueError("Must provide a sampling seed.")
 
-        np.random.seed(seed)
-        num_values = len(values)
-        sample_size = int(len(values) * fraction)
-        logger.info(f"Extracting sub-sample using {sample_size} out of {num_values} values (seed={seed}).")
-        perm = np.random.permutation(num_values)
-        sample_indices = sorted(perm[:sample_size])
-        return sorted(np.take(values, sample_indices), key=sort_key)
+        return Subsampler(values, sort_key=sort_key).get_subsample(fraction, seed)
 
 
 def plot_empty_figure(msg_text, *, result_descriptor=None, fontsize=20, figsize=(22, 4)):
@@ -0,0 +1,161 @@
+import numpy as np
+from collections import Counter
+from .logging import logger
+
+__all__ = [
+    "VerticalInterval",
+    "SimpleVerticalInterval",
+    "calculate_vertical_intervals",
+    "calculate_vertical_interval_counts",
+]
+
+# Range of vertical intervals (in semitones, from the tenor up to the duplum) which are counted
+# individually. Negative intervals occur where the duplum crosses below the tenor. Any intervals
+# outside this range (which are most likely due to errors in the transcription) are counted in
+# a separate "out of range" bucket.
+MIN_VERTICAL_INTERVAL = -12
+MAX_VERTICAL_INTERVAL = 24
+
+SIMPLE_INTERVAL_NAMES = ["P1", "m2", "M2", "m3", "M3", "P4", "TT", "P5", "m6", "M6", "m7", "M7"]
+
+
+class VerticalInterval:
+    """
+    Vertical interval between the duplum and the (sounding) tenor note, in semitones.
+    The special value `VerticalInterval.OUT_OF_RANGE` (with `semitones=None`) stands for
+    all intervals outside the range MIN_VERTICAL_INTERVAL..MAX_VERTICAL_INTERVAL.
+    """
+
+    def __init__(self, semitones):
+        self.semitones = None if semitones is None else int(semitones)
+
+    def __repr__(self):
+        return f"<VerticalInterval: {self.str_value}>"
+
+    def __eq__(self, other):
+        return self.semitones == other.semitones
+
+    def __lt__(self, other):
+        return self._sort_key < other._sort_key
+
+    def __hash__(self):
+        return hash(self.semitones)
+
+    @property
+    def _sort_key(self):
+        # The out-of-range bucket comes last
+        return (self.semitones is None, self.semitones or 0)
+
+    @property
+    def str_value(self):
+        return "out_of_range" if self.semitones is None else f"{self.semitones:+d}"
+
+    @property
+    def label_for_plots(self):
+        return self.str_value
+
+
+class SimpleVerticalInterval:
+    """
+    Simple interval obtained by reducing a vertical interval by whole octaves, i.e. its
+    size in semitones modulo the octave (from P1 to M7), regardless of whether the duplum
+    is above or below the tenor. Note that unlike interval classes in the set-theoretic
+    sense, complementary intervals (such as P4 and P5) are kept apart.
+    """
+
+    def __init__(self, value):
+        self.value = int(value)
+        assert 0 <= self.value < 12
+
+    def __repr__(self):
+        return f"<SimpleVerticalInterval: {self.str_value}>"
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return self.value < other.value
+
+    def __hash__(self):
+        return hash(self.value)
+
+    @property
+    def str_value(self):
+        return SIMPLE_INTERVAL_NAMES[self.value]
+
+    @property
+    def label_for_plots(self):
+        return self.str_value
+
+
+VerticalInterval.OUT_OF_RANGE = VerticalInterval(None)
+VerticalInterval.allowed_values = [
+    VerticalInterval(semitones) for semitones in range(MIN_VERTICAL_INTERVAL, MAX_VERTICAL_INTERVAL + 1)
+] + [VerticalInterval.OUT_OF_RANGE]
+SimpleVerticalInterval.allowed_values = [SimpleVerticalInterval(value) for value in range(12)]
+
+
+def calculate_vertical_intervals(duplum_pitches, tenor_pitches):
+    """
+    Return the vertical intervals (in semitones) between the duplum and the tenor at every duplum note.
+
+    Parameters
+    ----------
+    duplum_pitches, tenor_pitches : numpy.ndarray
+        Pitches (as MIDI numbers) of the duplum and tenor notes in the rows of an organum piece
+        dataframe (i.e. aligned by offset). Entries are NaN where no note starts in that voice.
+        The tenor is forward-filled because a tenor note sounds until the next one starts. Rows
+        without any duplum note and rows before the first tenor note are skipped.
+    """
+    duplum_pitches = np.asarray(duplum_pitches, dtype=float)
+    tenor_pitches = np.asarray(tenor_pitches, dtype=float)
+    assert duplum_pitches.shape == tenor_pitches.shape
+
+    has_tenor_note = ~np.isnan(tenor_pitches)
+    idx_of_last_tenor_note = np.maximum.accumulate(np.where(has_tenor_note, np.arange(len(tenor_pitches)), 0))
+    tenor_pitches_ffilled = np.where(
+        has_tenor_note[idx_of_last_tenor_note], tenor_pitches[idx_of_last_tenor_note], np.nan
+    )
+
+    intervals = duplum_pitches - tenor_pitches_ffilled
+    return np.rint(intervals[~np.isnan(intervals)]).astype(int)
+
+
+def calculate_vertical_interval_counts(item, *, simple=False):
+    """
+    Count the vertical intervals in the given item (an organum phrase or organum purum duplum part).
+
+    Parameters
+    ----------
+    simple : bool
+        If True, count the octave-reduced simple intervals (`SimpleVerticalInterval`)
+        rather than the vertical intervals in semitones (`VerticalInterval`). Otherwise
+        any intervals outside the range MIN_VERTICAL_INTERVAL..MAX_VERTICAL_INTERVAL are
+        counted as `VerticalInterval.OUT_OF_RANGE` (and a warning is logged).
+
+    Returns
+    -------
+    collections.Counter
+    """
+    try:
+        semitones = item.vertical_intervals
+    except AttributeError:
+        raise NotImplementedError(f"Vertical intervals are only defined for organum, not for {type(item).__name__}")
+
+    if simple:
+        num_occurrences = np.bincount(np.abs(semitones) % 12, minlength=12)
+        allowed_values = SimpleVerticalInterval.allowed_values
+    else:
+        is_out_of_range = (semitones < MIN_VERTICAL_INTERVAL) | (semitones > MAX_VERTICAL_INTERVAL)
+        if is_out_of_range.any():
+            logger.warning(
+                f"Found {is_out_of_range.sum()} vertical intervals outside the range {MIN_VERTICAL_INTERVAL}.."
+                f"{MAX_VERTICAL_INTERVAL} semitones in {getattr(item, 'descr', item)}: "
+                f"{sorted(set(semitones[is_out_of_range].tolist()))} (these are counted as out of range)."
+            )
+        out_of_range_idx = len(VerticalInterval.allowed_values) - 1
+        indices = np.where(is_out_of_range, out_of_range_idx, semitones - MIN_VERTICAL_INTERVAL)
+        num_occurrences = np.bincount(indices, minlength=len(VerticalInterval.allowed_values))
+        allowed_values = VerticalInterval.allowed_values
+
+    return Counter({allowed_values[idx]: int(n) for idx, n in enumerate(num_occurrences) if n > 0})
@@ -0,0 +1,27 @@
+import pytest
+from .context import chantstats, write_plainchant_sequence_piece
+from chantstats.v2.plainchant_sequence_piece import PlainchantSequencePieces, load_plainchant_sequence_pieces
+
+PHRASES = [
+    ["D4", "F4", "G4", "A4", "G4", "F4", "E4", "D4"],
+    ["D4", "C4", "D4", "F4", "E4", "D4"],
+    ["A4", "B-4", "A4", "G4", "F4", "E4", "D4"],
+    ["G4", "A4", "C5", "B4", "A4", "G4"],
+    ["G4", "F4", "G4", "A4", "B4", "A4", "G4"],
+    ["C5", "D5", "C5", "B4", "A4", "B4", "G4"],
+]
+
+
+@pytest.fixture(scope="session")
+def plainchant_sequence_pieces(tmp_path_factory):
+    """
+    Collection of 24 small plainchant sequence pieces (with between two and five phrases each,
+    ending on D or G) which are written to MusicXML files and loaded via the regular loader.
+    """
+    tmp_path = tmp_path_factory.mktemp("plainchant_sequences")
+    for i in range(24):
+        phrases = [PHRASES[(i + j * (i % 3 + 1)) % len(PHRASES)] for j in range(2 + i % 4)]
+        write_plainchant_sequence_piece(tmp_path / f"BN_lat_1112_Sequence_{i + 1:02d}_test.xml", phrases)
+    pieces = load_plainchant_sequence_pieces(str(tmp_path))
+    load_plainchant_sequence_pieces.cache_clear()
+    return PlainchantSequencePieces(pieces)
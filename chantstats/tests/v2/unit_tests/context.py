@@ -4,3 +4,79 @@ import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..")))
 
 import chantstats
+from music21.bar import Barline
+from music21.meter import TimeSignature
+from music21.note import Note, Rest
+from music21.stream import Measure, Part, Score
+from chantstats.v2.base_phrase import BasePhrase
+
+
+def make_phrase(note_names, *, measure_number=1, **attributes):
+    """
+    Return a `BasePhrase` consisting of a single measure with the given notes.
+    Any additional keyword arguments (e.g. `descr` or `cache_key`) are set as
+    attributes of the phrase.
+    """
+    measure = Measure(number=measure_number)
+    for name in note_names:
+        measure.append(Note(name))
+    phrase = BasePhrase(measure, piece=None)
+    for name, value in attributes.items():
+        setattr(phrase, name, value)
+    return phrase
+
+
+def write_plainchant_sequence_piece(filename, phrases):
+    """
+    Write a MusicXML file with a single part containing one measure per phrase.
+    """
+    part = Part()
+    for number, note_names in enumerate(phrases, start=1):
+        measure = Measure(number=number)
+        measure.append([Note(name) for name in note_names])
+        part.append(measure)
+    Score([part]).write("musicxml", fp=filename)
+
+
+def write_responsorial_chant_piece(filename, stanzas):
+    """
+    Write a MusicXML file with a single part containing one measure per phrase, where
+    `stanzas` is a list of lists of phrases and the last measure of each stanza ends
+    with a double barline (or a final barline at the end of the piece).
+    """
+    part = Part()
+    number = 0
+    for idx, phrases in enumerate(stanzas, start=1):
+        for note_names in phrases:
+            number += 1
+            measure = Measure(number=number)
+            measure.append([Note(name) for name in note_names])
+            part.append(measure)
+        measure.rightBarline = Barline("final" if idx == len(stanzas) else "double")
+    Score([part]).write("musicxml", fp=filename)
+
+
+def write_organum_piece(filename, measures):
+    """
+    Write a MusicXML file with a duplum and a tenor part. Each entry of `measures` is a tuple
+    `(time_signature, duplum_notes, tenor_notes, barline)`, where the notes are given as pairs
+    `(name, quarter_length)` (with name None for a rest), the time signature is None if it
+    doesn't change and barline is None, "double" or "final".
+    """
+    duplum, tenor = Part(), Part()
+    for number, (time_signature, duplum_notes, tenor_notes, barline) in enumerate(measures, start=1):
+        for part, notes in [(duplum, duplum_notes), (tenor, tenor_notes)]:
+            measure = Measure(number=number)
+            if time_signature is not None:
+                measure.timeSignature = TimeSignature(time_signature)
+            for name, quarter_length in notes:
+                measure.append(
+                    Rest(quarterLength=quarter_length) if name is None else Note(name, quarterLength=quarter_length)
+                )
+            if barline is not None:
+                measure.rightBarline = Barline(barline)
+            part.append(measure)
+    score = Score()
+    score.insert(0, duplum)
+    score.insert(0, tenor)
+    score.write("musicxml", fp=filename)
@@ -0,0 +1,42 @@
+import pytest
+from pandas.testing import assert_series_equal
+from .context import chantstats, make_phrase
+from chantstats.v2.analysis_functions import (
+    calculate_counts_for_units,
+    calculate_result_from_counts,
+    get_analysis_function,
+)
+
+
+@pytest.mark.parametrize(
+    "analysis",
+    [
+        "pc_freqs",
+        "tendency",
+        "L_and_M__L5_u_M5",
+        "L_and_M__L4_u_M4",
+        "phrase_endings__last_2_notes",
+        "phrase_endings__last_3_notes",
+        "approaches",
+        "approaches__interval_types_v2",
+    ],
+)
+@pytest.mark.parametrize(
+    "note_names",
+    [
+        ["D4", "A4", "G4", "F4", "E4", "C4", "D4", "F4", "G4", "A4", "D5", "C5", "A4", "D4"],
+        ["E4", "B4", "A4", "G4", "C5", "B4", "A4", "E4", "A4", "G4", "F4", "E4"],
+        # special cases in ModeDegree.from_note_pair(): B-flat and F-sharp finals
+        ["B-3", "F4", "D4", "C4", "E-4", "D4", "B3", "C4", "F4", "B-3"],
+        ["F#4", "B4", "A4", "G4", "E4", "D4", "B4", "A4", "G4", "F#4"],
+    ],
+)
+def test_mode_degree_results_derived_from_pc_counts_are_identical_to_direct_calculation(note_names, analysis):
+    phrase = make_phrase(note_names)
+    analysis_func = get_analysis_function(analysis)
+    counts = calculate_counts_for_units(phrase, analysis=analysis, units=["pcs", "mode_degrees"])
+
+    for unit in ["pcs", "mode_degrees"]:
+        result_expected = analysis_func(phrase, unit=unit)
+        result = calculate_result_from_counts(counts[unit], analysis=analysis, unit=unit)
+        assert_series_equal(result_expected, result)
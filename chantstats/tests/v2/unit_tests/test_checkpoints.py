@@ -0,0 +1,66 @@
+import pytest
+from collections import Counter
+from .context import chantstats
+from chantstats.v2.checkpoints import CheckpointStore
+from chantstats.v2.run_plan import Stage, StageGraph
+
+
+def make_graph(calls, input_file, *, fail_at=None, scale=10):
+    def record(name, func):
+        def wrapper(*dep_outputs):
+            calls[name] += 1
+            if name == fail_at:
+                raise KeyboardInterrupt()
+            return func(*dep_outputs)
+
+        return wrapper
+
+    graph = StageGraph()
+    load = graph.add(Stage(("load",), record("load", lambda: int(input_file.read())), input_files=[str(input_file)]))
+    scaled = graph.add(Stage(("scale",), record("scale", lambda x: scale * x), deps=[load], params={"scale": scale}))
+    plus_one = graph.add(Stage(("plus_one",), record("plus_one", lambda x: x + 1), deps=[scaled], checkpoint=False))
+    graph.add(Stage(("export",), record("export", lambda x: f"exported {x}"), deps=[plus_one]))
+    return graph
+
+
+def test_interrupted_run_is_resumed_from_checkpoints(tmpdir):
+    input_file = tmpdir.join("input.txt")
+    input_file.write("4")
+    checkpoint_dir = str(tmpdir.join("checkpoints"))
+
+    calls = Counter()
+    with pytest.raises(KeyboardInterrupt):
+        make_graph(calls, input_file, fail_at="export").run(checkpoints=checkpoint_dir)
+    assert calls == {"load": 1, "scale": 1, "plus_one": 1, "export": 1}
+    assert len(CheckpointStore(checkpoint_dir)) == 2  # "plus_one" isn't checkpointed
+
+    # the completed stages are skipped (except those which aren't checkpointed)
+    calls = Counter()
+    graph = make_graph(calls, input_file)
+    assert "[2] scale()  <- 1  [completed]" in graph.describe(checkpoints=checkpoint_dir)
+    assert graph.run(checkpoints=checkpoint_dir) == {("export",): "exported 41"}
+    assert calls == {"plus_one": 1, "export": 1}
+
+    # nothing needs to run if all final stages have completed
+    calls = Counter()
+    assert make_graph(calls, input_file).run(checkpoints=checkpoint_dir) == {("export",): "exported 41"}
+    assert calls == {}
+
+
+def test_checkpoints_are_invalidated_when_inputs_change(tmpdir):
+    input_file = tmpdir.join("input.txt")
+    input_file.write("4")
+    checkpoint_dir = str(tmpdir.join("checkpoints"))
+    make_graph(Counter(), input_file).run(checkpoints=checkpoint_dir)
+
+    # changing a parameter invalidates the stage and all stages depending on it
+    calls = Counter()
+    assert make_graph(calls, input_file, scale=100).run(checkpoints=checkpoint_dir) == {("export",): "exported 401"}
+    assert calls == {"scale": 1, "plus_one": 1, "export": 1}
+
+    # so does modifying an input file
+    input_file.write("5")
+    input_file.setmtime(input_file.mtime() + 10)
+    calls = Counter()
+    assert make_graph(calls, input_file).run(checkpoints=checkpoint_dir) == {("export",): "exported 51"}
+    assert calls == {"load": 1, "scale": 1, "plus_one": 1, "export": 1}
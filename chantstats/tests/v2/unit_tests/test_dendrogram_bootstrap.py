@@ -0,0 +1,50 @@
+import numpy as np
+from scipy.cluster.hierarchy import linkage
+from scipy.spatial.distance import pdist
+from .context import chantstats
+from chantstats.v2.dendrogram.bootstrap import calculate_bootstrap_support
+from chantstats.v2.dendrogram.dendrogram import calculate_distribution_distance
+from chantstats.v2.dendrogram.distance_metrics import calculate_chi_square_distances
+
+
+def test_vectorized_chi_square_distances_are_the_same_as_with_pdist():
+    rng = np.random.RandomState(0)
+    counts = rng.poisson(3.0, size=(12, 10)) * (rng.uniform(size=(12, 10)) < 0.6)
+    counts[:, 0] += 1  # avoid rows with all zeros
+    counts[:3, 2:] = 0  # some pairs with only one degree of freedom (Yates' correction) or none
+    freqs = 100 * counts / counts.sum(axis=1, keepdims=True)
+
+    distances_expected = pdist(freqs, metric=calculate_distribution_distance)
+    distances = calculate_chi_square_distances(freqs)
+    np.testing.assert_allclose(distances_expected, distances, rtol=0, atol=1e-12)
+
+
+def test_bootstrap_support_of_well_separated_clusters():
+    counts = np.array(
+        [
+            [50, 48, 2, 0],
+            [45, 55, 0, 1],
+            [52, 47, 1, 1],
+            [1, 0, 60, 40],
+            [0, 2, 55, 50],
+        ]
+    )
+    freqs = 100 * counts / counts.sum(axis=1, keepdims=True)
+    Z = linkage(calculate_chi_square_distances(freqs), method="complete")
+
+    support = calculate_bootstrap_support(counts, Z, num_replicates=40, scales=(0.5, 1.0), seed=42, chunk_size=15)
+    assert sorted(support.keys()) == [0.5, 1.0]
+    num_clusters = 2 * len(counts) - 1
+    for scale in [0.5, 1.0]:
+        assert support[scale].shape == (num_clusters,)
+        np.testing.assert_array_equal(support[scale][: len(counts)], 1.0)  # leaves
+        assert support[scale][-1] == 1.0  # root node
+
+    # The two top-level clusters {0, 1, 2} and {3, 4} are recovered in every replicate
+    left, right = Z[-1, :2].astype(int)
+    assert support[1.0][left] == 1.0 and support[1.0][right] == 1.0
+
+    support_again = calculate_bootstrap_support(
+        counts, Z, num_replicates=40, scales=(0.5, 1.0), seed=42, chunk_size=15, workers=2
+    )
+    np.testing.assert_array_equal(support[1.0], support_again[1.0])
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+import pytest
+import tracemalloc
+from scipy.cluster.hierarchy import cophenet
+from scipy.spatial.distance import jensenshannon, pdist
+from .context import chantstats
+from chantstats.v2.dendrogram import DISTANCE_METRICS, LINKAGE_METHODS, calculate_distances
+from chantstats.v2.dendrogram.dendrogram import Dendrogram
+
+
+@pytest.fixture
+def freqs():
+    rng = np.random.RandomState(0)
+    counts = rng.poisson(3.0, size=(9, 7)) * (rng.uniform(size=(9, 7)) < 0.6)
+    counts[:, 0] += 1  # avoid rows with all zeros
+    counts[1] = 2 * counts[0]  # same distribution as the first row
+    return 100 * counts / counts.sum(axis=1, keepdims=True)
+
+
+def hellinger(p, q):
+    p, q = p / p.sum(), q / q.sum()
+    return np.sqrt(0.5 * np.sum((np.sqrt(p) - np.sqrt(q)) ** 2))
+
+
+def total_variation(p, q):
+    return 0.5 * np.abs(p / p.sum() - q / q.sum()).sum()
+
+
+@pytest.mark.parametrize(
+    "metric, reference_metric",
+    [
+        ("jensen_shannon", lambda p, q: jensenshannon(p, q, base=2)),
+        ("hellinger", hellinger),
+        ("total_variation", total_variation),
+        ("cosine", "cosine"),
+    ],
+)
+def test_vectorized_distances_are_the_same_as_with_pdist(freqs, metric, reference_metric):
+    distances_expected = pdist(freqs, metric=reference_metric)
+    distances = calculate_distances(freqs, metric=metric)
+    np.testing.assert_allclose(distances_expected, distances, rtol=0, atol=1e-7)
+
+
+@pytest.mark.parametrize("metric", list(DISTANCE_METRICS))
+def test_distances_lie_between_zero_and_one(freqs, metric):
+    distances = calculate_distances(freqs, metric=metric)
+    assert distances.shape == (len(freqs) * (len(freqs) - 1) // 2,)
+    assert np.all((0.0 <= distances) & (distances <= 1.0))
+    if metric != "chi_square":
+        # The first two rows have the same relative frequencies
+        assert distances[0] == pytest.approx(0.0, abs=1e-7)
+
+
+def test_invalid_metric_or_method(freqs):
+    df = pd.DataFrame(freqs, index=[f"item_{i}" for i in range(len(freqs))])
+    with pytest.raises(ValueError, match="Invalid distance metric"):
+        calculate_distances(freqs, metric="euclidean")
+    with pytest.raises(ValueError, match="Invalid linkage method"):
+        Dendrogram(df, analysis="pc_freqs", method="ward")
+
+    for method in LINKAGE_METHODS:
+        dendrogram = Dendrogram(df, analysis="pc_freqs", metric="hellinger", method=method)
+        assert (dendrogram.metric, dendrogram.method) == ("hellinger", method)
+        assert dendrogram.root_node.num_leaves == len(freqs)
+
+
+@pytest.mark.parametrize("metric", list(DISTANCE_METRICS))
+def test_distances_calculated_in_blocks(freqs, metric):
+    distances_expected = calculate_distances(freqs, metric=metric)
+
+    distances = calculate_distances(freqs, metric=metric, block_size=5)
+    np.testing.assert_array_equal(distances_expected, distances)
+
+    out = np.empty(len(distances_expected), dtype=np.float32)
+    distances = calculate_distances(freqs, metric=metric, out=out, block_size=5)
+    assert distances is out
+    np.testing.assert_allclose(distances_expected, distances, rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize("metric", list(DISTANCE_METRICS))
+def test_peak_memory_of_blockwise_distance_calculation(metric):
+    rng = np.random.RandomState(0)
+    freqs = rng.poisson(3.0, size=(1000, 7)) + 1
+    out = np.empty(len(freqs) * (len(freqs) - 1) // 2, dtype=np.float32)
+
+    tracemalloc.start()
+    try:
+        calculate_distances(freqs, metric=metric, out=out, block_size=2**12)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # Only one block of distances (plus temporary arrays for a single row) is held in memory at
+    # a time, so the peak is much smaller than the full double-precision distance matrix (4 MB).
+    assert peak < len(out) * np.dtype(float).itemsize / 4
+
+
+def test_dendrogram_logs_progress_of_distance_calculation_for_many_items(freqs, monkeypatch, caplog):
+    df = pd.DataFrame(freqs)
+    Dendrogram(df, analysis="pc_freqs")
+    assert "Calculated chi_square distances" not in caplog.text
+
+    monkeypatch.setattr(chantstats.v2.dendrogram.dendrogram, "MIN_NUM_DISTANCES_FOR_PROGRESS_LOGGING", 10)
+    Dendrogram(df, analysis="pc_freqs")
+    assert f"Calculated chi_square distances for {len(freqs) - 1}/{len(freqs)} rows" in caplog.text
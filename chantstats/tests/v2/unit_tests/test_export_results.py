@@ -0,0 +1,45 @@
+import os
+import pytest
+from .context import chantstats
+from chantstats.v2 import calculate_results, export_results, iter_results
+from chantstats.v2.item_cache import ItemCache
+
+
+def read_exported_files(output_root_dir):
+    """
+    Return a dictionary {relative_path: contents} of all exported files, where the contents
+    are only included for CSV files (the plots are not guaranteed to be byte-for-byte identical).
+    """
+    exported = {}
+    for dirpath, _, filenames in os.walk(output_root_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            with open(path) as f:
+                contents = f.read() if filename.endswith(".csv") else None
+            exported[os.path.relpath(path, output_root_dir)] = contents
+    return exported
+
+
+@pytest.mark.parametrize("analysis", ["pc_freqs", "phrase_endings__last_2_notes"])
+def test_streamed_export_writes_the_same_files_as_dict_export(plainchant_sequence_pieces, analysis, tmp_path):
+    kwargs = dict(
+        pieces=plainchant_sequence_pieces,
+        analysis=analysis,
+        sampling_fraction=1.0,
+        sampling_seed=0,
+        min_num_phrases_per_monomodal_section=2,
+        min_num_notes_per_monomodal_section=10,
+    )
+    results = calculate_results(**kwargs, cache=ItemCache())
+    export_results(results, str(tmp_path / "from_dict"), p_cutoff=0.4)
+
+    # The worker processes are forked when iter_results() is called (i.e. in this thread),
+    # while the results are consumed by a background thread inside export_results().
+    results_iter = iter_results(**kwargs, workers=2, cache=ItemCache())
+    export_results(results_iter, str(tmp_path / "streamed"), p_cutoff=0.4)
+
+    exported_from_dict = read_exported_files(tmp_path / "from_dict")
+    assert len(exported_from_dict) > 0
+    if analysis != "pc_freqs":
+        assert any(contents is not None for contents in exported_from_dict.values())
+    assert read_exported_files(tmp_path / "streamed") == exported_from_dict
@@ -0,0 +1,136 @@
+import json
+import os
+import pytest
+from .context import chantstats
+from chantstats.v2 import calculate_results, export_results
+from chantstats.v2.instrumentation import Instrumentation, instrumentation
+
+
+@pytest.fixture
+def enabled_instrumentation():
+    instrumentation.reset()
+    instrumentation.enable()
+    yield instrumentation
+    instrumentation.disable()
+    instrumentation.reset()
+
+
+def test_timers_and_counters_record_nothing_if_disabled():
+    instr = Instrumentation()
+
+    @instr.instrumented("decorated")
+    def double(x):
+        return 2 * x
+
+    with instr.tagged("some_tag"), instr.timed("stage"):
+        assert double(21) == 42
+    instr.increment("counter")
+    report = instr.get_report()
+    assert report["stages"] == {}
+    assert report["counters"] == {}
+
+
+def test_timers_and_counters(tmp_path):
+    instr = Instrumentation(enabled=True)
+
+    @instr.instrumented("decorated")
+    def double(x):
+        return 2 * x
+
+    for tag in ["A", "B", "B"]:
+        with instr.tagged(tag), instr.timed("stage"):
+            double(1)
+            instr.increment("counter", 2)
+    with instr.timed("stage", tag="C"):
+        pass
+    double(1)
+
+    report = instr.get_report()
+    assert sorted(report["stages"]) == ["decorated", "stage"]
+    assert report["stages"]["stage"]["count"] == 4
+    assert {tag: x["count"] for tag, x in report["stages"]["stage"]["tags"].items()} == {"A": 1, "B": 2, "C": 1}
+    assert report["stages"]["decorated"]["count"] == 4
+    assert report["stages"]["decorated"]["tags"].keys() == {"A", "B"}  # the last call is untagged
+    stats = report["stages"]["stage"]
+    assert 0 <= stats["min"] <= stats["mean"] <= stats["max"] <= stats["total"]
+    assert report["counters"] == {"counter": 6}
+
+    instr.write_report(str(tmp_path / "report.json"))
+    with open(tmp_path / "report.json") as f:
+        assert json.load(f)["counters"] == {"counter": 6}
+
+
+def test_results_are_tagged_with_result_descriptors(plainchant_sequence_pieces, enabled_instrumentation, tmp_path):
+    results = calculate_results(
+        pieces=plainchant_sequence_pieces,
+        analysis="pc_freqs",
+        sampling_fraction=1.0,
+        sampling_seed=None,
+        modes=["final"],
+        min_num_phrases_per_monomodal_section=1,
+        min_num_notes_per_monomodal_section=6,
+    )
+    export_results(results, str(tmp_path))
+
+    report = enabled_instrumentation.get_report()
+    for stage in [
+        "input_extraction",
+        "feature_extraction",
+        "distances",
+        "linkage",
+        "node_construction",
+        "plotting",
+        "savefig",
+        "export",
+    ]:
+        assert report["stages"][stage]["count"] > 0, stage
+    expected_tags = {"/".join([d.output_dirname, d.modal_category.output_path_stub_2]) for d in results}
+    assert set(report["stages"]["linkage"]["tags"]) == expected_tags
+    assert set(report["stages"]["savefig"]["tags"]) == expected_tags
+    assert report["counters"]["dendrograms"] == len(results)
+    assert report["counters"]["figures_saved"] == report["stages"]["savefig"]["count"]
+
+
+def test_memory_tracking():
+    instr = Instrumentation()
+    instr.enable(memory=True, memory_sampling_interval=0.001)
+    retained = []
+    size = 20 * 1024 * 1024
+    try:
+        with instr.timed("outer"):
+            with instr.timed("retain"):
+                retained.append(bytearray(size))
+            with instr.timed("release"):
+                x = bytearray(size)
+                del x
+    finally:
+        instr.disable()
+
+    report = instr.get_report()
+    assert report["memory"]["peak_rss"] > size
+    memory = report["memory"]["stages"]
+    assert sorted(memory) == ["outer", "release", "retain"]
+    assert memory["retain"]["retained_traced"] >= size
+    assert memory["release"]["retained_traced"] < size / 10
+    assert memory["release"]["peak_traced_increase"] >= size
+    assert memory["outer"]["peak_traced"] >= memory["retain"]["peak_traced"] + size
+
+    # allocation sites are recorded for the whole run (from the start of the tracking)
+    top_site = report["memory"]["top_allocation_sites"][0]
+    assert os.path.basename(top_site["site"]).startswith("test_instrumentation.py:") and top_site["size"] >= size
+    assert report["memory"]["overhead"]["seconds"] > 0
+    assert report["memory"]["overhead"]["tracemalloc_memory"] > 0
+
+
+def test_memory_tracking_without_allocation_sites():
+    instr = Instrumentation()
+    instr.enable(memory=True, top_allocation_sites=0)
+    try:
+        with instr.timed("stage"):
+            x = bytearray(1024 * 1024)
+    finally:
+        instr.disable()
+
+    report = instr.get_report()
+    assert report["memory"]["stages"]["stage"]["count"] == 1
+    assert report["memory"]["top_allocation_sites"] == []
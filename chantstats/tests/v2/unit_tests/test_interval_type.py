@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from collections import Counter
+from music21.note import Note
+from .context import chantstats, make_phrase
+from chantstats.v2.analysis_functions import calculate_pc_based_counts
+from chantstats.v2.interval_type import IntervalType, LargeIntervalError, classify_intervals
+from chantstats.v2.note_pair import NotePair
+from chantstats.v2.pitch_class import PC
+from chantstats.v2.tendency import calculate_approach_counts
+
+
+@pytest.mark.parametrize("version", ["v1", "v2"])
+def test_vectorized_interval_classification_is_the_same_as_for_note_pairs(version):
+    note_pairs = [NotePair(Note("C4"), Note(pitch)) for pitch in range(60 - 12, 60 + 13)]
+    semitones = [n2.pitch.ps - n1.pitch.ps for n1, n2 in note_pairs]
+
+    codes = classify_intervals(semitones, version=version)
+    interval_types = [IntervalType.allowed_values[code] for code in codes]
+    assert interval_types == [getattr(note_pair, f"interval_type_{version}") for note_pair in note_pairs]
+
+
+def test_interval_classification_with_unexpected_intervals():
+    with pytest.raises(LargeIntervalError):
+        classify_intervals([2, -13, 1])
+    with pytest.raises(ValueError):
+        classify_intervals([2, 1], version="v3")
+    assert len(classify_intervals([])) == 0
+
+
+def test_approach_counts():
+    phrase = make_phrase(["D4", "D4", "E4", "G4", "F4", "D4", "D5"])
+    counts = calculate_approach_counts(phrase)
+    assert counts == Counter(
+        {
+            (PC("D"), IntervalType.COMMON_TONE): 1,
+            (PC("E"), IntervalType.STEP): 1,
+            (PC("G"), IntervalType.LEAP): 1,
+            (PC("F"), IntervalType.STEP): 1,
+            (PC("D"), IntervalType.LEAP): 2,  # minor third and octave
+        }
+    )
+    assert sum(counts.values()) == len(phrase.pc_pairs)
+
+
+def test_approach_counts_with_interval_type_v2():
+    phrase = make_phrase(["D4", "D4", "E4", "G4", "F4", "D4", "D5"])
+    counts = calculate_approach_counts(phrase, version="v2")
+    assert counts == Counter(
+        {
+            (PC("D"), IntervalType.COMMON_TONE): 1,
+            (PC("E"), IntervalType.STEP): 1,
+            (PC("G"), IntervalType.STEP): 1,  # minor third
+            (PC("F"), IntervalType.STEP): 1,
+            (PC("D"), IntervalType.STEP): 1,  # minor third
+            (PC("D"), IntervalType.LEAP): 1,  # octave
+        }
+    )
+    assert calculate_pc_based_counts(phrase, analysis="approaches__interval_types_v2") == counts
+    assert calculate_pc_based_counts(phrase, analysis="approaches") == calculate_approach_counts(phrase)
@@ -0,0 +1,37 @@
+from .context import chantstats, make_phrase
+from chantstats.v2.item_cache import ItemCache, get_counts_for_items
+from chantstats.v2.mode_degree import ModeDegree
+from chantstats.v2.pitch_class import PC
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ItemCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used entry
+    cache.put("c", 3)
+    assert "a" in cache and "c" in cache and "b" not in cache
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.hit_rate == 0.5
+
+
+def test_items_are_calculated_at_most_once():
+    cache = ItemCache()
+    phrase_1 = make_phrase(["D4", "A4", "G4", "F4", "E4", "D4"], cache_key="phrase_1")
+    phrase_2 = make_phrase(["E4", "G4", "F4", "E4"], cache_key="phrase_2")
+    phrase_1_recreated = make_phrase(["D4", "A4", "G4", "F4", "E4", "D4"], cache_key="phrase_1")
+    units = ["pcs", "mode_degrees"]
+
+    counts = get_counts_for_items(
+        [phrase_1, phrase_2, phrase_1_recreated], analysis="pc_freqs", units=units, cache=cache
+    )
+    assert len(cache) == 4  # two items, two units
+    assert counts[0]["pcs"] is counts[2]["pcs"]
+    assert counts[0]["pcs"][PC("D")] == 2
+    assert counts[1]["mode_degrees"][ModeDegree(value=1)] == 2
+    assert (cache.hits, cache.misses) == (2, 4)  # repeated occurrence of phrase_1 is served from the cache
+
+    counts_again = get_counts_for_items([phrase_2], analysis="pc_freqs", units=units, cache=cache)
+    assert counts_again[0]["mode_degrees"] is counts[1]["mode_degrees"]
+    assert (cache.hits, cache.misses) == (4, 4)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from scipy.cluster.hierarchy import linkage
+from scipy.spatial.distance import pdist, squareform
+from .context import chantstats
+from chantstats.v2.dendrogram.leaf_ordering import get_leaf_order, order_leaves
+
+
+@pytest.fixture
+def distances():
+    rng = np.random.RandomState(0)
+    centers = rng.uniform(size=(5, 4))
+    points = np.concatenate([c + 0.1 * rng.normal(size=(30, 4)) for c in centers])
+    return pdist(points[rng.permutation(len(points))])
+
+
+def get_cluster_sets(Z):
+    num_leaves = len(Z) + 1
+    clusters = [frozenset([i]) for i in range(num_leaves)]
+    for left, right in Z[:, :2].astype(int):
+        clusters.append(clusters[left] | clusters[right])
+    return set(clusters)
+
+
+def get_total_distance_between_adjacent_leaves(Z, distances):
+    leaf_order = get_leaf_order(Z)
+    D = squareform(distances)
+    return D[leaf_order[:-1], leaf_order[1:]].sum()
+
+
+def test_optimal_leaf_ordering_is_the_same_as_in_linkage(distances):
+    Z = linkage(distances, method="complete")
+    Z_ordered, leaf_ordering = order_leaves(Z, distances, leaf_ordering="auto")
+    assert leaf_ordering == "optimal"
+    np.testing.assert_array_equal(Z_ordered, linkage(distances, method="complete", optimal_ordering=True))
+
+
+def test_greedy_leaf_ordering(distances):
+    Z = linkage(distances, method="complete")
+    Z_greedy, leaf_ordering = order_leaves(Z, distances, leaf_ordering="auto", max_num_leaves_for_optimal_ordering=50)
+    assert leaf_ordering == "greedy"
+
+    # Only the children of each cluster are swapped, the clusters themselves stay the same.
+    np.testing.assert_array_equal(Z_greedy[:, 2:], Z[:, 2:])
+    assert get_cluster_sets(Z_greedy) == get_cluster_sets(Z)
+    assert sorted(get_leaf_order(Z_greedy)) == list(range(len(Z) + 1))
+
+    total_distance_unordered = get_total_distance_between_adjacent_leaves(Z, distances)
+    total_distance_greedy = get_total_distance_between_adjacent_leaves(Z_greedy, distances)
+    assert total_distance_greedy < total_distance_unordered
+
+
+def test_invalid_leaf_ordering(distances):
+    Z = linkage(distances, method="complete")
+    np.testing.assert_array_equal(order_leaves(Z, distances, leaf_ordering="none")[0], Z)
+    with pytest.raises(ValueError, match="Invalid leaf ordering"):
+        order_leaves(Z, distances, leaf_ordering="random")
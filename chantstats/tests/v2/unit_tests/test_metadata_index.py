@@ -0,0 +1,105 @@
+import os
+import pandas as pd
+import pytest
+from .context import chantstats, write_plainchant_sequence_piece
+from chantstats.v2 import ChantStatsConfig
+from chantstats.v2.metadata_index import MetadataIndex
+from chantstats.v2.old_code.organum_piece import OrganumPieces
+from chantstats.v2.plainchant_sequence_piece import PlainchantSequencePieces, load_plainchant_sequence_pieces
+from chantstats.v2.repertoire_and_genre import RepertoireAndGenreType
+from chantstats.v2.responsorial_chants import ResponsorialChantPieces
+from chantstats.v2.run_plan import RunPlan
+
+PHRASE_ENDING_ON_D = ["D4", "F4", "G4", "A4", "G4", "F4", "E4", "D4"]
+PHRASE_ENDING_ON_G = ["G4", "A4", "C5", "B4", "A4", "G4"]
+
+
+def test_metadata_index_skips_pieces_without_qualifying_monomodal_sections(tmp_path):
+    write_plainchant_sequence_piece(tmp_path / "BN_lat_1112_Sequence_01_long.xml", [PHRASE_ENDING_ON_D] * 3)
+    write_plainchant_sequence_piece(
+        tmp_path / "BN_lat_1112_Sequence_02_short.xml", [PHRASE_ENDING_ON_D, PHRASE_ENDING_ON_G]
+    )
+    index = MetadataIndex(str(tmp_path / "metadata.sqlite"))
+    filters = dict(min_num_phrases_per_monomodal_section=3, min_num_notes_per_monomodal_section=20)
+
+    # nothing is known about the pieces yet, so both are loaded and added to the index
+    pieces = load_plainchant_sequence_pieces(str(tmp_path), metadata_index=index, **filters)
+    assert [p.number for p in pieces] == [1, 2]
+
+    df = index.query(
+        "SELECT filename, final, num_phrases, num_notes, phrase_numbers FROM items "
+        "WHERE kind = 'monomodal_section' AND mode = 'final' ORDER BY filename, phrase_numbers"
+    )
+    assert df.values.tolist() == [
+        [pieces[0].filename_full, "D", 3, 24, "1,2,3"],
+        [pieces[1].filename_full, "D", 1, 8, "1"],
+        [pieces[1].filename_full, "G", 1, 6, "2"],
+    ]
+
+    # the second piece doesn't contain any monomodal section satisfying the filters, so it is
+    # skipped, but the analysis inputs are the same as those obtained from loading all pieces
+    load_plainchant_sequence_pieces.cache_clear()
+    pieces_filtered = load_plainchant_sequence_pieces(str(tmp_path), metadata_index=index, **filters)
+    assert [p.number for p in pieces_filtered] == [1]
+    inputs = PlainchantSequencePieces(pieces).get_analysis_inputs("final", **filters)
+    inputs_filtered = PlainchantSequencePieces(pieces_filtered).get_analysis_inputs("final", **filters)
+    assert [s.descr for s in inputs_filtered] == [s.descr for s in inputs]
+    assert [(s.piece.number, s.idx_start, s.idx_end) for s in inputs_filtered] == [(1, 1, 3)]
+
+    # without filters (or if a file changed since it was indexed) all pieces are loaded
+    assert index.get_qualifying_filenames([p.filename_full for p in pieces], "plainchant_sequences") == [
+        p.filename_full for p in pieces
+    ]
+    os.utime(pieces[1].filename_full, (0, os.path.getmtime(pieces[1].filename_full) + 10))
+    assert not index.is_up_to_date(pieces[1].filename_full)
+    assert index.get_qualifying_filenames([p.filename_full for p in pieces], "plainchant_sequences", **filters) == [
+        p.filename_full for p in pieces
+    ]
+    load_plainchant_sequence_pieces.cache_clear()
+
+
+def test_filters_which_dont_apply_to_a_repertoire_are_rejected():
+    cfg = ChantStatsConfig(musicxml_paths={rep: "/nonexistent" for rep in RepertoireAndGenreType})
+    with pytest.raises(ValueError, match="don't apply to responsorial_chants"):
+        ResponsorialChantPieces.from_musicxml_files(cfg, min_num_notes_per_monomodal_section=80)
+    with pytest.raises(ValueError, match="don't apply to plainchant_sequences"):
+        PlainchantSequencePieces.from_musicxml_files(cfg, min_num_notes_per_organum_phrase=12)
+    with pytest.raises(ValueError, match="don't apply to organum_pieces"):
+        OrganumPieces.from_musicxml_files(cfg, min_num_notes_per_organum_phrase=12)
+    with pytest.raises(ValueError, match="don't apply to organum_phrases"):
+        MetadataIndex().get_qualifying_filenames([], "organum_phrases", min_num_phrases_per_monomodal_section=3)
+
+
+def test_run_plan_skips_pieces_via_the_metadata_index(tmp_path):
+    write_plainchant_sequence_piece(tmp_path / "BN_lat_1112_Sequence_01_long.xml", [PHRASE_ENDING_ON_D] * 3)
+    write_plainchant_sequence_piece(
+        tmp_path / "BN_lat_1112_Sequence_02_short.xml", [PHRASE_ENDING_ON_D, PHRASE_ENDING_ON_G]
+    )
+    write_plainchant_sequence_piece(tmp_path / "BN_lat_1112_Sequence_03_long.xml", [PHRASE_ENDING_ON_G] * 3)
+    cfg = ChantStatsConfig(musicxml_paths={"plainchant_sequences": str(tmp_path)})
+    index = MetadataIndex(str(tmp_path / "metadata.sqlite"))
+    kwargs = dict(
+        modes=["final"],
+        units=["pcs"],
+        sampling_fraction=1.0,
+        min_num_phrases_per_monomodal_section=3,
+        min_num_notes_per_monomodal_section=10,
+        cache=None,
+    )
+
+    count_parse_stages = lambda graph: sum(stage.kind == "parse_musicxml_file" for stage in graph)
+    plan = RunPlan(["plainchant_sequences"], ["pc_freqs"], metadata_index=index, **kwargs)
+    assert count_parse_stages(plan.compile(cfg)) == 3
+    (results,) = plan.run(cfg).values()
+
+    # Now that the pieces are indexed, the second one (which doesn't contain any qualifying
+    # monomodal section) is skipped, but the results are the same.
+    assert count_parse_stages(plan.compile(cfg)) == 2
+    (results_after_indexing,) = plan.run(cfg).values()
+    (results_without_index,) = RunPlan(["plainchant_sequences"], ["pc_freqs"], **kwargs).run(cfg).values()
+    assert len(results) == len(results_after_indexing) == len(results_without_index) > 0
+    for (_, result), (_, result_after_indexing), (_, result_without_index) in zip(
+        results, results_after_indexing, results_without_index
+    ):
+        pd.testing.assert_frame_equal(result_after_indexing["dendrogram"].df_orig, result["dendrogram"].df_orig)
+        pd.testing.assert_frame_equal(result_without_index["dendrogram"].df_orig, result["dendrogram"].df_orig)
@@ -0,0 +1,83 @@
+import pytest
+from .context import chantstats, write_organum_piece
+from chantstats.v2.old_code.organum_piece import OrganumPiece
+
+# Each measure is given as (time signature, duplum notes, tenor notes, barline). Measure 3 is in compound
+# meter (discant/copula), the tenor changes in the middle of measure 4 and the last measure is chant.
+MEASURES = [
+    ("4/4", [("A4", 1.0), ("G4", 1.0), ("F4", 1.0), ("A4", 1.0)], [("D3", 4.0)], None),
+    (None, [("C5", 1.0), ("D5", 0.5), ("C5", 0.5), ("A4", 2.0)], [("F3", 4.0)], None),
+    ("6/8", [(n, 0.5) for n in ["D4", "E4", "F4", "G4", "F4", "E4"]], [("G3", 1.5), ("A3", 1.5)], "double"),
+    ("4/4", [("D5", 1.0), ("B4", 1.0), ("C5", 1.0), ("E5", 1.0)], [("G3", 2.0), ("A3", 2.0)], "final"),
+    (None, [(None, 4.0)], [("E3", 1.0), ("F3", 1.0), ("D3", 2.0)], "final"),
+]
+
+
+@pytest.fixture(scope="module")
+def piece(tmp_path_factory):
+    filename = str(tmp_path_factory.mktemp("organum") / "F3_test.xml")
+    write_organum_piece(filename, MEASURES)
+    return OrganumPiece(filename)
+
+
+def test_organum_piece_dataframe(piece):
+    df = piece.df
+    assert list(df.index) == [0, 1, 2, 3, 4, 5, 5.5, 6, 8, 8.5, 9, 9.5, 10, 10.5, 11, 12, 13, 14, 15, 16, 17]
+    assert list(df[("common", "measure")]) == [1] * 4 + [2] * 4 + [3] * 6 + [4] * 4 + [5] * 3
+    assert list(df[("common", "texture")].drop_duplicates()) == ["organum_purum", "discant_or_copula", "chant"]
+    assert list(df[("common", "texture")].iloc[14:18]) == ["organum_purum"] * 4
+    assert list(df[("common", "stanza")]) == [1] * 18 + [2] * 3
+
+    # Rows which don't belong to any phrase have the phrase number None (not NaN)
+    phrases = list(df[("common", "phrase")])
+    assert phrases == [1] * 4 + [2] * 4 + [None] * 6 + [3, 3, 4, 4] + [None] * 3
+    assert all(type(x) is int or x is None for x in phrases)
+    assert piece.final == "D"
+
+
+def test_organum_piece_phrases_and_sections(piece):
+    assert [p.descr for p in piece.phrases] == [
+        "F3_test.p01.m01",
+        "F3_test.p02.m02",
+        "F3_test.p03.m04",
+        "F3_test.p04.m04",
+    ]
+    assert [[n.nameWithOctave for n in p.notes] for p in piece.phrases] == [
+        ["A4", "G4", "F4", "A4"],
+        ["C5", "D5", "C5", "A4"],
+        ["D5", "B4"],
+        ["C5", "E5"],
+    ]
+    assert [p.tenor_pc for p in piece.phrases] == ["D", "F", "G", "A"]
+    assert [p.vertical_intervals.tolist() for p in piece.phrases] == [
+        [19, 17, 15, 19],
+        [19, 21, 19, 16],
+        [19, 16],
+        [15, 19],
+    ]
+    assert piece.phrases is piece.phrases  # phrases are only created once
+
+    sections = piece.sections
+    assert [(s.texture, list(s.measures)) for s in sections] == [
+        ("organum_purum", [1] * 4 + [2] * 4),
+        ("discant_or_copula", [3] * 6),
+        ("organum_purum", [4] * 4),
+        ("chant", [5] * 3),
+    ]
+    assert [[p.phrase_number for p in s.phrases] for s in sections] == [[1, 2], [], [3, 4], []]
+    assert sections[0].phrases[0] is piece.phrases[0]
+
+    duplum_part = piece.organum_purum_duplum_part
+    assert [n.nameWithOctave for n in duplum_part.notes] == sum(
+        ([n.nameWithOctave for n in p.notes] for p in piece.phrases), []
+    )
+    assert duplum_part.vertical_intervals.tolist() == sum((p.vertical_intervals.tolist() for p in piece.phrases), [])
+
+
+def test_phrases_of_pieces_with_the_same_filename_in_different_directories_have_different_cache_keys(piece, tmp_path):
+    filename = str(tmp_path / "F3_test.xml")
+    write_organum_piece(filename, MEASURES)
+    other_piece = OrganumPiece(filename)
+    assert [p.descr for p in other_piece.phrases] == [p.descr for p in piece.phrases]
+    assert other_piece.phrases[0].cache_key == ("organum_phrase", filename, 1)
+    assert not {p.cache_key for p in other_piece.phrases} & {p.cache_key for p in piece.phrases}
@@ -0,0 +1,63 @@
+import os
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from .context import chantstats
+from chantstats.v2.parallel import SharedInputsPool, iter_in_background_thread, map_over_shared_inputs
+
+
+def square_and_get_pid(x):
+    return x * x, os.getpid()
+
+
+def test_map_over_shared_inputs_preserves_input_order():
+    inputs = list(range(20))
+    expected = [x * x for x in inputs]
+
+    results_serial = map_over_shared_inputs(square_and_get_pid, inputs)
+    assert [res for (res, _) in results_serial] == expected
+    assert set(pid for (_, pid) in results_serial) == {os.getpid()}
+
+    results_parallel = map_over_shared_inputs(square_and_get_pid, inputs, workers=2)
+    assert [res for (res, _) in results_parallel] == expected
+    assert os.getpid() not in set(pid for (_, pid) in results_parallel)
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results_executor = map_over_shared_inputs(square_and_get_pid, inputs, executor=executor)
+    assert [res for (res, _) in results_executor] == expected
+
+
+def test_iter_in_background_thread():
+    assert list(iter_in_background_thread(iter(range(10)), maxsize=2)) == list(range(10))
+
+    def failing_generator():
+        yield 1
+        raise ValueError("Something went wrong")
+
+    results = []
+    with pytest.raises(ValueError, match="Something went wrong"):
+        for x in iter_in_background_thread(failing_generator(), maxsize=1):
+            results.append(x)
+    assert results == [1]
+
+
+def test_shared_inputs_pool_forks_workers_in_the_calling_thread():
+    inputs = list(range(10))
+    pool = SharedInputsPool(inputs, workers=2)
+    assert pool.shares_inputs
+
+    # The results can be consumed in a different thread because the workers have already been forked.
+    results = list(iter_in_background_thread(pool.imap(square_and_get_pid, max_pending=3), maxsize=2))
+    pool.shutdown()
+    assert [res for (res, _) in results] == [x * x for x in inputs]
+    assert os.getpid() not in set(pid for (_, pid) in results)
+
+
+def test_shared_inputs_pool_does_not_fork_outside_the_main_thread():
+    def create_pool_and_calculate():
+        with SharedInputsPool(list(range(5)), workers=2) as pool:
+            return pool.shares_inputs, [pool.submit(square_and_get_pid, idx).result()[0] for idx in range(5)]
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        shares_inputs, results = executor.submit(create_pool_and_calculate).result()
+    assert not shares_inputs
+    assert results == [0, 1, 4, 9, 16]
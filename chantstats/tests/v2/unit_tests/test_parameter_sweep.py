@@ -0,0 +1,70 @@
+import pytest
+from .context import chantstats
+from chantstats.v2 import calculate_results
+from chantstats.v2.parameter_sweep import filter_analysis_inputs, sweep_parameters
+
+
+@pytest.mark.parametrize("min_num_phrases, min_num_notes", [(0, 0), (1, 30), (2, 0), (2, 50)])
+def test_filtering_analysis_inputs_is_equivalent_to_extracting_them_with_filters(
+    plainchant_sequence_pieces, min_num_phrases, min_num_notes
+):
+    filters = dict(
+        min_num_phrases_per_monomodal_section=min_num_phrases,
+        min_num_notes_per_monomodal_section=min_num_notes,
+        min_num_notes_per_organum_phrase=None,
+    )
+    all_items = plainchant_sequence_pieces.get_analysis_inputs(
+        "final", min_num_phrases_per_monomodal_section=0, min_num_notes_per_monomodal_section=0
+    )
+    expected = plainchant_sequence_pieces.get_analysis_inputs("final", **filters)
+    filtered = filter_analysis_inputs(all_items, "plainchant_sequences", **filters)
+    assert [x.descr for x in filtered] == [x.descr for x in expected]
+
+
+def test_sweep_gives_same_clusters_as_separate_calculations(plainchant_sequence_pieces):
+    param_grid = dict(
+        min_num_phrases_per_monomodal_section=[1, 2],
+        min_num_notes_per_monomodal_section=[6, 14],
+        sampling_fraction=[1.0, 0.7],
+        p_cutoff=[0.2, 0.5],
+    )
+    df = sweep_parameters(
+        pieces=plainchant_sequence_pieces, analysis="pc_freqs", param_grid=param_grid, sampling_seed=42, modes=["final"]
+    )
+    assert set(df["min_num_notes_per_organum_phrase"]) == {12}  # default for parameters which aren't swept
+
+    for min_num_phrases, min_num_notes in [(1, 6), (1, 14), (2, 6), (2, 14)]:
+        for sampling_fraction in [1.0, 0.7]:
+            results = calculate_results(
+                pieces=plainchant_sequence_pieces,
+                analysis="pc_freqs",
+                sampling_fraction=sampling_fraction,
+                sampling_seed=42,
+                min_num_phrases_per_monomodal_section=min_num_phrases,
+                min_num_notes_per_monomodal_section=min_num_notes,
+                modes=["final"],
+            )
+            for p_cutoff in [0.2, 0.5]:
+                df_point = df[
+                    (df.min_num_phrases_per_monomodal_section == min_num_phrases)
+                    & (df.min_num_notes_per_monomodal_section == min_num_notes)
+                    & (df.sampling_fraction == sampling_fraction)
+                    & (df.p_cutoff == p_cutoff)
+                ]
+                assert len(df_point) == len(results)
+                for (descriptor, result), (_, row) in zip(results.items(), df_point.iterrows()):
+                    nodes = result["dendrogram"].get_nodes_below_cutoff(p_cutoff, include_leaf_nodes=True)
+                    assert (row.unit, row.modal_category) == (
+                        descriptor.unit,
+                        descriptor.modal_category.output_path_stub_2,
+                    )
+                    assert row.num_items == len(descriptor.modal_category.items)
+                    assert row.num_clusters == len(nodes)
+                    assert row.cluster_sizes == tuple(node.num_leaves for node in nodes)
+
+
+def test_sweep_with_invalid_parameters(plainchant_sequence_pieces):
+    with pytest.raises(ValueError):
+        sweep_parameters(pieces=plainchant_sequence_pieces, analysis="pc_freqs", param_grid={"sampling_seed": [1, 2]})
+    with pytest.raises(ValueError):
+        sweep_parameters(pieces=plainchant_sequence_pieces, analysis="tendency", param_grid={"p_cutoff": [0.4]})
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from .context import chantstats, make_phrase
+from chantstats.v2.pattern_search import MelodicPatternIndex, build_suffix_array
+
+
+@pytest.fixture
+def phrases():
+    return [
+        make_phrase(["D4", "E4", "F4", "E4", "D4", "D4"], measure_number=1),
+        make_phrase(["D4", "E4", "F4", "G4", "E4", "D4"], measure_number=2),
+        make_phrase(["G4", "A4", "B4", "C5", "B4", "A4", "G4"], measure_number=3),
+        make_phrase(["D4", "F4", "E4", "D4", "E4", "F4"], measure_number=4),
+    ]
+
+
+def test_suffix_array_is_the_same_as_with_naive_sorting():
+    rng = np.random.RandomState(0)
+    for size in [1, 2, 10, 200]:
+        codes = list(rng.randint(0, 4, size=size))
+        expected = sorted(range(size), key=lambda i: codes[i:])
+        np.testing.assert_array_equal(build_suffix_array(codes), expected)
+
+
+def test_find_pattern_of_pitch_classes(phrases):
+    index = MelodicPatternIndex(phrases)
+    df = index.find(["D", "E", "F"], unit="pcs")
+    assert list(df["phrase"]) == [1, 2, 4]
+    assert list(df["measure"]) == [1, 2, 4]
+    assert list(df["note_index"]) == [0, 0, 3]
+    assert index.count(["D", "E", "F"], unit="pcs") == 3
+    assert index.count(["E", "D"], unit="pcs") == 3
+
+    # Patterns never extend across phrase boundaries
+    assert index.count(["D", "D", "E"], unit="pcs") == 0
+    assert index.count(["D", "D"], unit="pcs") == 1
+    # Pitch classes which don't occur in the index at all
+    assert index.count(["D", "B-"], unit="pcs") == 0
+
+
+def test_find_pattern_of_intervals_and_mode_degrees(phrases):
+    index = MelodicPatternIndex(phrases)
+    df = index.find([2, 1], unit="intervals")  # D-E-F or A-B-C
+    assert list(df["phrase"]) == [1, 2, 3, 4]
+    assert list(df["note_index"]) == [0, 0, 1, 3]
+
+    # Mode degrees are relative to the final of each phrase (D, D, G and F)
+    assert index.count([1, 2, 3], unit="mode_degrees") == 3
+    df = index.find([1, 2, 3], unit="mode_degrees")
+    assert list(df["phrase"]) == [1, 2, 3]
+
+
+def test_count_per_modal_category(phrases):
+    index = MelodicPatternIndex(phrases)
+    counts = index.count_per_modal_category([1, 2, 3], unit="mode_degrees", group_by="final")
+    assert counts.to_dict() == {"D": 2, "F": 0, "G": 1}
+
+    with pytest.raises(ValueError):
+        index.count([], unit="pcs")
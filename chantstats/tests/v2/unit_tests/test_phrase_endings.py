@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+from collections import Counter
+from .context import chantstats, make_phrase
+import chantstats.v2.analysis_functions
+from chantstats.v2.analysis_functions import calculate_counts_for_units
+from chantstats.v2.dendrogram import calculate_dendrogram_from_dataframe
+from chantstats.v2.item_cache import ItemCache, get_counts_for_items
+from chantstats.v2.modal_category import make_counts_dataframe
+from chantstats.v2.mode_degree import ModeDegree
+from chantstats.v2.phrase_endings import PhraseEnding, PhraseEndingInMD, calculate_phrase_ending_counts
+
+
+class Section:
+    def __init__(self, phrases, *, descr):
+        self.phrases = phrases
+        self.descr = descr
+        self.cache_key = ("dummy.xml", descr)
+        self.note_of_final = phrases[-1].note_of_final
+        self.final = phrases[-1].final
+
+
+def test_phrase_ending_counts_for_all_lengths():
+    section = Section(
+        [
+            make_phrase(["D4", "F4", "E4", "D4"]),
+            make_phrase(["A4", "G4", "F4", "E4"]),
+            make_phrase(["E4"]),
+            make_phrase(["C4", "E4", "D4"]),
+        ],
+        descr="section_1",
+    )
+    counts = calculate_phrase_ending_counts(section, lengths=[1, 2, 3])
+    assert counts[1] == Counter({PhraseEnding(["D"]): 2, PhraseEnding(["E"]): 2})
+    assert counts[2] == Counter({PhraseEnding(["E", "D"]): 2, PhraseEnding(["F", "E"]): 1})
+    assert counts[3] == Counter(
+        {PhraseEnding(["F", "E", "D"]): 1, PhraseEnding(["G", "F", "E"]): 1, PhraseEnding(["C", "E", "D"]): 1}
+    )
+
+    # Mode degrees are relative to the final of the section, not of the individual phrases
+    md_counts = calculate_counts_for_units(section, analysis="phrase_endings__last_2_notes", units=["mode_degrees"])
+    assert md_counts["mode_degrees"] == Counter({PhraseEndingInMD([2, 1]): 2, PhraseEndingInMD([3, 2]): 1})
+
+    with pytest.raises(ValueError):
+        calculate_phrase_ending_counts(section, lengths=[4])
+
+
+def test_phrase_endings_can_be_clustered():
+    items = [
+        Section([make_phrase(["F4", "E4", "D4"]), make_phrase(["G4", "E4", "D4"])], descr="section_1"),
+        Section([make_phrase(["G4", "E4", "D4"]), make_phrase(["F4", "E4", "D4"])], descr="section_2"),
+        Section([make_phrase(["C4", "C4", "D4"]), make_phrase(["E4", "C4", "D4"])], descr="section_3"),
+        Section([make_phrase(["E4", "C4", "D4"]), make_phrase(["D4", "C4", "D4"])], descr="section_4"),
+    ]
+    analysis = "phrase_endings__last_2_notes"
+    counts_per_item = [calculate_counts_for_units(item, analysis=analysis, units=["pcs"]) for item in items]
+    df_counts = make_counts_dataframe(items, counts_per_item, analysis=analysis, unit="pcs")
+    assert df_counts.shape == (4, 100)
+    np.testing.assert_array_equal(df_counts.sum(axis=1), 2)
+
+    df_freqs = df_counts.div(df_counts.sum(axis=1), axis=0) * 100
+    dendrogram = calculate_dendrogram_from_dataframe(df_freqs, analysis=analysis)
+    left, right = dendrogram.L[-1, :2].astype(int)
+    assert {left, right} == {4, 5}  # the two sections ending in E-D and the two ending in C-D
+
+
+def test_phrase_endings_of_all_lengths_are_counted_once_per_item(monkeypatch):
+    calls = []
+    calculate_phrase_ending_counts_orig = chantstats.v2.analysis_functions.calculate_phrase_ending_counts
+
+    def calculate_phrase_ending_counts_and_record_call(item, *, lengths):
+        calls.append(sorted(lengths))
+        return calculate_phrase_ending_counts_orig(item, lengths=lengths)
+
+    monkeypatch.setattr(
+        chantstats.v2.analysis_functions,
+        "calculate_phrase_ending_counts",
+        calculate_phrase_ending_counts_and_record_call,
+    )
+    items = [
+        Section([make_phrase(["F4", "E4", "D4"]), make_phrase(["G4", "E4", "D4"])], descr="section_1"),
+        Section([make_phrase(["C4", "E4"]), make_phrase(["E4", "C4", "D4"])], descr="section_2"),
+    ]
+    cache = ItemCache()
+    counts_2 = get_counts_for_items(items, analysis="phrase_endings__last_2_notes", units=["pcs"], cache=cache)
+    counts_3 = get_counts_for_items(items, analysis="phrase_endings__last_3_notes", units=["pcs"], cache=cache)
+    assert calls == [[2, 3], [2, 3]]
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    for item, c2, c3 in zip(items, counts_2, counts_3):
+        expected = calculate_phrase_ending_counts_orig(item, lengths=[2, 3])
+        assert c2["pcs"] == expected[2]
+        assert c3["pcs"] == expected[3]
+
+
+def test_phrase_ending_comparisons_and_repr():
+    assert PhraseEnding(["E", "D"]) == PhraseEnding(["E", "D"])
+    assert PhraseEnding(["E", "D"]) != PhraseEnding(["F", "D"])
+    assert PhraseEnding(["E", "D"]) != "E-D"
+    assert PhraseEnding(["E", "D"]) not in [None, 42, PhraseEndingInMD([2, 1])]
+    with pytest.raises(TypeError):
+        PhraseEnding(["E", "D"]) < "E-D"
+    assert repr(PhraseEnding(["E", "D"])) == "<PCsE-D_PE>"
@@ -0,0 +1,121 @@
+import os
+import pstats
+import pytest
+import threading
+import time
+from .context import chantstats
+from chantstats.v2 import calculate_results, export_results, iter_results
+from chantstats.v2 import profiling
+from chantstats.v2.profiling import Profiler, profiler
+
+
+def busy_wait(seconds):
+    tic = time.perf_counter()
+    while time.perf_counter() - tic < seconds:
+        pass
+
+
+def test_profiler_records_nothing_if_disabled(tmp_path):
+    prof = Profiler()
+    with prof.profiled("stage", tag="A"):
+        busy_wait(0.01)
+    assert prof.write(str(tmp_path)) == [str(tmp_path / "stacks.collapsed")]
+    assert os.path.getsize(tmp_path / "stacks.collapsed") == 0
+
+
+def test_nested_sections_are_profiled_separately(tmp_path):
+    prof = Profiler(sampling_interval=0.001)
+
+    @prof.profiled_function("outer")
+    def outer():
+        busy_wait(0.05)
+        for tag in ["A", "B/C"]:
+            with prof.profiled("inner", tag=tag):
+                busy_wait(0.05)
+
+    with prof.session(str(tmp_path)):
+        outer()
+    assert not prof.enabled
+
+    assert sorted(os.listdir(tmp_path)) == ["inner", "outer", "stacks.collapsed"]
+    assert sorted(os.listdir(tmp_path / "inner")) == ["A.pstats", "B__C.pstats"]
+    assert os.listdir(tmp_path / "outer") == ["all.pstats"]
+    stats = pstats.Stats(str(tmp_path / "inner" / "B__C.pstats"))
+    assert [func[2] for func in stats.stats if func[2] == "busy_wait"] == ["busy_wait"]
+
+    with open(tmp_path / "stacks.collapsed") as f:
+        stacks = [line.rsplit(" ", 1) for line in f]
+    assert all(int(count) > 0 for _, count in stacks)
+    prefixes = {tuple(stack.split(";")[:2]) for stack, _ in stacks if stack.split(";")[-1].startswith("busy_wait")}
+    assert ("outer", "inner:A") in prefixes
+    assert ("outer", "inner:B/C") in prefixes
+    assert any(second.startswith("outer (test_profiling.py") for first, second in prefixes if first == "outer")
+
+
+def test_profiles_for_each_result(plainchant_sequence_pieces, tmp_path):
+    results = calculate_results(
+        pieces=plainchant_sequence_pieces,
+        analysis="pc_freqs",
+        sampling_fraction=1.0,
+        sampling_seed=None,
+        modes=["final"],
+        min_num_phrases_per_monomodal_section=1,
+        min_num_notes_per_monomodal_section=6,
+    )
+    export_results(results, str(tmp_path), p_cutoff=0.4, profile=True)
+    assert not profiler.enabled
+
+    profiles_dir = tmp_path / "profiles" / "p_cutoff_0.40"
+    expected = sorted(
+        "__".join([*d.output_dirname.split(os.sep), d.modal_category.output_path_stub_2]) + ".pstats" for d in results
+    )
+    assert sorted(os.listdir(profiles_dir / "export")) == expected
+    assert os.path.exists(profiles_dir / "stacks.collapsed")
+
+
+def test_only_the_main_thread_is_profiled_from_python_3_12(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "_PROFILE_ALL_THREADS", False)
+    prof = Profiler(sampling_interval=0.001)
+
+    def run_in_background_thread():
+        with prof.profiled("background"):
+            busy_wait(0.05)
+
+    with prof.session(str(tmp_path)):
+        with prof.profiled("main"):
+            thread = threading.Thread(target=run_in_background_thread)
+            thread.start()
+            busy_wait(0.05)
+            thread.join()
+
+    # the section in the background thread only appears in the sampled call stacks
+    assert sorted(os.listdir(tmp_path)) == ["main", "stacks.collapsed"]
+    with open(tmp_path / "stacks.collapsed") as f:
+        assert any(line.startswith("background;") for line in f)
+
+
+@pytest.mark.parametrize("use_env", [False, True])
+def test_profiles_for_calculate_and_iter_results(plainchant_sequence_pieces, monkeypatch, tmp_path, use_env):
+    kwargs = dict(
+        pieces=plainchant_sequence_pieces,
+        analysis="pc_freqs",
+        sampling_fraction=1.0,
+        sampling_seed=None,
+        modes=["final"],
+        min_num_phrases_per_monomodal_section=1,
+        min_num_notes_per_monomodal_section=6,
+    )
+    if use_env:
+        monkeypatch.setenv("CHANTSTATS_PROFILE", "1")
+        monkeypatch.chdir(tmp_path)
+        results = dict(iter_results(**kwargs))
+    else:
+        results = calculate_results(**kwargs, profile=str(tmp_path / "profiles"))
+    assert not profiler.enabled
+
+    profiles_dir = tmp_path / "profiles"
+    expected = sorted(
+        "__".join([*d.output_dirname.split(os.sep), d.modal_category.output_path_stub_2]) + ".pstats" for d in results
+    )
+    assert sorted(os.listdir(profiles_dir / "calculation")) == expected
+    assert os.path.exists(profiles_dir / "stacks.collapsed")
@@ -0,0 +1,29 @@
+from .context import chantstats, write_responsorial_chant_piece
+from chantstats.v2.responsorial_chants.responsorial_chant_piece import ResponsorialChantPiece
+
+
+def test_stanzas_are_created_once_and_match_stanzas_without_modulatory_phrases(tmp_path):
+    filename = str(tmp_path / "F3M01ps_test.xml")
+    write_responsorial_chant_piece(
+        filename,
+        [
+            [["D4", "F4", "E4", "D4"], ["F4", "G4", "A4", "G4"], ["A4", "G4", "E4", "D4"]],
+            [["G4", "A4", "G4"], ["A4", "C5", "B4", "A4", "G4"]],
+            [["F4", "A4", "G4", "F4"], ["D4", "E4", "F4"], ["G4", "E4", "D4"], ["F4", "E4", "D4"]],
+        ],
+    )
+    piece = ResponsorialChantPiece(filename)
+    assert piece.stanza_boundaries == [(1, 3), (4, 5), (6, 9)]
+    assert piece.nonmodulatory_phrase_numbers == [[1, 3], [4, 5], [8, 9]]
+
+    stanzas = piece.get_stanzas()
+    nonmodulatory_stanzas = piece.get_stanzas_without_modulatory_phrases()
+    assert all(x is y for x, y in zip(stanzas, piece.get_stanzas()))
+    assert all(x is y for x, y in zip(nonmodulatory_stanzas, piece.get_stanzas_without_modulatory_phrases()))
+
+    # The stanzas are the same as those obtained by removing the modulatory phrases from each stanza
+    expected = [stanza.without_modulatory_phrases() for stanza in stanzas]
+    assert [s.phrase_numbers for s in nonmodulatory_stanzas] == [s.phrase_numbers for s in expected]
+    assert [s.descr for s in nonmodulatory_stanzas] == [s.descr for s in expected]
+    assert [s.notes for s in nonmodulatory_stanzas] == [s.notes for s in expected]
+    assert [s.final for s in nonmodulatory_stanzas] == ["D", "G", "D"]
@@ -51,3 +51,20 @@ def test_plot_title():
     # rd = ResultDescriptor("responsorial_chants", "leaps_and_melodic_outlines", "mode_degrees", modal_category)
     # assert rd.plot_title == "Chant: Analysis 3 L&M: L5: Seq.: PCs: F-plagal"
     # assert rd.plot_title == "Chant: Analysis 3 L&M: L5&M5: Resp.: MDs: F-plagal"
+
+
+def test_non_default_metric_and_method_are_recorded_in_output_path():
+    output_root_dir = "/tmp/foo/"
+    modal_category = ModalCategory(items=None, modal_category_type="final", key="G")
+    rd = ResultDescriptor("plainchant_sequences", "pc_freqs", "pcs", modal_category, metric="chi_square")
+    assert rd.output_dirname == "chant/1_mode_profiles/1_sequences/1_pcs"
+
+    rd = ResultDescriptor("plainchant_sequences", "pc_freqs", "pcs", modal_category, metric="hellinger")
+    assert rd.output_dirname == "chant/1_mode_profiles/1_sequences/1_pcs/hellinger__complete_linkage"
+    rd = ResultDescriptor(
+        "plainchant_sequences", "pc_freqs", "pcs", modal_category, metric="jensen_shannon", method="average"
+    )
+    assert (
+        rd.get_full_output_path(output_root_dir, filename_prefix="dendrogram", filename_suffix="")
+        == "/tmp/foo/chant/1_mode_profiles/1_sequences/1_pcs/jensen_shannon__average_linkage/dendrogram__06.G_1.final.png"
+    )
@@ -0,0 +1,186 @@
+import json
+import numpy as np
+import os
+import pytest
+import threading
+from collections import Counter
+from .context import chantstats
+from chantstats.v2 import ChantStatsConfig, calculate_results
+from chantstats.v2.checkpoints import CheckpointStore
+from chantstats.v2.instrumentation import instrumentation
+from chantstats.v2.item_cache import ItemCache
+from chantstats.v2.run_plan import RunPlan, Stage, StageGraph
+
+
+def make_diamond_graph(calls):
+    lock = threading.Lock()
+
+    def record(name, value):
+        def func(*dep_outputs):
+            with lock:
+                calls[name] += 1
+            return value + sum(dep_outputs)
+
+        return func
+
+    graph = StageGraph()
+    a = graph.add(Stage(("a",), record("a", 1)))
+    b = graph.add(Stage(("b",), record("b", 10), deps=[a]))
+    c = graph.add(Stage(("c",), record("c", 100), deps=[a], in_main_thread=True))
+    d = graph.add(Stage(("d",), record("d", 1000), deps=[b, c]))
+    e = graph.add(Stage(("e",), record("e", 0), deps=[c]))
+    assert graph.add(Stage(("b",), record("b_duplicate", 0), deps=[a])) == b
+    return graph
+
+
+@pytest.mark.parametrize("workers", [None, 4])
+def test_each_stage_runs_once_after_its_dependencies(workers):
+    calls = Counter()
+    graph = make_diamond_graph(calls)
+    assert len(graph) == 5
+    assert graph.get_sinks() == [("d",), ("e",)]
+
+    # only the outputs of the final stages are returned
+    outputs = graph.run(workers=workers)
+    assert outputs == {("d",): 1000 + 11 + 101, ("e",): 101}
+    assert calls == {"a": 1, "b": 1, "c": 1, "d": 1, "e": 1}
+
+
+def test_stages_must_be_added_after_their_dependencies():
+    graph = StageGraph()
+    with pytest.raises(ValueError):
+        graph.add(Stage(("b",), lambda a: a, deps=[("a",)]))
+
+
+def test_description_of_stage_graph():
+    graph = make_diamond_graph(Counter())
+    # without deduplication, 'd' would run a, b, a, c and 'e' would run a, c
+    assert graph.count_stages_without_deduplication() == 8
+    descr = graph.describe()
+    assert "[4] d()  <- 2, 3" in descr
+    assert "5 unique stages (8 without deduplication)" in descr
+
+
+def test_run_plan_shares_stages_between_repertoires_analyses_and_cutoffs(tmpdir):
+    cfg = ChantStatsConfig(
+        musicxml_paths={
+            "plainchant_sequences": str(tmpdir.join("sequences")),
+            "responsorial_chants": str(tmpdir.join("responsorial_chants")),
+            "organum_pieces": str(tmpdir.join("organum")),
+            "organum_phrases": str(tmpdir.join("organum")),
+        }
+    )
+    plan = RunPlan(
+        ["plainchant_sequences", "responsorial_chants", "organum_pieces", "organum_phrases"],
+        ["pc_freqs", "tendency"],
+        p_cutoffs=[0.4, 0.6],
+    )
+    graph = plan.compile(cfg, output_root_dir=str(tmpdir.join("output")))
+    num_stages_per_kind = Counter(stage.kind for stage in graph)
+
+    # organum pieces and organum phrases are loaded from the same files
+    assert num_stages_per_kind["load_pieces"] == 3
+    # chant repertoires are grouped by final and by final and ambitus, organum only by final
+    assert num_stages_per_kind["analysis_inputs"] == 2 + 2 + 1 + 1
+    # tendency results are only calculated for mode="final"
+    assert num_stages_per_kind["counts"] == 6 + 4
+    # each unit has its own results, which are shared by all cutoffs
+    assert num_stages_per_kind["results"] == 10 * 2
+    assert num_stages_per_kind["export"] == 10 * 2 * 2
+    assert graph.count_stages_without_deduplication() > 2 * len(graph)
+
+    graph = plan.compile(cfg)
+    assert "export" not in Counter(stage.kind for stage in graph)
+
+
+def test_run_plan_gives_the_same_results_as_calculate_results(plainchant_sequence_pieces):
+    musicxml_path = os.path.dirname(plainchant_sequence_pieces[0].filename_full)
+    cfg = ChantStatsConfig(musicxml_paths={"plainchant_sequences": musicxml_path})
+    kwargs = dict(
+        sampling_fraction=1.0,
+        sampling_seed=0,
+        min_num_phrases_per_monomodal_section=2,
+        min_num_notes_per_monomodal_section=10,
+        leaf_ordering="none",
+        num_bootstrap_replicates=5,
+        bootstrap_seed=0,
+    )
+    plan = RunPlan(["plainchant_sequences"], ["pc_freqs"], modes=["final"], units=["pcs"], cache=ItemCache(), **kwargs)
+    outputs = plan.run(cfg, workers=2)
+    (results_from_run_plan,) = outputs.values()
+
+    expected = calculate_results(
+        pieces=plainchant_sequence_pieces, analysis="pc_freqs", modes=["final"], units=["pcs"], cache=None, **kwargs
+    )
+    get_path = lambda d: os.path.join(d.output_dirname, d.modal_category.output_path_stub_2)
+    assert [get_path(descr) for (descr, _) in results_from_run_plan] == [get_path(descr) for descr in expected]
+    for (descr, result), expected_result in zip(results_from_run_plan, expected.values()):
+        dendrogram, expected_dendrogram = result["dendrogram"], expected_result["dendrogram"]
+        np.testing.assert_array_equal(dendrogram.L, expected_dendrogram.L)
+        supports = [n.bootstrap_support for n in dendrogram.all_cluster_nodes]
+        assert supports == [n.bootstrap_support for n in expected_dendrogram.all_cluster_nodes]
+        assert all(support is not None for support in supports)
+
+
+def test_resumed_run_plan_links_the_results_to_the_loaded_pieces(plainchant_sequence_pieces, tmpdir):
+    musicxml_path = os.path.dirname(plainchant_sequence_pieces[0].filename_full)
+    cfg = ChantStatsConfig(musicxml_paths={"plainchant_sequences": musicxml_path})
+    checkpoint_dir = str(tmpdir.join("checkpoints"))
+    plan = RunPlan(
+        ["plainchant_sequences"],
+        ["pc_freqs"],
+        modes=["final"],
+        sampling_fraction=1.0,
+        min_num_phrases_per_monomodal_section=2,
+        min_num_notes_per_monomodal_section=10,
+        cache=None,
+    )
+    outputs = plan.run(cfg, checkpoint_dir=checkpoint_dir)
+
+    # Only the parsed pieces, the counts and the results are saved (but not the
+    # analysis inputs or the result descriptors, which refer to the pieces).
+    checkpointed_stages = [entry["stage"] for entry in CheckpointStore(checkpoint_dir).manifest.values()]
+    assert Counter(stage.split("(")[0] for stage in checkpointed_stages) == {
+        "parse_musicxml_file": len(plainchant_sequence_pieces.pieces),
+        "counts": 1,
+        "results": 2,
+    }
+
+    resumed_outputs = plan.run(cfg, checkpoint_dir=checkpoint_dir)
+    assert list(resumed_outputs) == list(outputs)
+    results_pcs, results_mode_degrees = resumed_outputs.values()
+    assert len(results_pcs) > 1
+    for (descr, result), (expected_descr, expected_result) in zip(results_pcs, list(outputs.values())[0]):
+        assert descr.modal_category.key == expected_descr.modal_category.key
+        np.testing.assert_array_equal(result["dendrogram"].L, expected_result["dendrogram"].L)
+    # the results for both units refer to the same modal categories (and thus to the same pieces)
+    for (descr_pcs, _), (descr_mode_degrees, _) in zip(results_pcs, results_mode_degrees):
+        assert descr_pcs.modal_category is descr_mode_degrees.modal_category
+
+
+def test_run_plan_reports_memory_usage(plainchant_sequence_pieces, tmpdir):
+    musicxml_path = os.path.dirname(plainchant_sequence_pieces[0].filename_full)
+    cfg = ChantStatsConfig(musicxml_paths={"plainchant_sequences": musicxml_path})
+    plan = RunPlan(["plainchant_sequences"], ["pc_freqs"], modes=["final"], units=["pcs"], cache=None)
+    report_filename = str(tmpdir.join("report.json"))
+    plan.run(cfg, instrumentation_report=report_filename, track_memory=True, top_allocation_sites=3)
+    assert not instrumentation.enabled and instrumentation.memory is None
+
+    with open(report_filename) as f:
+        memory = json.load(f)["memory"]
+    assert memory["stages"]["run_plan.results"]["count"] == 1
+    assert 0 < len(memory["top_allocation_sites"]) <= 3
+    assert memory["overhead"]["seconds"] > 0
+
+
+def test_run_plan_without_output_root_dir_is_profiled_if_requested_by_env(monkeypatch, tmp_path):
+    (tmp_path / "sequences").mkdir()
+    cfg = ChantStatsConfig(musicxml_paths={"plainchant_sequences": str(tmp_path / "sequences")})
+    plan = RunPlan(["plainchant_sequences"], ["pc_freqs"], modes=["final"], units=["pcs"], cache=None)
+    with pytest.raises(ValueError, match="Profiling requires an output root directory"):
+        plan.run(cfg, profile=True)
+
+    monkeypatch.setenv("CHANTSTATS_PROFILE", "1")
+    monkeypatch.chdir(tmp_path)
+    plan.run(cfg)
+    assert os.path.exists(tmp_path / "profiles" / "stacks.collapsed")
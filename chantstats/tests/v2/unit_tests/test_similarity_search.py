@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from scipy.spatial.distance import squareform
+from .context import chantstats, make_phrase
+from chantstats.v2.dendrogram.distance_metrics import calculate_chi_square_distances
+from chantstats.v2.similarity_search import SimilarityIndex
+
+
+@pytest.fixture
+def phrases():
+    return [
+        make_phrase(["D4", "E4", "F4", "E4", "D4", "D4"], descr="phrase_1", cache_key=None),
+        make_phrase(["D4", "E4", "F4", "G4", "E4", "D4"], descr="phrase_2", cache_key=None),
+        make_phrase(["G4", "A4", "B4", "C5", "B4", "A4", "G4"], descr="phrase_3", cache_key=None),
+        make_phrase(["D4", "F4", "E4", "D4", "E4", "D4", "D4"], descr="phrase_4", cache_key=None),
+        make_phrase(["G4", "B4", "A4", "G4", "C5", "G4"], descr="phrase_5", cache_key=None),
+    ]
+
+
+def test_find_similar_items(phrases):
+    index = SimilarityIndex(phrases, cache=None)
+    df_freqs = index.get_frequencies_dataframe(analysis="pc_freqs", unit="pcs")
+    assert list(df_freqs.index) == [p.descr for p in phrases]
+    np.testing.assert_allclose(df_freqs.sum(axis=1), 100.0)
+
+    distances_expected = squareform(calculate_chi_square_distances(df_freqs.values))
+    similar = index.find_similar("phrase_1", "pc_freqs", "pcs", k=3)
+    assert len(similar) == 3
+    assert "phrase_1" not in similar.index
+    assert similar.is_monotonic_increasing
+    expected_order = [df_freqs.index[i] for i in np.argsort(distances_expected[0], kind="stable") if i != 0]
+    assert list(similar.index) == expected_order[:3]
+    np.testing.assert_allclose(
+        similar.values, [distances_expected[0, df_freqs.index.get_loc(d)] for d in similar.index]
+    )
+
+    # Asking for more items than there are returns all other items
+    assert len(index.find_similar("phrase_3", "pc_freqs", "mode_degrees", k=10)) == 4
+
+
+def test_find_similar_to_frequencies(phrases):
+    index = SimilarityIndex(phrases, metric="hellinger", cache=None)
+    df_freqs = index.get_frequencies_dataframe(analysis="pc_freqs", unit="pcs")
+    similar = index.find_similar_to_frequencies(df_freqs.loc["phrase_5"], "pc_freqs", "pcs", k=2)
+    assert similar.index[0] == "phrase_5"
+    assert similar.iloc[0] == pytest.approx(0.0, abs=1e-7)
+
+
+def test_invalid_queries(phrases):
+    index = SimilarityIndex(phrases + [make_phrase(["D4", "E4"], descr="phrase_1", cache_key=None)], cache=None)
+    with pytest.raises(ValueError, match="not unique"):
+        index.find_similar("phrase_1", "pc_freqs", "pcs")
+    with pytest.raises(ValueError, match="not found"):
+        index.find_similar("phrase_99", "pc_freqs", "pcs")
+    with pytest.raises(ValueError, match="Invalid distance metric"):
+        SimilarityIndex(phrases, metric="foobar")
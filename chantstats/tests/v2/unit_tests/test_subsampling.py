@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from .context import chantstats
+from chantstats.v2.subsampling import Subsampler
+from chantstats.v2.utils import get_subsample
+
+
+def test_subsample_is_reproducible_and_sorted():
+    values = [7, 3, 9, 1, 4, 8, 2, 6, 5, 0]
+    subsampler = Subsampler(values)
+
+    subsample = subsampler.get_subsample(0.5, seed=12345)
+    assert len(subsample) == 5
+    assert subsample == sorted(subsample)
+    assert set(subsample).issubset(values)
+    assert subsample == subsampler.get_subsample(0.5, seed=12345)
+    assert subsample == get_subsample(values, 0.5, seed=12345)
+
+
+def test_subsample_does_not_depend_on_global_random_state():
+    subsampler = Subsampler(list(range(100)))
+    np.random.seed(0)
+    indices_1 = subsampler.get_indices(0.3, seed=42)
+    np.random.seed(1)
+    indices_2 = subsampler.get_indices(0.3, seed=42)
+    np.testing.assert_array_equal(indices_1, indices_2)
+
+
+def test_same_subsample_as_with_global_seed():
+    # Sub-samples should be the same as those produced by `np.random.seed()` in
+    # previous versions, so that results for a given seed are reproducible.
+    values = list(range(20))
+    np.random.seed(99999)
+    expected = sorted(np.random.permutation(len(values))[:15])
+    assert Subsampler(values).get_subsample(0.75, seed=99999) == expected
+
+
+def test_full_sample_keeps_original_order():
+    values = [3, 1, 2]
+    assert Subsampler(values).get_subsample(1.0, seed=None) == [3, 1, 2]
+    with pytest.raises(ValueError, match="Must provide a sampling seed"):
+        Subsampler(values).get_subsample(0.5, seed=None)
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+from pandas.testing import assert_series_equal
+from types import SimpleNamespace
+from .context import chantstats, make_phrase
+from chantstats.v2 import ChantStatsConfig, calculate_results
+from chantstats.v2.analysis_functions import (
+    calculate_counts_for_units,
+    calculate_result_from_counts,
+    get_analysis_function,
+    get_units_for_analysis,
+)
+from chantstats.v2.repertoire_and_genre import RepertoireAndGenreType
+from chantstats.v2.run_plan import RunPlan
+from chantstats.v2.unit import UnitType
+from chantstats.v2.vertical_intervals import (
+    VerticalInterval,
+    SimpleVerticalInterval,
+    calculate_vertical_intervals,
+    calculate_vertical_interval_counts,
+)
+
+
+def test_vertical_intervals_use_forward_filled_tenor():
+    nan = np.nan
+    duplum_pitches = [67.0, 69.0, nan, 71.0, 62.0, 64.0, nan]
+    tenor_pitches = [nan, 60.0, 60.0, nan, 64.0, nan, 62.0]
+
+    # the first duplum note sounds before the first tenor note and is skipped, as
+    # are the rows where only the tenor has a note; the duplum crosses the tenor at 62
+    intervals = calculate_vertical_intervals(duplum_pitches, tenor_pitches)
+    assert intervals.tolist() == [9, 11, -2, 0]
+    assert intervals.dtype == int
+
+    assert calculate_vertical_intervals([], []).tolist() == []
+
+
+def test_vertical_interval_counts():
+    item = SimpleNamespace(vertical_intervals=np.array([7, 7, 12, 19, -2, 0]))
+
+    counts = calculate_vertical_interval_counts(item)
+    assert counts == {
+        VerticalInterval(7): 2,
+        VerticalInterval(12): 1,
+        VerticalInterval(19): 1,
+        VerticalInterval(-2): 1,
+        VerticalInterval(0): 1,
+    }
+
+    counts = calculate_vertical_interval_counts(item, simple=True)
+    assert counts == {SimpleVerticalInterval(7): 3, SimpleVerticalInterval(0): 2, SimpleVerticalInterval(2): 1}
+    assert [x.str_value for x in sorted(counts)] == ["P1", "M2", "P5"]
+
+
+def test_vertical_intervals_out_of_range_are_counted_separately():
+    item = SimpleNamespace(vertical_intervals=np.array([7, 30, -15, 24, -12]), descr="item_1")
+
+    counts = calculate_vertical_interval_counts(item)
+    assert counts == {
+        VerticalInterval(7): 1,
+        VerticalInterval(24): 1,
+        VerticalInterval(-12): 1,
+        VerticalInterval.OUT_OF_RANGE: 2,
+    }
+    assert [x.str_value for x in sorted(counts)] == ["-12", "+7", "+24", "out_of_range"]
+    assert VerticalInterval.allowed_values[-1] == VerticalInterval.OUT_OF_RANGE
+
+    # Simple intervals are always in range
+    counts = calculate_vertical_interval_counts(item, simple=True)
+    assert counts == {
+        SimpleVerticalInterval(7): 1,
+        SimpleVerticalInterval(6): 1,
+        SimpleVerticalInterval(3): 1,
+        SimpleVerticalInterval(0): 2,
+    }
+
+
+def test_vertical_interval_counts_with_invalid_input():
+
+    with pytest.raises(NotImplementedError):
+        calculate_vertical_interval_counts(make_phrase(["D4", "F4", "D4"]))
+
+
+@pytest.mark.parametrize("analysis", ["vertical_intervals__semitones", "vertical_intervals__simple_intervals"])
+def test_vertical_interval_results_derived_from_counts_are_identical_to_direct_calculation(analysis):
+    item = SimpleNamespace(vertical_intervals=np.array([7, 5, 7, 12, 9, -1, 7, 0]))
+    analysis_func = get_analysis_function(analysis)
+    counts = calculate_counts_for_units(item, analysis=analysis, units=["pcs", "mode_degrees"])
+
+    for unit in ["pcs", "mode_degrees"]:
+        result_expected = analysis_func(item, unit=unit)
+        result = calculate_result_from_counts(counts[unit], analysis=analysis, unit=unit)
+        assert_series_equal(result_expected, result)
+        assert result.sum() == pytest.approx(100)
+
+
+@pytest.mark.parametrize("analysis", ["vertical_intervals__semitones", "vertical_intervals__simple_intervals"])
+def test_vertical_interval_analyses_are_rejected_for_chant_and_only_calculated_for_pcs(
+    analysis, plainchant_sequence_pieces, tmp_path
+):
+    with pytest.raises(ValueError, match="only defined for organum"):
+        calculate_results(pieces=plainchant_sequence_pieces, analysis=analysis, sampling_fraction=1.0, sampling_seed=0)
+
+    cfg = ChantStatsConfig(musicxml_paths={rep: str(tmp_path) for rep in RepertoireAndGenreType})
+    with pytest.raises(ValueError, match="only defined for organum"):
+        RunPlan(["organum_phrases", "responsorial_chants"], [analysis]).compile(cfg)
+
+    graph = RunPlan(["organum_pieces", "organum_phrases"], [analysis]).compile(cfg)
+    assert [stage.key[4] for stage in graph if stage.kind == "results"] == [UnitType.PCS, UnitType.PCS]
+    assert get_units_for_analysis(analysis, ["pcs", "mode_degrees"]) == [UnitType.PCS]
+    with pytest.raises(ValueError, match="only calculated for unit='pcs'"):
+        get_units_for_analysis(analysis, ["mode_degrees"])